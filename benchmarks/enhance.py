@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+"""
+Benchmark insoundzAPI and AudioEnhancer against the local fake server (see
+fake_server.py), which runs in its own process so it doesn't skew the
+timings or the memory use of the client.
+
+Scenarios:
+    api         The latency of single API calls.
+    phases      The latency of every phase of a single enhancement (session
+                request, upload, processing, download) and its status polls.
+    enhance     The end-to-end latency of AudioEnhancer.enhance_file().
+    batch       The throughput of AudioEnhancer.enhance_many() for every
+                concurrency level.
+    ordering    The completion latency of a batch that mixes short and long
+                files under every job order ('fifo', 'sjf'), against a
+                server with a limited bandwidth whose processing time
+                follows the file size.
+    push        The end-to-end latency and the status polls of
+                AudioEnhancer.enhance_file() when it polls the status at
+                the default interval, and when the server notifies a
+                CallbackListener.
+
+Every scenario also reports the peak memory that the client allocated.
+The results are flat "<scenario>.<metric>" values, so that runs of
+different releases (with the same options) can be compared:
+
+    python benchmarks/enhance.py --output baseline.json
+    python benchmarks/enhance.py --compare baseline.json --threshold 0.2
+
+A comparison exits with a non-zero status if a metric regressed by more
+than the threshold.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import urllib.request
+from insoundz_api import version
+from insoundz_api.api import insoundzAPI
+from insoundz_api.enhancer import AudioEnhancer
+from insoundz_api.helpers import upload_file, download_file
+
+DEFAULT_FILES = 16
+DEFAULT_FILE_SIZE_KB = 1024
+DEFAULT_CONCURRENCY = "1,4,8"
+DEFAULT_ORDERS = "fifo,sjf"
+DEFAULT_ORDERING_CONCURRENCY = 2
+DEFAULT_ORDERING_BANDWIDTH_MBPS = 8
+DEFAULT_ORDERING_PROCESSING_PER_MB = 0.25
+# Every fourth file of the ordering scenario is this many times larger
+LONG_FILE_FACTOR = 8
+DEFAULT_PUSH_FILES = 8
+DEFAULT_API_REPEAT = 50
+DEFAULT_PHASES_REPEAT = 5
+DEFAULT_STATUS_INTERVAL_SEC = 0.1
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_SEED = 0
+
+FAKE_SERVER = os.path.join(os.path.dirname(__file__), "fake_server.py")
+
+
+class FakeServerProcess(object):
+    """
+    Run fake_server.py in a child process.
+    """
+    def __init__(self, args):
+        self._process = subprocess.Popen(
+            [sys.executable, FAKE_SERVER] + args,
+            stdout=subprocess.PIPE, text=True
+        )
+        self.endpoint_url = self._process.stdout.readline().strip()
+        if not self.endpoint_url:
+            raise Exception("The fake server didn't start")
+
+    def _call(self, method, path):
+        request = urllib.request.Request(
+            f"http://{self.endpoint_url}{path}", method=method
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._call("GET", "/_stats")
+
+    def reset_stats(self):
+        self._call("POST", "/_stats/reset")
+
+    def close(self):
+        self._process.terminate()
+        self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def summarize(name, values):
+    """
+    Return the p50, p95 and mean of <values> [sec] in milliseconds.
+    """
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {
+        f"{name}.p50_ms": statistics.median(values) * 1000,
+        f"{name}.p95_ms": p95 * 1000,
+        f"{name}.mean_ms": statistics.mean(values) * 1000,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start_time, result
+
+
+def make_sources(folder, count, size, seed, sizes=None):
+    rng = random.Random(seed)
+    sources = []
+    for number in range(count):
+        if sizes:
+            size = sizes[number]
+        path = os.path.join(folder, f"source_{number:04d}.wav")
+        with open(path, "wb") as fd:
+            fd.write(rng.getrandbits(size * 8).to_bytes(size, "little"))
+        sources.append(path)
+    return sources
+
+
+def make_mixed_sources(folder, count, size, seed):
+    """
+    Sources of which every fourth is LONG_FILE_FACTOR times larger, starting
+    with a long one, so short files queue behind long ones.
+    """
+    sizes = [
+        size * LONG_FILE_FACTOR if number % 4 == 0 else size
+        for number in range(count)
+    ]
+    return make_sources(folder, count, size, seed, sizes)
+
+
+def polls(stats):
+    return stats.get("status", 0) + stats.get("bulk_status", 0)
+
+
+def bench_api(server, options):
+    results = {}
+    with insoundzAPI(
+        "benchmark", "benchmark", server.endpoint_url, scheme="http"
+    ) as api:
+        api.authenticate()
+
+        times = [
+            timed(api.account_token, "benchmark", "benchmark")[0]
+            for _ in range(options.api_repeat)
+        ]
+        results.update(summarize("account_token", times))
+
+        times = []
+        sids = []
+        for _ in range(options.api_repeat):
+            elapsed, (sid, _) = timed(api.enhance_file)
+            times.append(elapsed)
+            sids.append(sid)
+        results.update(summarize("enhance_file", times))
+
+        times = [timed(api.enhance_status, sid)[0] for sid in sids]
+        results.update(summarize("enhance_status", times))
+
+        elapsed, _ = timed(api.enhance_status_bulk, sids)
+        results["enhance_status_bulk.ms"] = elapsed * 1000
+    return results
+
+
+def bench_phases(server, options, sources, folder):
+    phases = {"request": [], "upload": [], "processing": [], "download": []}
+    poll_counts = []
+    with insoundzAPI(
+        "benchmark", "benchmark", server.endpoint_url, scheme="http"
+    ) as api:
+        api.authenticate()
+        for src in sources[:options.phases_repeat]:
+            elapsed, (sid, upload_url) = timed(api.enhance_file)
+            phases["request"].append(elapsed)
+
+            elapsed, _ = timed(
+                upload_file, src, upload_url, session=api.session
+            )
+            phases["upload"].append(elapsed)
+
+            start_time = time.perf_counter()
+            count = 0
+            while True:
+                count += 1
+                status, url = api.enhance_status(sid)
+                if status != "processing":
+                    break
+                time.sleep(options.status_interval)
+            phases["processing"].append(time.perf_counter() - start_time)
+            poll_counts.append(count)
+
+            dst = os.path.join(folder, os.path.basename(src))
+            elapsed, _ = timed(download_file, url, dst, session=api.session)
+            phases["download"].append(elapsed)
+
+    results = {}
+    for name, times in phases.items():
+        results.update(summarize(name, times))
+    results["polls_per_file"] = statistics.mean(poll_counts)
+    return results
+
+
+def _enhancer(server, **kwargs):
+    return AudioEnhancer(
+        "benchmark", "benchmark", server.endpoint_url, scheme="http",
+        log_stream=open(os.devnull, "w"), **kwargs
+    )
+
+
+def bench_enhance(server, options, sources, folder):
+    times = []
+    with _enhancer(server) as enhancer:
+        server.reset_stats()
+        for src in sources[:options.phases_repeat]:
+            dst = os.path.join(folder, os.path.basename(src))
+            elapsed, _ = timed(
+                enhancer.enhance_file, src, dst=dst,
+                status_interval_sec=options.status_interval
+            )
+            times.append(elapsed)
+        stats = server.stats()
+
+    results = summarize("latency", times)
+    results["polls_per_file"] = polls(stats) / len(times)
+    return results
+
+
+def bench_batch(server, options, sources, folder, concurrency):
+    with _enhancer(
+        server, pool_maxsize=concurrency * 5 + 1
+    ) as enhancer:
+        server.reset_stats()
+        start_time = time.perf_counter()
+        batch = enhancer.enhance_many(
+            sources, dst=folder, max_workers=concurrency,
+            status_interval_sec=options.status_interval
+        )
+        latencies = [result.elapsed for result in batch]
+        elapsed = time.perf_counter() - start_time
+        stats = server.stats()
+
+    size = sum(os.path.getsize(src) for src in sources)
+    results = summarize("latency", latencies)
+    results.update({
+        "files_per_sec": len(sources) / elapsed,
+        "mb_per_sec": 2 * size / elapsed / 1024 / 1024,
+        "polls_per_file": polls(stats) / len(sources),
+        "failures": batch.stats.failures,
+    })
+    return results
+
+
+def bench_ordering(server, options, sources, folder, order):
+    short_size = min(os.path.getsize(src) for src in sources)
+    with _enhancer(
+        server, pool_maxsize=options.ordering_concurrency * 5 + 1
+    ) as enhancer:
+        batch = enhancer.enhance_many(
+            sources, dst=folder, max_workers=options.ordering_concurrency,
+            status_interval_sec=options.status_interval, order=order
+        )
+        # The results are created as the batch is fed, so their elapsed
+        # time is the completion latency of every file
+        results = list(batch)
+
+    short, long = [], []
+    for result in results:
+        if os.path.getsize(result.src) == short_size:
+            short.append(result.elapsed)
+        else:
+            long.append(result.elapsed)
+    latencies = short + long
+    summary = summarize("latency", latencies)
+    summary.update(summarize("short_latency", short))
+    summary.update(summarize("long_latency", long))
+    summary["failures"] = batch.stats.failures
+    return summary
+
+
+def bench_push(server, options, sources, folder, push):
+    times = []
+    with _enhancer(server, callback=push or None) as enhancer:
+        server.reset_stats()
+        for number, src in enumerate(sources[:options.push_files]):
+            start_time = time.perf_counter()
+            enhancer.enhance_file(
+                src, dst=os.path.join(folder, f"push_{number}.wav"),
+                status_interval_sec=options.push_status_interval
+            )
+            times.append(time.perf_counter() - start_time)
+        stats = server.stats()
+
+    results = summarize("latency", times)
+    results["polls_per_file"] = polls(stats) / len(times)
+    return results
+
+
+def warm_up(server, options, sources, folder):
+    """
+    Enhance a file once before the scenarios, so that the first scenario
+    doesn't pay for lazy imports and first-time initialization.
+    """
+    with _enhancer(server) as enhancer:
+        enhancer.enhance_file(
+            sources[0], dst=os.path.join(folder, "warm_up.wav"),
+            status_interval_sec=options.status_interval
+        )
+        for _ in enhancer.enhance_many(
+            sources[:1], dst=folder,
+            status_interval_sec=options.status_interval
+        ):
+            pass
+
+
+def run_scenario(name, fn, *args):
+    """
+    Run a scenario while tracing the memory the client allocates.
+    """
+    print(f"Running {name}...", file=sys.stderr)
+    tracemalloc.start()
+    try:
+        results = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    results["peak_memory_mb"] = peak / 1024 / 1024
+    return {f"{name}.{metric}": value for metric, value in results.items()}
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_sec")
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every metric from <baseline>, and return the
+    metrics which regressed by more than <threshold>.
+    """
+    regressions = []
+    for metric, value in results.items():
+        base = baseline.get(metric)
+        if not base:
+            continue
+        change = (value - base) / base
+        regressed = -change if higher_is_better(metric) else change
+        flag = ""
+        if regressed > threshold:
+            flag = "  REGRESSION"
+            regressions.append(metric)
+        print(
+            f"{metric:<40}{base:12.2f}{value:12.2f}{change:+9.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES)
+    parser.add_argument(
+        "--file-size-kb", type=int, default=DEFAULT_FILE_SIZE_KB
+    )
+    parser.add_argument(
+        "--concurrency", default=DEFAULT_CONCURRENCY,
+        help="Comma separated concurrency levels of the batch scenario."
+    )
+    parser.add_argument(
+        "--orders", default=DEFAULT_ORDERS,
+        help="Comma separated job orders of the ordering scenario."
+    )
+    parser.add_argument(
+        "--ordering-concurrency", type=int,
+        default=DEFAULT_ORDERING_CONCURRENCY
+    )
+    parser.add_argument(
+        "--ordering-bandwidth-mbps", type=float,
+        default=DEFAULT_ORDERING_BANDWIDTH_MBPS
+    )
+    parser.add_argument(
+        "--ordering-processing-per-mb", type=float,
+        default=DEFAULT_ORDERING_PROCESSING_PER_MB
+    )
+    parser.add_argument(
+        "--push-files", type=int, default=DEFAULT_PUSH_FILES
+    )
+    parser.add_argument(
+        "--push-status-interval", type=float,
+        default=AudioEnhancer.get_default_status_interval(),
+        help="The status interval of the push scenario [sec], the default "
+             "interval of the enhancer."
+    )
+    parser.add_argument(
+        "--api-repeat", type=int, default=DEFAULT_API_REPEAT
+    )
+    parser.add_argument(
+        "--phases-repeat", type=int, default=DEFAULT_PHASES_REPEAT
+    )
+    parser.add_argument(
+        "--status-interval", type=float, default=DEFAULT_STATUS_INTERVAL_SEC
+    )
+    parser.add_argument(
+        "--scenarios", default="api,phases,enhance,batch,ordering,push",
+        help="Comma separated scenarios to run."
+    )
+    parser.add_argument("--processing-delay", type=float, default=0.5)
+    parser.add_argument("--bandwidth-mbps", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help="Write the results to a JSON file.")
+    parser.add_argument(
+        "--compare", help="Compare the results to a previous JSON file."
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="The relative change of a metric that is a regression."
+    )
+    options = parser.parse_args()
+
+    server_args = [
+        "--processing-delay", str(options.processing_delay),
+        "--error-rate", str(options.error_rate),
+        "--seed", str(options.seed),
+    ]
+    if options.bandwidth_mbps:
+        server_args += ["--bandwidth-mbps", str(options.bandwidth_mbps)]
+
+    scenarios = options.scenarios.split(",")
+    results = {}
+    folder = tempfile.mkdtemp(prefix="insoundz_bench")
+    sources = make_sources(
+        tempfile.mkdtemp(dir=folder), options.files,
+        options.file_size_kb * 1024, options.seed
+    )
+
+    with FakeServerProcess(server_args) as server:
+        warm_up(server, options, sources, tempfile.mkdtemp(dir=folder))
+        if "api" in scenarios:
+            results.update(run_scenario("api", bench_api, server, options))
+        if "phases" in scenarios:
+            results.update(run_scenario(
+                "phases", bench_phases, server, options, sources,
+                tempfile.mkdtemp(dir=folder)
+            ))
+        if "enhance" in scenarios:
+            results.update(run_scenario(
+                "enhance", bench_enhance, server, options, sources,
+                tempfile.mkdtemp(dir=folder)
+            ))
+        if "batch" in scenarios:
+            for concurrency in map(int, options.concurrency.split(",")):
+                results.update(run_scenario(
+                    f"batch_{concurrency}", bench_batch, server, options,
+                    sources, tempfile.mkdtemp(dir=folder), concurrency
+                ))
+
+        if "push" in scenarios:
+            for push in (False, True):
+                results.update(run_scenario(
+                    "push_callback" if push else "push_polling", bench_push,
+                    server, options, sources, tempfile.mkdtemp(dir=folder),
+                    push
+                ))
+
+    if "ordering" in scenarios:
+        mixed = make_mixed_sources(
+            tempfile.mkdtemp(dir=folder), options.files,
+            options.file_size_kb * 1024, options.seed
+        )
+        ordering_args = server_args + [
+            "--bandwidth-mbps", str(options.ordering_bandwidth_mbps),
+            "--processing-per-mb", str(options.ordering_processing_per_mb),
+        ]
+        with FakeServerProcess(ordering_args) as server:
+            warm_up(server, options, mixed, tempfile.mkdtemp(dir=folder))
+            for order in options.orders.split(","):
+                results.update(run_scenario(
+                    f"ordering_{order}", bench_ordering, server, options,
+                    mixed, tempfile.mkdtemp(dir=folder), order
+                ))
+
+    report = {
+        "meta": {
+            "insoundz_api": version.string(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "options": vars(options),
+        "results": results,
+    }
+
+    for metric, value in results.items():
+        print(f"{metric:<40}{value:12.2f}")
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as fd:
+            json.dump(report, fd, indent=2)
+
+    if options.compare:
+        with open(options.compare, "r", encoding="utf-8") as fd:
+            baseline = json.load(fd)
+        # Metrics of other scenarios or concurrency levels aren't compared
+        ignored = (
+            "output", "compare", "threshold", "scenarios", "concurrency",
+            "orders"
+        )
+        differ = [
+            name for name, value in baseline["options"].items()
+            if name not in ignored and report["options"].get(name) != value
+        ]
+        if differ:
+            print(f"Warning: the baseline ran with different options "
+                  f"({', '.join(differ)}), the results aren't comparable")
+        print()
+        print(f"{'metric':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+        regressions = compare(results, baseline["results"], options.threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than "
+                  f"{options.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
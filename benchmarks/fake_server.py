@@ -0,0 +1,650 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the insoundz API server, for benchmarks and manual
+testing without an account (and without paying for enhancements).
+
+It implements the account token, enhance, status (single and bulk),
+balance and version endpoints, and serves the upload URLs (single PUT and
+multipart) and the download URLs (with Range requests) itself. The
+"enhanced" file is the uploaded file as is.
+
+The processing delay, the bandwidth of every transfer, the rate of failed
+requests and the lifetime of account tokens are configurable, so that
+benchmarks run against a predictable server. So are the account limits:
+the balance (charged per uploaded MB, uploads it can't cover get a 402),
+the rate of session starts and the number of concurrent sessions (excess
+session starts get a 429).
+
+Sessions which are started with a "callback_url" are notified (POST of
+their final status) once they are processed; a share of the callbacks
+can be lost on purpose, to exercise the polling fallback of the client.
+
+    python benchmarks/fake_server.py --port 8080 --processing-delay 2
+
+    enhancer = AudioEnhancer("id", "secret", "127.0.0.1:8080", scheme="http")
+
+Counters of every endpoint are served as JSON at GET /_stats, and are reset
+by POST /_stats/reset.
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib.request
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PROCESSING_DELAY_SEC = 0.5
+DEFAULT_TOKEN_TTL_SEC = 3600
+DEFAULT_BALANCE = 1000
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_CALLBACK_TIMEOUT_SEC = 10
+VERSION = "v1"
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class _Session(object):
+    def __init__(self, sid, retention=None, preset=None, callback_url=None):
+        self.sid = sid
+        self.retention = retention
+        self.preset = preset
+        self.callback_url = callback_url
+        self.parts = {}
+        self.data = None
+        self.uploaded_at = None
+
+
+class FakeInsoundzServer(object):
+    """
+    A threaded HTTP server which behaves like the insoundz API.
+    """
+    def __init__(
+        self, host=DEFAULT_HOST, port=0,
+        processing_delay_sec=DEFAULT_PROCESSING_DELAY_SEC,
+        processing_sec_per_mb=0.0, bandwidth=None, error_rate=0.0,
+        token_ttl_sec=DEFAULT_TOKEN_TTL_SEC, multipart=True,
+        bulk_status=True, seed=None, balance=DEFAULT_BALANCE,
+        credits_per_mb=0.0, rate_limit=None, max_sessions=None,
+        callback_loss_rate=0.0
+    ):
+        """
+        :param str   host:                  The address to listen on.
+        :param int   port:                  The port to listen on, 0 for any
+                                            free port.
+        :param float processing_delay_sec:  How long a session is processed
+                                            after its upload is complete.
+        :param float processing_sec_per_mb: Extra processing time per MB of
+                                            the uploaded file.
+        :param int   bandwidth:             The bandwidth of every upload and
+                                            download [bytes/sec], or None for
+                                            no limit.
+        :param float error_rate:            The probability of a 503
+                                            response to a status, upload or
+                                            download request.
+        :param float token_ttl_sec:         The lifetime of account tokens.
+        :param bool  multipart:             If set, large files get part
+                                            URLs when a part size is asked.
+        :param bool  bulk_status:           If set, the bulk status
+                                            endpoint is available.
+        :param int   seed:                  The seed of the random errors.
+        :param float balance:               The initial balance [credits].
+        :param float credits_per_mb:        The charge of every uploaded MB.
+        :param float rate_limit:            The maximal number of session
+                                            starts per second, or None for
+                                            no limit.
+        :param int   max_sessions:          The maximal number of sessions
+                                            that are uploaded or processed
+                                            at once, or None for no limit.
+        :param float callback_loss_rate:    The probability that the
+                                            callback of a session isn't
+                                            sent.
+        """
+        self.processing_delay_sec = processing_delay_sec
+        self.processing_sec_per_mb = processing_sec_per_mb
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.token_ttl_sec = token_ttl_sec
+        self.multipart = multipart
+        self.bulk_status = bulk_status
+        self.balance = balance
+        self.credits_per_mb = credits_per_mb
+        self.rate_limit = rate_limit
+        self.max_sessions = max_sessions
+        self.callback_loss_rate = callback_loss_rate
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._tokens = {}
+        self._stats = {}
+        self._starts = []
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        """
+        The endpoint (without a scheme) to pass to the client.
+        """
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True,
+            name="insoundz-fake-server"
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self.close()
+
+    def close(self):
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        expires = time.time() + self.token_ttl_sec
+        with self._lock:
+            self._tokens[token] = expires
+        return token, expires
+
+    def is_authorized(self, token):
+        with self._lock:
+            expires = self._tokens.get(token)
+        return expires is not None and expires > time.time()
+
+    def throttle_session(self):
+        """
+        Count a session start against the account limits. Returns the
+        error status if it exceeds them, otherwise None.
+        """
+        now = time.time()
+        with self._lock:
+            if self.rate_limit:
+                self._starts = [t for t in self._starts if now - t < 1]
+                if len(self._starts) >= self.rate_limit:
+                    return HTTPStatus.TOO_MANY_REQUESTS
+            active = sum(
+                1 for session in self._sessions.values()
+                if not self.is_done(session)
+            )
+            if self.max_sessions and active >= self.max_sessions:
+                return HTTPStatus.TOO_MANY_REQUESTS
+            if self.balance <= 0:
+                return HTTPStatus.PAYMENT_REQUIRED
+            self._starts.append(now)
+            self._stats["peak_sessions"] = max(
+                self._stats.get("peak_sessions", 0), active + 1
+            )
+        return None
+
+    def new_session(self, retention=None, preset=None, callback_url=None):
+        session = _Session(uuid.uuid4().hex, retention, preset, callback_url)
+        with self._lock:
+            self._sessions[session.sid] = session
+        return session
+
+    def get_session(self, sid):
+        with self._lock:
+            return self._sessions.get(sid)
+
+    def uploaded(self, session, data):
+        """
+        Charge the balance for <data> and start processing it. Returns
+        False if the balance doesn't cover it.
+        """
+        cost = self.credits_per_mb * len(data) / 1024 / 1024
+        with self._lock:
+            if cost > self.balance:
+                return False
+            self.balance -= cost
+        session.data = data
+        session.parts = {}
+        session.uploaded_at = time.time()
+        if session.callback_url:
+            timer = threading.Timer(
+                self.processing_sec(session), self.send_callback, (session,)
+            )
+            timer.daemon = True
+            timer.start()
+        return True
+
+    def processing_sec(self, session):
+        return self.processing_delay_sec + \
+            self.processing_sec_per_mb * len(session.data) / 1024 / 1024
+
+    def is_done(self, session):
+        if session.uploaded_at is None:
+            return False
+        return time.time() >= \
+            session.uploaded_at + self.processing_sec(session)
+
+    def send_callback(self, session):
+        """
+        Notify the callback URL of <session> that it's done.
+        """
+        if self.callback_loss_rate:
+            with self._lock:
+                lost = self._random.random() < self.callback_loss_rate
+            if lost:
+                self.count("callback_lost")
+                return
+
+        body = json.dumps({
+            "session_id": session.sid,
+            "status": "done",
+            "url": f"http://{self.endpoint_url}/download/{session.sid}",
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            session.callback_url, data=body, method="POST",
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(
+                request, timeout=DEFAULT_CALLBACK_TIMEOUT_SEC
+            ) as response:
+                response.read()
+        except (OSError, ValueError):
+            self.count("callback_error")
+        else:
+            self.count("callback")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are separate writes
+    disable_nagle_algorithm = True
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        pass
+
+    def _base_url(self):
+        return f"http://{self.headers['Host']}"
+
+    def _send_json(self, obj, status=HTTPStatus.OK, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status):
+        self.fake.count(f"error_{int(status)}")
+        self._send_json({"msg": status.phrase}, status)
+
+    def _throttle(self, start_time, length):
+        if self.fake.bandwidth:
+            delay = length / self.fake.bandwidth - (time.time() - start_time)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _read_body(self):
+        start_time = time.time()
+        chunks = []
+        length = 0
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                length += size
+                self._throttle(start_time, length)
+        else:
+            remaining = int(self.headers.get("Content-Length") or 0)
+            while remaining:
+                chunk = self.rfile.read(min(DEFAULT_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+                length += len(chunk)
+                self._throttle(start_time, length)
+        return b"".join(chunks)
+
+    def _read_json(self):
+        body = self._read_body()
+        return json.loads(body) if body else {}
+
+    def _authorized(self):
+        if self.fake.is_authorized(self.headers.get("Authorization")):
+            return True
+        self._send_error(HTTPStatus.UNAUTHORIZED)
+        return False
+
+    def _status(self, session):
+        if self.fake.is_done(session):
+            return {
+                "status": "done",
+                "url": f"{self._base_url()}/download/{session.sid}",
+            }
+        return {"status": "processing"}
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+
+        if path == f"/{VERSION}/account/token":
+            self._read_json()
+            self.fake.count("token")
+            token, expires = self.fake.issue_token()
+            return self._send_json({"token": token, "expires": expires})
+
+        if path == f"/{VERSION}/enhance":
+            request = self._read_json()
+            if not self._authorized():
+                return
+            self.fake.count("enhance")
+            error = self.fake.throttle_session()
+            if error:
+                return self._send_error(error)
+            return self._enhance(request)
+
+        if path == f"/{VERSION}/enhance/status":
+            request = self._read_json()
+            if not self.fake.bulk_status:
+                return self._send_error(HTTPStatus.NOT_FOUND)
+            if not self._authorized():
+                return
+            self.fake.count("bulk_status")
+            if self.fake.should_fail():
+                return self._send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+            sessions = {}
+            for sid in request.get("session_ids", []):
+                session = self.fake.get_session(sid)
+                if session:
+                    sessions[sid] = self._status(session)
+            return self._send_json({"sessions": sessions})
+
+        match = re.fullmatch(r"/upload/(\w+)/complete", path)
+        if match:
+            request = self._read_json()
+            session = self.fake.get_session(match.group(1))
+            if not session:
+                return self._send_error(HTTPStatus.NOT_FOUND)
+            self.fake.count("complete")
+            try:
+                data = b"".join(
+                    session.parts[part["part_number"]]
+                    for part in request["parts"]
+                )
+            except KeyError:
+                return self._send_error(HTTPStatus.BAD_REQUEST)
+            if not self.fake.uploaded(session, data):
+                return self._send_error(HTTPStatus.PAYMENT_REQUIRED)
+            return self._send_json({})
+
+        if path == "/_stats/reset":
+            self._read_body()
+            self.fake.reset_stats()
+            return self._send_json({})
+
+        self._read_body()
+        self._send_error(HTTPStatus.NOT_FOUND)
+
+    def _enhance(self, request):
+        session = self.fake.new_session(
+            request.get("retention"), request.get("preset"),
+            request.get("callback_url")
+        )
+        base_url = self._base_url()
+        response = {
+            "session_id": session.sid,
+            "upload_url": f"{base_url}/upload/{session.sid}",
+        }
+
+        file_size = request.get("file_size")
+        part_size = request.get("part_size")
+        if self.fake.multipart and file_size and part_size and \
+                file_size > part_size:
+            parts = -(-file_size // part_size)
+            response["part_size"] = part_size
+            response["part_urls"] = [
+                f"{base_url}/upload/{session.sid}/part/{number}"
+                for number in range(1, parts + 1)
+            ]
+            response["complete_url"] = \
+                f"{base_url}/upload/{session.sid}/complete"
+
+        self._send_json(response)
+
+    def do_PUT(self):
+        path = self.path.split("?")[0]
+        match = re.fullmatch(r"/upload/(\w+)(?:/part/(\d+))?", path)
+        if not match:
+            self._read_body()
+            return self._send_error(HTTPStatus.NOT_FOUND)
+
+        data = self._read_body()
+        session = self.fake.get_session(match.group(1))
+        if not session:
+            return self._send_error(HTTPStatus.NOT_FOUND)
+        if self.fake.should_fail():
+            return self._send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+
+        number = match.group(2)
+        if number is None:
+            self.fake.count("upload")
+            if not self.fake.uploaded(session, data):
+                return self._send_error(HTTPStatus.PAYMENT_REQUIRED)
+            return self._send_json({})
+
+        self.fake.count("upload_part")
+        session.parts[int(number)] = data
+        self._send_json({}, headers={"ETag": f'"{session.sid}-{number}"'})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+
+        if path == "/_stats":
+            return self._send_json(self.fake.stats())
+
+        if path == f"/{VERSION}/account/balance":
+            if not self._authorized():
+                return
+            self.fake.count("balance")
+            return self._send_json({"balance": self.fake.balance})
+
+        if path == f"/{VERSION}/version":
+            if not self._authorized():
+                return
+            return self._send_json({"version": "fake", "build": "0"})
+
+        match = re.fullmatch(rf"/{VERSION}/enhance/(\w+)", path)
+        if match:
+            if not self._authorized():
+                return
+            self.fake.count("status")
+            session = self.fake.get_session(match.group(1))
+            if not session:
+                return self._send_error(HTTPStatus.NOT_FOUND)
+            if self.fake.should_fail():
+                return self._send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+            return self._send_json(self._status(session))
+
+        match = re.fullmatch(r"/download/(\w+)", path)
+        if match:
+            session = self.fake.get_session(match.group(1))
+            if not session or not self.fake.is_done(session):
+                return self._send_error(HTTPStatus.NOT_FOUND)
+            if self.fake.should_fail():
+                return self._send_error(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.fake.count("download")
+            return self._download(session)
+
+        self._send_error(HTTPStatus.NOT_FOUND)
+
+    def do_HEAD(self):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _download(self, session):
+        data = session.data
+        start, end = 0, len(data) - 1
+        status = HTTPStatus.OK
+
+        match = _RANGE.fullmatch(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            if start > end:
+                return self._send_error(
+                    HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{session.sid}"')
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(data)}"
+            )
+        self.end_headers()
+
+        start_time = time.time()
+        view = memoryview(data)[start:end + 1]
+        for offset in range(0, len(view), DEFAULT_CHUNK_SIZE):
+            self.wfile.write(view[offset:offset + DEFAULT_CHUNK_SIZE])
+            self._throttle(
+                start_time, min(offset + DEFAULT_CHUNK_SIZE, len(view))
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="A local stand-in for the insoundz API server."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument(
+        "--processing-delay", type=float,
+        default=DEFAULT_PROCESSING_DELAY_SEC,
+        help="Processing time of every session [seconds]."
+    )
+    parser.add_argument(
+        "--processing-per-mb", type=float, default=0.0,
+        help="Extra processing time per MB [seconds]."
+    )
+    parser.add_argument(
+        "--bandwidth-mbps", type=float, default=None,
+        help="The bandwidth of every transfer [MB/s]."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="The probability of a 503 response to a status, upload or "
+             "download request."
+    )
+    parser.add_argument(
+        "--token-ttl", type=float, default=DEFAULT_TOKEN_TTL_SEC,
+        help="The lifetime of account tokens [seconds]."
+    )
+    parser.add_argument(
+        "--no-multipart", action="store_true",
+        help="Always upload with a single PUT."
+    )
+    parser.add_argument(
+        "--no-bulk-status", action="store_true",
+        help="Disable the bulk status endpoint."
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--balance", type=float, default=DEFAULT_BALANCE,
+        help="The initial balance [credits]."
+    )
+    parser.add_argument(
+        "--credits-per-mb", type=float, default=0.0,
+        help="The charge of every uploaded MB [credits]."
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, default=None,
+        help="The maximal number of session starts per second."
+    )
+    parser.add_argument(
+        "--max-sessions", type=int, default=None,
+        help="The maximal number of concurrent sessions."
+    )
+    parser.add_argument(
+        "--callback-loss-rate", type=float, default=0.0,
+        help="The probability that the callback of a session isn't sent."
+    )
+    args = parser.parse_args()
+
+    bandwidth = None
+    if args.bandwidth_mbps:
+        bandwidth = int(args.bandwidth_mbps * 1024 * 1024)
+
+    server = FakeInsoundzServer(
+        args.host, args.port,
+        processing_delay_sec=args.processing_delay,
+        processing_sec_per_mb=args.processing_per_mb,
+        bandwidth=bandwidth, error_rate=args.error_rate,
+        token_ttl_sec=args.token_ttl, multipart=not args.no_multipart,
+        bulk_status=not args.no_bulk_status, seed=args.seed,
+        balance=args.balance, credits_per_mb=args.credits_per_mb,
+        rate_limit=args.rate_limit, max_sessions=args.max_sessions,
+        callback_loss_rate=args.callback_loss_rate
+    )
+    print(server.endpoint_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Measure the startup cost of the insoundz_api package and the insoundz_cli
+command, and fail if it regresses beyond a budget.
+
+Every scenario runs in a fresh interpreter <runs> times; the median time,
+minus the time of a bare interpreter, is compared to its budget. A scenario
+also fails if it imports one of the heavy dependencies that should only be
+loaded by the code paths that need them.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 20 --budget-scale 1.5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+DEFAULT_RUNS = 10
+
+# Modules that must not be imported by a scenario
+HEAVY_MODULES = ("requests", "urllib3", "tqdm", "halo", "validators",
+                 "aiohttp")
+
+# (name, statement, budget [ms])
+SCENARIOS = (
+    ("import insoundz_api", "import insoundz_api", 20),
+    ("import insoundz_api.api", "import insoundz_api.api", 40),
+    (
+        "insoundz_cli --help",
+        "from insoundz_cli.cli import insoundz_cli\n"
+        "insoundz_cli(['--help'])",
+        100,
+    ),
+)
+
+_REPORT = """
+import sys, json
+try:
+{statement}
+except SystemExit:
+    pass
+sys.stderr.write("\\n" + json.dumps(sorted(
+    m for m in {heavy!r} if m in sys.modules
+)) + "\\n")
+"""
+
+
+def _script(statement):
+    indented = "\n".join("    " + line for line in statement.splitlines())
+    return _REPORT.format(statement=indented, heavy=HEAVY_MODULES)
+
+
+def _run(code, env):
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True
+    )
+    elapsed = time.perf_counter() - start_time
+    return elapsed, result.stderr.decode("utf-8")
+
+
+def measure(statement, runs, env):
+    """
+    Return the median time of <statement> [sec] and the heavy modules it
+    imported.
+    """
+    code = _script(statement)
+    times = []
+    heavy = []
+    for _ in range(runs):
+        elapsed, stderr = _run(code, env)
+        times.append(elapsed)
+        heavy = json.loads(stderr.strip().splitlines()[-1])
+    return statistics.median(times), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--runs", type=int, default=DEFAULT_RUNS,
+        help="The number of runs of every scenario."
+    )
+    parser.add_argument(
+        "--budget-scale", type=float, default=1.0,
+        help="Scale all the budgets, e.g. on slow CI machines."
+    )
+    args = parser.parse_args()
+
+    # Keep the CLI away from the user's credentials and config
+    env = dict(os.environ, HOME=tempfile.mkdtemp(prefix="insoundz_bench"))
+
+    baseline, _ = measure("pass", args.runs, env)
+    print(f"{'interpreter':<28}{baseline * 1000:8.1f} ms")
+
+    failed = False
+    for name, statement, budget in SCENARIOS:
+        elapsed, heavy = measure(statement, args.runs, env)
+        cost = (elapsed - baseline) * 1000
+        budget *= args.budget_scale
+
+        problems = []
+        if cost > budget:
+            problems.append(f"over the budget of {budget:.0f} ms")
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)}")
+        failed = failed or bool(problems)
+
+        status = "; ".join(problems) or "ok"
+        print(f"{name:<28}{cost:8.1f} ms  ({status})")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
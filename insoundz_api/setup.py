@@ -45,6 +45,12 @@ setup(
         'halo',
         'validators',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'compress': ['soundfile'],
+        'segment': ['numpy', 'soundfile'],
+        'watch': ['watchdog'],
+    },
     classifiers=[
         'Operating System :: OS Independent',
         'Intended Audience :: Developers',
@@ -1,8 +1,16 @@
-import requests
 from urllib.parse import urlunsplit
+from http import HTTPStatus
 import logging
+from insoundz_api.session import (
+    SessionPool, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+)
+from insoundz_api.tokens import (
+    TokenCache, TokenManager, DEFAULT_REFRESH_MARGIN_SEC
+)
+from insoundz_api.retry import get_retry_policy
 
 DEFAULT_ENDPOINT_URL = "api.insoundz.io"
+DEFAULT_SCHEME = "https"
 DEFAULT_ENHANCE_VERSION = "v1"
 DEFAULT_TIMEOUT_SEC = 30
 
@@ -16,24 +24,160 @@ class insoundzAPI(object):
             client_id,
             secret,
             endpoint_url=DEFAULT_ENDPOINT_URL,
-            logger=None):
+            logger=None,
+            pool_connections=DEFAULT_POOL_CONNECTIONS,
+            pool_maxsize=DEFAULT_POOL_MAXSIZE,
+            keep_alive=True,
+            prewarm=0,
+            session=None,
+            token_cache=None,
+            refresh_margin_sec=DEFAULT_REFRESH_MARGIN_SEC,
+            scheme=DEFAULT_SCHEME,
+            retry_policy=None):
+        """
+        :param str  client_id:          Client ID for insoundz API services.
+        :param str  secret:             Secret key for insoundz API services.
+        :param str  endpoint_url:       insoundz API endpoint (without the
+                                        'https://' prefix).
+        :param int  pool_connections:   The number of hosts to keep a
+                                        connection pool for.
+        :param int  pool_maxsize:       The maximal number of keep-alive
+                                        connections per host.
+        :param bool keep_alive:         If not set, connections are closed
+                                        after every request.
+        :param int  prewarm:            The number of connections to open to
+                                        the endpoint at construction.
+        :param SessionPool session:     An existing pool to share with other
+                                        clients. The pool is not closed by
+                                        close() in that case.
+        :param TokenCache token_cache:  A persistent account token cache,
+                                        or True for the default one
+                                        (~/.insoundz_tokens).
+                                        (This param is optional)
+        :param int  refresh_margin_sec: Refresh the account token this long
+                                        before it expires.
+        :param str  scheme:             The scheme of the endpoint, e.g.
+                                        'http' for a local test server.
+        :param RetryPolicy retry_policy:
+                                        Which failed requests are retried
+                                        and the request timeouts, or a
+                                        number of retries. The upload and
+                                        download helpers should share it.
+                                        (This param is optional)
+
+        The account token is retrieved lazily on the first request and is
+        refreshed in the background before it expires.
+        """
         self._headers = {
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
 
         self._endpoint_url = endpoint_url
-        auth_token, _ = self.account_token(client_id, secret)
-        self.set_auth_token(auth_token)
+        self._scheme = scheme
+        self._retry = get_retry_policy(retry_policy)
+
+        self._owns_session = session is None
+        self._session = session
+        if not self._session:
+            self._session = SessionPool(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                keep_alive=keep_alive,
+            )
+
+        if prewarm:
+            self._session.prewarm(
+                urlunsplit((self._scheme, self._endpoint_url, '', '', '')),
+                connections=prewarm
+            )
 
         self._logger = logger
         if not self._logger:
             self._logger = logging.getLogger(__class__.__name__)
             self._logger.addHandler(logging.NullHandler())
 
-    def set_auth_token(self, auth_token):
-        self._auth_token = auth_token
-        self._headers.update({"Authorization": auth_token})
+        if token_cache is True:
+            token_cache = TokenCache()
+
+        self._tokens = TokenManager(
+            fetch=lambda: self.account_token(client_id, secret),
+            cache=token_cache,
+            cache_key=TokenCache.key(endpoint_url, client_id, secret),
+            refresh_margin_sec=refresh_margin_sec,
+            logger=self._logger,
+        )
+
+    @property
+    def session(self):
+        """
+        The connection pool which is used by this client. The upload and
+        download helpers should reuse it for their transfers.
+        """
+        return self._session
+
+    @property
+    def retry_policy(self):
+        return self._retry
+
+    @property
+    def handshakes(self):
+        """
+        The total number of connections that were opened by this client.
+        """
+        return self._session.handshakes
+
+    def close(self):
+        """
+        Stop refreshing the account token and close all the pooled
+        connections.
+        """
+        self._tokens.close()
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_auth_token(self, auth_token, expires=None):
+        self._tokens.set(auth_token, expires)
+
+    def authenticate(self):
+        """
+        Make sure the client holds a valid account token.
+        """
+        self._tokens.get()
+
+    def _send(self, method, url, auth=True, **kwargs):
+        headers = dict(self._headers)
+        if auth:
+            headers["Authorization"] = self._tokens.get()
+
+        timeout = self._retry.timeout()
+        response = self._session.request(
+            method, url, headers=headers, timeout=timeout, **kwargs
+        )
+
+        # The token was revoked or expired early, retry once with a new one
+        if auth and response.status_code == HTTPStatus.UNAUTHORIZED:
+            self._logger.info("The account token was rejected, refreshing it")
+            self._tokens.invalidate()
+            headers["Authorization"] = self._tokens.get()
+            response = self._session.request(
+                method, url, headers=headers, timeout=timeout, **kwargs
+            )
+
+        return response
+
+    def _request(self, method, url, auth=True, idempotent=None, **kwargs):
+        # Transient failures are retried according to the retry policy
+        return self._retry.call(
+            lambda: self._send(method, url, auth, **kwargs), method,
+            idempotent=idempotent, logger=self._logger
+        )
 
     def account_token(
         self, client_id, secret, version=DEFAULT_ENHANCE_VERSION
@@ -43,7 +187,7 @@ class insoundzAPI(object):
         retrieve an JWT Token
         """
         url = urlunsplit(
-            ('https', self._endpoint_url,
+            (self._scheme, self._endpoint_url,
             f'{version}/account/token', '', '')
         )
 
@@ -52,12 +196,11 @@ class insoundzAPI(object):
             "secret": secret
         }
 
-        response = requests.post(
-            url, headers=self._headers, json=data, timeout=DEFAULT_TIMEOUT_SEC
+        # Asking for a token twice is harmless
+        response = self._request(
+            "POST", url, auth=False, idempotent=True, json=data
         )
 
-        response.raise_for_status()
-
         response = response.json()
         token = response["token"]
         expires = response["expires"]
@@ -68,7 +211,10 @@ class insoundzAPI(object):
     def get_default_endpoint_url():
         return DEFAULT_ENDPOINT_URL
 
-    def enhance_file(self, retention=None, preset=None, version=DEFAULT_ENHANCE_VERSION):
+    def enhance_file(
+        self, retention=None, preset=None, version=DEFAULT_ENHANCE_VERSION,
+        callback_url=None
+    ):
         """
         Request the Audio API for a URL to upload the original audio file.
         The function returns an upload_url and a session_id
@@ -83,41 +229,79 @@ class insoundzAPI(object):
                                 file in question. The avalible presets are
                                 'flat' and 'post'.
 
+        :param str callback_url:
+                                A URL the server notifies (POST) when the
+                                session is done or failed, with the body
+                                of enhance_status() and the session_id.
+                                See CallbackListener.
+                                (This param is optional)
+
         :return:                A <session_id> and an <upload_url>.
         :rtype:                 Tuple
         """
+        sid, upload = self._enhance_request(
+            retention, preset, version, callback_url
+        )
+
+        return sid, upload["upload_url"]
+
+    def enhance_file_multipart(
+        self, file_size, part_size, retention=None, preset=None,
+        version=DEFAULT_ENHANCE_VERSION, callback_url=None
+    ):
+        """
+        Same as enhance_file(), but asks for a multipart upload of a
+        <file_size> bytes file in <part_size> bytes parts.
+
+        :return:                A <session_id> and an <upload> dict. The
+                                upload has an "upload_url", and a
+                                "part_urls" list and a "complete_url" when
+                                the server supports multipart uploads.
+        :rtype:                 Tuple
+        """
+        return self._enhance_request(
+            retention, preset, version, callback_url,
+            file_size=file_size, part_size=part_size
+        )
+
+    def _enhance_request(
+        self, retention, preset, version, callback_url=None, **extra
+    ):
         url = urlunsplit(
-            ('https', self._endpoint_url,
+            (self._scheme, self._endpoint_url,
             f'{version}/enhance', '', '')
         )
 
-        data = {}
+        data = dict(extra)
         if retention:
             data["retention"] = retention
         
         if preset:
             data["preset"] = preset
 
-        response = requests.post(
-            url, headers=self._headers, json=data, timeout=DEFAULT_TIMEOUT_SEC
-        )
+        if callback_url:
+            data["callback_url"] = callback_url
 
-        response.raise_for_status()
+        response = self._request("POST", url, json=data)
 
         response = response.json()
-        sid = response["session_id"]
-        src_url = response["upload_url"]
+        sid = response.pop("session_id")
 
-        return sid, src_url
+        return sid, response
 
-    def enhance_status(self, session_id, version=DEFAULT_ENHANCE_VERSION):
+    def enhance_status(
+        self, session_id, version=DEFAULT_ENHANCE_VERSION, with_headers=False
+    ):
         """
         Checks the status of the audio file that is under audio enhancement
         process (by sending a <session_id> which was given by enhance_file()).
         The function returns the status and additional info.
 
         :param str session_id:  Was given by enhance_file().
-        :return:                A <status> and <resp_info>.
+        :param bool with_headers:
+                                If set, the response headers (e.g.
+                                Retry-After) are returned as well.
+        :return:                A <status> and <resp_info> (and <headers>).
                                 #   <resp_info> will contain a url of the
                                     enhanced file in-case of <status> is "done"
                                 #   <resp_info> will contain the failure
@@ -125,17 +309,21 @@ class insoundzAPI(object):
         :rtype:                 Tuple
         """
         url = urlunsplit(
-            ('https', self._endpoint_url,
+            (self._scheme, self._endpoint_url,
             f'{version}/enhance/{session_id}', '', '')
         )
 
-        response = requests.get(
-            url, headers=self._headers, timeout=DEFAULT_TIMEOUT_SEC
-        )
+        response = self._request("GET", url)
 
-        response.raise_for_status()
+        headers = response.headers
+        status, resp_info = self._parse_status(response.json())
 
-        response = response.json()
+        if with_headers:
+            return status, resp_info, headers
+        return status, resp_info
+
+    @staticmethod
+    def _parse_status(response):
         status = response["status"]
 
         if status == "done":
@@ -147,21 +335,49 @@ class insoundzAPI(object):
 
         return status, resp_info
 
+    def enhance_status_bulk(
+        self, session_ids, version=DEFAULT_ENHANCE_VERSION
+    ):
+        """
+        Checks the status of many sessions with a single request.
+        This requires a server which exposes the bulk status endpoint.
+        A server without it responds with 404/405/501 (HTTPError).
+
+        :param list session_ids:    Were given by enhance_file().
+        :return:                    A {<session_id>: (<status>, <resp_info>)}
+                                    dict and the response headers.
+        :rtype:                     Tuple
+        """
+        url = urlunsplit(
+            (self._scheme, self._endpoint_url,
+            f'{version}/enhance/status', '', '')
+        )
+
+        response = self._request(
+            "POST", url, idempotent=True,
+            json={"session_ids": list(session_ids)}
+        )
+
+        headers = response.headers
+        sessions = response.json()["sessions"]
+        statuses = {
+            sid: self._parse_status(session)
+            for sid, session in sessions.items()
+        }
+
+        return statuses, headers
+
     def balance(self, version=DEFAULT_ENHANCE_VERSION):
         """
         Based on client_id and secret from the User Management System,
         retrieve the client current balance.
         """
         url = urlunsplit(
-            ('https', self._endpoint_url,
+            (self._scheme, self._endpoint_url,
             f'{version}/account/balance', '', '')
         )
 
-        response = requests.get(
-            url, headers=self._headers, timeout=DEFAULT_TIMEOUT_SEC
-        )
-
-        response.raise_for_status()
+        response = self._request("GET", url)
         response = response.json()
         
         return response["balance"]
@@ -171,15 +387,11 @@ class insoundzAPI(object):
         Retrieve insoundz API server version.
         """
         url = urlunsplit(
-            ('https', self._endpoint_url,
+            (self._scheme, self._endpoint_url,
             f'{version}/version', '', '')
         )
 
-        response = requests.get(
-            url, headers=self._headers, timeout=DEFAULT_TIMEOUT_SEC
-        )
-
-        response.raise_for_status()
+        response = self._request("GET", url)
         response = response.json()
 
         return response['version'], response['build']
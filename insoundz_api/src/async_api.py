@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import aiohttp
+from http import HTTPStatus
+from urllib.parse import urlunsplit
+from insoundz_api.api import (
+    DEFAULT_ENDPOINT_URL, DEFAULT_ENHANCE_VERSION, DEFAULT_TIMEOUT_SEC,
+    DEFAULT_SCHEME
+)
+from insoundz_api.session import DEFAULT_POOL_MAXSIZE
+from insoundz_api.tokens import (
+    TokenCache, TokenManager, DEFAULT_REFRESH_MARGIN_SEC
+)
+
+DEFAULT_KEEP_ALIVE_TIMEOUT_SEC = 15
+
+
+class AsyncInsoundzAPI(object):
+    """
+    An asyncio implementation of insoundz API client.
+    It has the same surface as insoundzAPI, but every request is a
+    coroutine, so a single event loop can drive many sessions at once.
+
+    The client authenticates on the first request (or when it is entered
+    as an async context manager), and fetches a new account token once the
+    current one is about to expire.
+    """
+    def __init__(
+            self,
+            client_id,
+            secret,
+            endpoint_url=DEFAULT_ENDPOINT_URL,
+            logger=None,
+            pool_maxsize=DEFAULT_POOL_MAXSIZE,
+            keep_alive=True,
+            session=None,
+            token_cache=None,
+            refresh_margin_sec=DEFAULT_REFRESH_MARGIN_SEC,
+            scheme=DEFAULT_SCHEME):
+        """
+        :param str  client_id:          Client ID for insoundz API services.
+        :param str  secret:             Secret key for insoundz API services.
+        :param str  endpoint_url:       insoundz API endpoint (without the
+                                        'https://' prefix).
+        :param int  pool_maxsize:       The maximal number of connections
+                                        per host.
+        :param bool keep_alive:         If not set, connections are closed
+                                        after every request.
+        :param aiohttp.ClientSession session:
+                                        An existing session to share with
+                                        other clients. The session is not
+                                        closed by close() in that case.
+        :param TokenCache token_cache:  A persistent account token cache,
+                                        or True for the default one
+                                        (~/.insoundz_tokens).
+                                        (This param is optional)
+        :param int  refresh_margin_sec: Refresh the account token this long
+                                        before it expires.
+        :param str  scheme:             The scheme of the endpoint, e.g.
+                                        'http' for a local test server.
+        """
+        self._headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        self._client_id = client_id
+        self._secret = secret
+        self._endpoint_url = endpoint_url
+        self._scheme = scheme
+        self._auth_lock = None
+
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        self._owns_session = session is None
+        self._session = session
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        if token_cache is True:
+            token_cache = TokenCache()
+
+        # Tokens are fetched by authenticate() on the event loop
+        self._tokens = TokenManager(
+            cache=token_cache,
+            cache_key=TokenCache.key(endpoint_url, client_id, secret),
+            refresh_margin_sec=refresh_margin_sec,
+            logger=self._logger,
+        )
+
+    @property
+    def session(self):
+        """
+        The aiohttp session which is used by this client. The async upload
+        and download helpers should reuse it for their transfers.
+        """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self._pool_maxsize,
+                keepalive_timeout=(
+                    DEFAULT_KEEP_ALIVE_TIMEOUT_SEC if self._keep_alive else None
+                ),
+                force_close=not self._keep_alive,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """
+        Close all the pooled connections.
+        """
+        self._tokens.close()
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        await self.authenticate()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def set_auth_token(self, auth_token, expires=None):
+        self._tokens.set(auth_token, expires)
+
+    async def authenticate(self):
+        """
+        Retrieve a JWT token, unless the client already has a valid one.
+        """
+        if not self._tokens.needs_refresh():
+            return self._tokens.peek()
+
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+
+        async with self._auth_lock:
+            if self._tokens.needs_refresh():
+                auth_token, expires = await self.account_token(
+                    self._client_id, self._secret
+                )
+                self.set_auth_token(auth_token, expires)
+            return self._tokens.peek()
+
+    def _url(self, path):
+        return urlunsplit((self._scheme, self._endpoint_url, path, '', ''))
+
+    async def _request(
+        self, method, url, auth=True, with_headers=False, retry_auth=True,
+        **kwargs
+    ):
+        headers = dict(self._headers)
+        if auth:
+            headers["Authorization"] = await self.authenticate()
+
+        async with self.session.request(
+            method, url, headers=headers,
+            timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT_SEC), **kwargs
+        ) as response:
+            # The token was revoked or expired early, retry once with a new one
+            if auth and retry_auth and \
+                    response.status == HTTPStatus.UNAUTHORIZED:
+                self._logger.info(
+                    "The account token was rejected, refreshing it"
+                )
+                self._tokens.invalidate()
+                return await self._request(
+                    method, url, auth, with_headers, retry_auth=False,
+                    **kwargs
+                )
+
+            response.raise_for_status()
+            if with_headers:
+                return await response.json(), response.headers
+            return await response.json()
+
+    async def account_token(
+        self, client_id, secret, version=DEFAULT_ENHANCE_VERSION
+    ):
+        """
+        Based on client_id and secret from the User Management System,
+        retrieve an JWT Token
+        """
+        data = {
+            "client_id": client_id,
+            "secret": secret
+        }
+
+        response = await self._request(
+            "POST", self._url(f'{version}/account/token'), auth=False,
+            json=data
+        )
+
+        return response["token"], response["expires"]
+
+    @staticmethod
+    def get_default_endpoint_url():
+        return DEFAULT_ENDPOINT_URL
+
+    async def enhance_file(
+        self, retention=None, preset=None, version=DEFAULT_ENHANCE_VERSION,
+        callback_url=None
+    ):
+        """
+        Request the Audio API for a URL to upload the original audio file.
+        See insoundzAPI.enhance_file().
+
+        :return:                A <session_id> and an <upload_url>.
+        :rtype:                 Tuple
+        """
+        data = {}
+        if retention:
+            data["retention"] = retention
+
+        if preset:
+            data["preset"] = preset
+
+        if callback_url:
+            data["callback_url"] = callback_url
+
+        response = await self._request(
+            "POST", self._url(f'{version}/enhance'), json=data
+        )
+
+        return response["session_id"], response["upload_url"]
+
+    async def enhance_status(
+        self, session_id, version=DEFAULT_ENHANCE_VERSION, with_headers=False
+    ):
+        """
+        Checks the status of the audio file that is under audio enhancement
+        process. See insoundzAPI.enhance_status().
+
+        :return:                A <status> and <resp_info> (and <headers>).
+        :rtype:                 Tuple
+        """
+        response, headers = await self._request(
+            "GET", self._url(f'{version}/enhance/{session_id}'),
+            with_headers=True
+        )
+        status = response["status"]
+
+        if status == "done":
+            resp_info = response["url"]
+        elif status == "failure":
+            resp_info = response["msg"]
+        else:
+            resp_info = None
+
+        if with_headers:
+            return status, resp_info, headers
+        return status, resp_info
+
+    async def balance(self, version=DEFAULT_ENHANCE_VERSION):
+        """
+        Retrieve the client current balance.
+        """
+        response = await self._request(
+            "GET", self._url(f'{version}/account/balance')
+        )
+
+        return response["balance"]
+
+    async def version(self, version=DEFAULT_ENHANCE_VERSION):
+        """
+        Retrieve insoundz API server version.
+        """
+        response = await self._request("GET", self._url(f'{version}/version'))
+
+        return response['version'], response['build']
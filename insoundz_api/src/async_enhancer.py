@@ -0,0 +1,201 @@
+import os
+import asyncio
+import aiohttp
+from insoundz_api.async_api import AsyncInsoundzAPI
+from insoundz_api.async_helpers import async_upload_file, async_download_file
+from insoundz_api.enhancer import AudioEnhancerBase, MAX_UNAUTHORIZED_RETRIES
+from insoundz_api.metrics import SPAN_UPLOAD, SPAN_DOWNLOAD
+from insoundz_api.polling import (
+    get_polling_policy, DEFAULT_STATUS_INTERVAL_SEC,
+    RETRYABLE_POLL_STATUS_CODES
+)
+
+
+class AsyncAudioEnhancer(AudioEnhancerBase):
+    """
+    An asyncio wrapper for insoundz API client to produce audio enhancement.
+    It has the same surface as AudioEnhancer, but enhance_file() is a
+    coroutine and status polling doesn't block a thread, so a single event
+    loop can drive thousands of in-flight sessions.
+    """
+    def __init__(
+        self,
+        client_id,
+        secret,
+        endpoint_url=AsyncInsoundzAPI.get_default_endpoint_url(),
+        pool_maxsize=None,
+        keep_alive=None,
+        token_cache=None,
+        scheme=None,
+        on_event=None,
+    ):
+        super().__init__(on_event=on_event)
+
+        kwargs = dict(
+            client_id=client_id,
+            secret=secret,
+            endpoint_url=endpoint_url,
+            logger=self._logger,
+            pool_maxsize=pool_maxsize,
+            keep_alive=keep_alive,
+            token_cache=token_cache,
+            scheme=scheme,
+        )
+        kwargsNotNone = {k: v for k, v in kwargs.items() if v is not None}
+        self._api = AsyncInsoundzAPI(**kwargsNotNone)
+
+    async def close(self):
+        """
+        Close the pooled connections of the underlying AsyncInsoundzAPI
+        client.
+        """
+        await self._api.close()
+
+    async def __aenter__(self):
+        await self._api.authenticate()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _download_enhanced_file(self, sid, url, src, dst, progress):
+        dst_path = self._get_dst_path(src, dst)
+
+        self._logger.info(f"[{sid}] Downloading enhanced file to {dst_path}")
+        await async_download_file(
+            url, str(dst_path), self._api.session,
+            pbar=self._transfer(progress, SPAN_DOWNLOAD)
+        )
+        self._logger.info(f"[{sid}] {dst_path} was downloaded succesfully.")
+
+    async def _wait_till_done(self, sid, policy, progress, file_size=None):
+        prev_status = None
+        status = None
+        retries = MAX_UNAUTHORIZED_RETRIES
+        state = policy.new_state(file_size)
+        interval = policy.next_interval(state)
+
+        while True:
+            await asyncio.sleep(interval)
+            headers = None
+            try:
+                status, resp_info, headers = await self._api.enhance_status(
+                    sid, with_headers=True
+                )
+                policy.observe(state, status)
+
+                if status != prev_status:
+                    self._update_status_changed(sid, status, progress)
+
+                if status == "done" or status == "failure":
+                    self._logger.info(
+                        f"[{sid}] Job status was polled {state.polls} times"
+                    )
+                    return status, resp_info
+
+                progress.polled(status, state.polls)
+                prev_status = status
+
+            except aiohttp.ClientResponseError as e:
+                headers = e.headers
+                if e.status in RETRYABLE_POLL_STATUS_CODES and retries:
+                    retries -= 1
+                else:
+                    self._handle_enhance_failure(sid, e)
+                    raise
+
+            except Exception as e:
+                self._handle_enhance_failure(sid, e)
+                raise
+
+            else:
+                retries = MAX_UNAUTHORIZED_RETRIES
+
+            interval = policy.next_interval(state, headers)
+
+    async def _enhancement_finish(
+        self, sid, status, info, src, no_download, dst, progress
+    ):
+        if status == "done":
+            self._logger.info(
+                f"[{sid}] Enhanced file URL is located at {info}"
+            )
+
+            # Downloading enhanced file
+            if not no_download:
+                await self._download_enhanced_file(
+                    sid, info, src, dst, progress
+                )
+
+        elif status == "failure":
+            self._logger.error(f"[{sid}] Failure reason: {info}")
+
+        else:
+            self._logger.exception(f"[{sid}] Unexpected status {status}")
+
+    async def _enhancement_start(
+        self, api, src, dst, retention, preset, progress
+    ):
+        self._logger.info(f"Sending a request to insoundzAPI to enhance {src}")
+
+        self._validate_paths(src, dst)
+
+        sid, src_url = await api.enhance_file(retention, preset)
+        progress.sid = sid
+
+        self._logger.info(
+            f"[{sid}] Uploading {src} to insoundzAPI for processing."
+        )
+        await async_upload_file(
+            src, src_url, api.session,
+            pbar=self._transfer(progress, SPAN_UPLOAD)
+        )
+
+        return sid
+
+    async def enhance_file(
+        self, src, no_download=False, dst=None, retention=None,
+        preset=None, status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC,
+        progress_bar=False
+    ):
+        """
+        The asyncio counterpart of AudioEnhancer.enhance_file(), see its
+        documentation for the parameters.
+
+        :return:    sid:            The session ID.
+                    status:         Enhancment final status ("done" or "failure")
+                    resp_info:      Final status additinal info (Enhanced file url
+                                    if status "done. Error message if status "failure".)
+        :rtype:                     Tuple
+        """
+
+        progress = self._job_progress(src, progress_bar)
+        progress.started()
+
+        sid = None
+        status = None
+        resp_info = None
+        error = None
+
+        try:
+            sid = await self._enhancement_start(
+                self._api, src, dst, retention, preset, progress
+            )
+            status, resp_info = await self._wait_till_done(
+                sid, get_polling_policy(status_interval_sec), progress,
+                os.path.getsize(src)
+            )
+            await self._enhancement_finish(
+                sid, status, resp_info, src, no_download, dst, progress
+            )
+
+        except KeyError as e:
+            self._logger.error(f"[{sid}] invalid key {e}")
+            error = e
+
+        except Exception as e:
+            self._logger.error(f"[{sid}] {e}")
+            error = e
+
+        progress.finished(status, resp_info, error)
+        return sid, status, resp_info
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import aiohttp
+from insoundz_api.helpers import open_progress, DEFAULT_CHUNK_SIZE
+
+DEFAULT_SOCK_READ_TIMEOUT_SEC = 30
+
+
+def _transfer_timeout():
+    # Transfers may legitimately take longer than any fixed total timeout,
+    # only a stalled socket is considered a failure.
+    return aiohttp.ClientTimeout(
+        total=None, sock_read=DEFAULT_SOCK_READ_TIMEOUT_SEC
+    )
+
+
+async def _read_chunks(fd, chunk_size, callback=None):
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, fd.read, chunk_size)
+        if not chunk:
+            break
+        if callback:
+            callback(len(chunk))
+        yield chunk
+
+
+async def async_upload_file(
+    src, dst, session, chunk_size=DEFAULT_CHUNK_SIZE, pbar=False
+):
+    file_size = os.path.getsize(src)
+    headers = {"Content-Length": str(file_size)}
+
+    t = open_progress(pbar, file_size, desc="Uploading")
+
+    try:
+        with open(src, "rb") as fd:
+            data = _read_chunks(
+                fd, chunk_size, t.update if t is not None else None
+            )
+            async with session.put(
+                dst, data=data, headers=headers, timeout=_transfer_timeout()
+            ) as response:
+                response.raise_for_status()
+    finally:
+        if t is not None:
+            t.close()
+
+
+async def async_download_file(
+    src, dst, session, chunk_size=DEFAULT_CHUNK_SIZE, pbar=False
+):
+    loop = asyncio.get_running_loop()
+
+    async with session.get(src, timeout=_transfer_timeout()) as response:
+        response.raise_for_status()
+
+        t = open_progress(
+            pbar, response.content_length, desc="Downloading"
+        )
+
+        try:
+            with open(dst, "wb") as fd:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await loop.run_in_executor(None, fd.write, chunk)
+                    if t is not None:
+                        t.update(len(chunk))
+        finally:
+            if t is not None:
+                t.close()
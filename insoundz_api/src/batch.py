@@ -0,0 +1,526 @@
+import time
+import heapq
+import queue
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from insoundz_api.polling import FixedPolling
+from insoundz_api.metrics import (
+    JobTimings, SPAN_LOOKUP, SPAN_ADMISSION, SPAN_PROCESSING
+)
+from insoundz_api.progress import ProgressEmitter, BatchRenderer
+from insoundz_api.retry import observe_retries
+from insoundz_api.scheduler import (
+    estimate_duration, get_order, order_key, ORDER_SJF
+)
+from insoundz_api.journal import (
+    PHASE_PROCESSING, PHASE_FINISHED, PHASE_FAILED
+)
+
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_MAX_IN_FLIGHT = 32
+
+_DONE = object()
+
+
+class BatchJob(object):
+    """
+    A source of an EnhanceBatch with its own destination, priority or
+    deadline (an epoch timestamp). See order_key() for the order of the
+    queued jobs.
+    """
+    def __init__(self, src, dst=None, priority=0, deadline=None):
+        self.src = src
+        self.dst = dst
+        self.priority = priority
+        self.deadline = deadline
+
+    def __repr__(self):
+        return f"BatchJob(src={self.src!r}, priority={self.priority}, " \
+            f"deadline={self.deadline})"
+
+
+class BatchResult(object):
+    """
+    The outcome of a single file of an EnhanceBatch.
+    Its <upload> is the UploadReport (with per-part timings) of the file,
+    its <timings> is the JobTimings of the whole job and its <progress> is
+    the JobProgress which emits the progress events of the job. Its
+    <ticket> is the admission of the job by the JobScheduler of the
+    enhancer, if it has one.
+    """
+    def __init__(self, src, dst=None, progress=None):
+        self.src = src
+        self.dst = dst
+        self.sid = None
+        self.status = None
+        self.resp_info = None
+        self.error = None
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.polls = 0
+        self.upload = None
+        self.cached = False
+        self.cache_key = None
+        self.job_id = None
+        self.ticket = None
+        self.priority = 0
+        self.deadline = None
+        self.duration = None
+        self.timings = JobTimings(src)
+        self.progress = progress
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.status == "done"
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def missed_deadline(self):
+        return self.deadline is not None and \
+            (self.end_time or time.time()) > self.deadline
+
+    def __repr__(self):
+        return f"BatchResult(src={self.src!r}, sid={self.sid!r}, " \
+            f"status={self.status!r}, error={self.error!r})"
+
+
+class BatchStats(object):
+    """
+    Aggregate throughput of an EnhanceBatch.
+    """
+    def __init__(self):
+        self.files = 0
+        self.failures = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.polls = 0
+        self.cached = 0
+        self.missed_deadlines = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def files_per_sec(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        total = self.bytes_uploaded + self.bytes_downloaded
+        return total / self.elapsed if self.elapsed else 0.0
+
+    def add(self, result):
+        self.files += 1
+        if not result.ok:
+            self.failures += 1
+        self.bytes_uploaded += result.bytes_uploaded
+        self.bytes_downloaded += result.bytes_downloaded
+        self.polls += result.polls
+        if result.cached:
+            self.cached += 1
+        if result.missed_deadline:
+            self.missed_deadlines += 1
+
+    def __str__(self):
+        missed = ""
+        if self.missed_deadlines:
+            missed = f", {self.missed_deadlines} missed their deadlines"
+        return f"{self.files} files ({self.failures} failed, " \
+            f"{self.cached} cached{missed}) in " \
+            f"{self.elapsed:.1f} sec; {self.files_per_sec:.2f} files/s; " \
+            f"{self.bytes_per_sec / 1024 / 1024:.2f} MB/s; " \
+            f"{self.polls} status polls"
+
+
+class EnhanceBatch(object):
+    """
+    Enhance many files concurrently.
+    Session start + upload, status polling (through the shared
+    StatusPoller of the enhancer) and download run as separate bounded
+    stages, so uploads and downloads of some files overlap with the
+    server-side processing of others.
+
+    Uploads start in the order of the jobs (see order_key()) whenever an
+    upload worker is free, so the order applies to the jobs which wait for
+    one (up to <max_in_flight>). If the enhancer has a JobScheduler, the
+    jobs wait for its admission first.
+
+    Iterating over the batch yields a BatchResult per file as soon as the
+    file is done. The aggregate throughput is available through <stats>.
+    If iterating over <sources> fails, the batch ends once the jobs in
+    flight are done, and the iteration raises the error.
+    """
+    def __init__(
+        self, enhancer, sources, dst=None, no_download=False,
+        retention=None, preset=None, max_workers=DEFAULT_BATCH_WORKERS,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT, polling_policy=None,
+        progress_bar=False, order=None, priority=0, deadline=None
+    ):
+        self._enhancer = enhancer
+        self._api = enhancer._api
+        self._logger = enhancer._logger
+        self._sources = sources
+        self._dst = dst
+        self._no_download = no_download
+        self._retention = retention
+        self._preset = preset
+        self._priority = priority
+        self._deadline = deadline
+        self._order = get_order(order)
+        self._policy = polling_policy or FixedPolling()
+        self._poller = enhancer.poller
+
+        # The events of the batch jobs reach the subscribers of the
+        # enhancer too
+        self._events = ProgressEmitter(
+            parent=enhancer.events, logger=self._logger
+        )
+        self._renderer = None
+        if progress_bar:
+            total = len(sources) if hasattr(sources, "__len__") else None
+            self._renderer = self._events.subscribe(BatchRenderer(total))
+
+        self._uploads = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="insoundz-upload"
+        )
+        self._downloads = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="insoundz-download"
+        )
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._results = queue.Queue()
+        # The jobs which wait for an upload worker
+        self._pending = []
+        self._sequence = 0
+
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._emitted = 0
+        self._feeding_done = False
+        self._feed_error = None
+        self._cancelled = threading.Event()
+
+        self.stats = BatchStats()
+        self._started = False
+
+    def _split_source(self, source):
+        # A source is either a path, a (src, dst) tuple or a BatchJob
+        if isinstance(source, BatchJob):
+            return source
+        if isinstance(source, (tuple, list)):
+            return BatchJob(
+                source[0], source[1], self._priority, self._deadline
+            )
+        return BatchJob(source, self._dst, self._priority, self._deadline)
+
+    def _journal_emit(self, result, error):
+        if error is None:
+            self._enhancer._journal_update(
+                result.job_id, phase=PHASE_FINISHED
+            )
+        elif result.sid is None:
+            self._enhancer._journal_update(
+                result.job_id, phase=PHASE_FAILED, error=str(error)
+            )
+        elif result.status != "failure":
+            # Keep the phase, so the session can be resumed
+            self._enhancer._journal_update(result.job_id, error=str(error))
+
+    def _release(self, result, charged):
+        if result.ticket is not None:
+            self._enhancer._release(result.ticket, charged)
+
+    def _emit(self, result, error=None):
+        self._release(
+            result, result.sid is not None and result.status != "failure"
+        )
+        if error is not None:
+            result.error = error
+            self._logger.error(f"[{result.sid}] {result.src}: {error}")
+        result.end_time = time.time()
+        self._journal_emit(result, error)
+        result.timings.finish(result.sid, result.status, error)
+        self._enhancer._report_timings(result.timings)
+        result.progress.sid = result.sid
+        result.progress.finished(result.status, result.resp_info, error)
+
+        with self._lock:
+            self.stats.add(result)
+            self._emitted += 1
+            finished = self._feeding_done and self._emitted == self._submitted
+
+        self._results.put(result)
+        self._in_flight.release()
+        if finished:
+            self._results.put(_DONE)
+
+    def _new_result(self, source):
+        job = self._split_source(source)
+        result = BatchResult(
+            job.src, job.dst if job.dst is not None else self._dst,
+            self._events.job(job.src)
+        )
+        result.priority = job.priority
+        result.deadline = job.deadline
+        return result
+
+    def _submit(self, result):
+        src = result.src
+        scheduler = self._enhancer.scheduler
+        if self._order == ORDER_SJF or \
+                scheduler and scheduler.order == ORDER_SJF:
+            result.duration = self._estimate_duration(src)
+
+        # Sources are compressed in advance, in parallel with the uploads
+        # of the sources before them
+        compression = None
+        if self._enhancer._compressor:
+            try:
+                compression = self._enhancer._compressor.submit(src)
+            except Exception as e:
+                self._logger.warning(f"Couldn't compress {src}: {e}")
+
+        if scheduler is None:
+            self._queue_upload(result, compression)
+            return
+        # The job is uploaded once the scheduler admits it
+        try:
+            scheduler.enqueue(
+                src, priority=result.priority, deadline=result.deadline,
+                duration=result.duration,
+                callback=partial(self._admitted, result, compression)
+            )
+        except Exception:
+            self._discard(compression)
+            raise
+
+    def _feed(self):
+        # The batch ends even if <sources> fails; its error is raised by
+        # the iteration once the jobs in flight are done
+        try:
+            for source in self._sources:
+                self._in_flight.acquire()
+                if self._cancelled.is_set():
+                    return
+                try:
+                    result = self._new_result(source)
+                except Exception:
+                    self._in_flight.release()
+                    raise
+                with self._lock:
+                    self._submitted += 1
+                try:
+                    self._submit(result)
+                except Exception as e:
+                    self._emit(result, e)
+        except Exception as e:
+            self._logger.error(f"Couldn't read the sources of the batch: {e}")
+            self._feed_error = e
+        finally:
+            with self._lock:
+                self._feeding_done = True
+                finished = self._emitted == self._submitted
+            if finished:
+                self._results.put(_DONE)
+
+    def _get_cached(self, result):
+        cache = self._enhancer.cache
+        if not cache or self._no_download:
+            return False
+
+        result.cache_key = cache.key_for_file(
+            result.src, self._preset, self._enhancer._result_version(
+                self._enhancer._compressor is not None
+            )
+        )
+        dst_path = self._enhancer._get_dst_path(result.src, result.dst)
+        if not cache.get(result.cache_key, dst_path):
+            return False
+        dst_path = self._enhancer._restore(None, dst_path, result.src)
+
+        result.dst = dst_path
+        result.status = "done"
+        result.resp_info = dst_path
+        result.cached = True
+        result.timings.cached = True
+        return True
+
+    def _estimate_duration(self, src):
+        try:
+            return estimate_duration(src)
+        except OSError as e:
+            self._logger.warning(
+                f"Couldn't estimate the duration of {src}: {e}"
+            )
+            return None
+
+    def _admitted(self, result, compression, ticket):
+        # Called from the thread of the scheduler
+        if self._cancelled.is_set():
+            self._enhancer._release(ticket, charged=False)
+            return
+        self._queue_upload(result, compression, ticket)
+
+    def _queue_upload(self, result, compression=None, ticket=None):
+        with self._lock:
+            self._sequence += 1
+            key = order_key(
+                self._order, result.priority, result.deadline,
+                result.duration, self._sequence
+            )
+            heapq.heappush(self._pending, key + (result, compression, ticket))
+        # Every worker task uploads the first pending job once it runs
+        self._uploads.submit(self._upload_next)
+
+    def _upload_next(self):
+        with self._lock:
+            entry = heapq.heappop(self._pending)
+        self._upload(*entry[-3:])
+
+    def _upload(self, result, compression=None, ticket=None):
+        result.progress.started()
+        if ticket is not None:
+            result.ticket = ticket
+            if ticket.error is not None:
+                self._discard(compression)
+                self._emit(result, ticket.error)
+                return
+            result.timings.add_span(
+                SPAN_ADMISSION, ticket.enqueued_at, ticket.admitted_at
+            )
+        with observe_retries(result.timings.retried):
+            try:
+                with result.timings.span(SPAN_LOOKUP):
+                    cached = self._get_cached(result)
+                if cached:
+                    self._discard(compression)
+                    self._emit(result)
+                    return
+
+                result.job_id = self._enhancer._journal_add(
+                    result.src, result.dst, self._preset, self._retention,
+                    self._no_download, local=True
+                )
+                result.sid, result.upload = self._enhancer._enhancement_start(
+                    self._api, result.src, result.dst,
+                    self._retention, self._preset, result.progress,
+                    result.timings, compression=compression
+                )
+                # The size of what was uploaded, e.g. the compressed copy
+                result.bytes_uploaded = result.upload.size
+            except Exception as e:
+                self._discard(compression)
+                self._emit(result, e)
+                return
+        processing_start = time.time()
+        result.progress.enter(SPAN_PROCESSING)
+
+        self._enhancer._journal_update(
+            result.job_id, session_id=result.sid, phase=PHASE_PROCESSING
+        )
+
+        self._poller.submit(
+            result.sid, file_size=result.bytes_uploaded,
+            polling_policy=self._policy,
+            callback=lambda future: self._handle_polled(
+                result, future, processing_start
+            )
+        )
+
+    def _discard(self, compression):
+        if compression is not None:
+            self._enhancer._compressor.discard(compression)
+
+    def _handle_polled(self, result, future, processing_start):
+        # Runs as a done callback of the poll, which swallows exceptions,
+        # so the result must be emitted on any error
+        try:
+            self._handle_status(result, future, processing_start)
+        except Exception as e:
+            self._emit(result, e)
+
+    def _handle_status(self, result, future, processing_start):
+        result.timings.add_span(SPAN_PROCESSING, processing_start)
+        if future.cancelled():
+            self._emit(result, Exception("Status polling was cancelled"))
+            return
+
+        result.polls = result.timings.polls = future.polls
+        error = future.exception()
+        if error is not None:
+            self._emit(result, error)
+            return
+
+        result.status, result.resp_info = future.result()
+        self._enhancer._journal_status(
+            result.job_id, result.status, result.resp_info
+        )
+        if result.status == "failure":
+            self._emit(result, result.resp_info)
+        elif self._no_download:
+            self._emit(result)
+        else:
+            # The session is over, its download takes no slot
+            self._release(result, charged=True)
+            self._downloads.submit(self._download, result)
+
+    def _download(self, result):
+        with observe_retries(result.timings.retried):
+            try:
+                result.dst = self._enhancer._download_enhanced_file(
+                    result.sid, result.resp_info, result.src, result.dst,
+                    result.progress, result.timings
+                )
+                # The bytes that were downloaded, e.g. before a restore
+                result.bytes_downloaded = result.timings.bytes_downloaded
+                if result.cache_key:
+                    self._enhancer.cache.put(result.cache_key, result.dst)
+            except Exception as e:
+                self._emit(result, e)
+                return
+
+        self._emit(result)
+
+    def _start(self):
+        self._started = True
+        self.stats = BatchStats()
+        threading.Thread(
+            target=self._feed, name="insoundz-feed", daemon=True
+        ).start()
+
+    def __iter__(self):
+        if self._started:
+            raise Exception("A batch can only be iterated once")
+
+        self._start()
+        try:
+            while True:
+                result = self._results.get()
+                if result is _DONE:
+                    break
+                yield result
+            if self._feed_error is not None:
+                raise self._feed_error
+        finally:
+            self.stats.end_time = time.time()
+            self._cancelled.set()
+            self._in_flight.release()
+            self._uploads.shutdown(wait=False)
+            self._downloads.shutdown(wait=False)
+            if self._renderer:
+                self._renderer.close()
+            self._logger.info(f"Batch summary: {self.stats}")
+
+    def run(self):
+        """
+        Run the whole batch and return the list of results.
+        """
+        return list(self)
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from insoundz_api.helpers import DEFAULT_CHUNK_SIZE
+
+DEFAULT_CACHE_DIR = os.path.join(Path.home(), ".insoundz_cache")
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+DEFAULT_RETAINED_INDEX_PATH = os.path.join(Path.home(), ".insoundz_retained")
+
+
+def hash_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Return the sha256 hex digest of the content of <path>, reading it in
+    chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CacheStats(object):
+    """
+    Cache hits and misses of this process, and the current cache usage.
+    """
+    def __init__(self, hits, misses, evictions, entries, size, max_size):
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.entries = entries
+        self.size = size
+        self.max_size = max_size
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses " \
+            f"({self.hit_rate:.0%} hit rate), {self.evictions} evictions; " \
+            f"{self.entries} entries, {self.size / 1024 / 1024:.1f}/" \
+            f"{self.max_size / 1024 / 1024:.1f} MB"
+
+
+class _EntryWriter(object):
+    """
+    Writes a new cache entry to a temporary file, which becomes the entry
+    only once it is committed.
+    """
+    def __init__(self, cache, key):
+        self._cache = cache
+        self._key = key
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=cache.path, prefix=".entry"
+        )
+        self._fd = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self._fd.write(chunk)
+
+    def commit(self):
+        self._fd.close()
+        self._cache._commit(self._key, self._tmp_path)
+
+    def abort(self):
+        self._fd.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class ResultCache(object):
+    """
+    A content-addressed on-disk cache of enhanced files.
+    Entries are keyed by the hash of the source audio, the preset and the
+    API version, so identical audio is enhanced (and paid for) only once.
+    Entries are written atomically, and the least recently used entries are
+    evicted once the cache grows beyond <max_size> bytes.
+    """
+    def __init__(
+        self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_MAX_SIZE,
+        logger=None
+    ):
+        """
+        :param str  path:       The cache directory.
+        :param int  max_size:   The maximal total size of the entries
+                                [bytes].
+        """
+        self.path = path
+        self.max_size = max_size
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(digest, preset=None, version=None):
+        return hashlib.sha256(
+            f"{digest}\0{preset or ''}\0{version or ''}".encode("utf-8")
+        ).hexdigest()
+
+    def key_for_file(self, src, preset=None, version=None):
+        return self.key(hash_file(src), preset, version)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _entries(self):
+        for folder in os.scandir(self.path):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.is_file():
+                    yield entry
+
+    def lookup(self, key):
+        """
+        Return the path of the entry of <key> (and mark it as recently
+        used), or None.
+        """
+        path = self._entry_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return path
+
+    def get(self, key, dst):
+        """
+        Copy the entry of <key> to <dst>. Returns False on a cache miss.
+        """
+        path = self.lookup(key)
+        if not path:
+            return False
+
+        tmp_path = f"{dst}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dst)
+        return True
+
+    def put(self, key, src):
+        """
+        Store a copy of the file <src> as the entry of <key>.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".entry")
+        os.close(fd)
+        shutil.copyfile(src, tmp_path)
+        self._commit(key, tmp_path)
+
+    def writer(self, key):
+        """
+        Return a writer of a new entry for <key>, for results which are
+        streamed rather than downloaded to a file. Call commit() once the
+        whole result was written, or abort().
+        """
+        return _EntryWriter(self, key)
+
+    def _commit(self, key, tmp_path):
+        path = self._entry_path(key)
+        Path(path).parent.mkdir(exist_ok=True)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        <max_size>.
+        """
+        with self._lock:
+            entries = [(entry.stat(), entry.path) for entry in self._entries()]
+            size = sum(stat.st_size for stat, _ in entries)
+            entries.sort(key=lambda entry: entry[0].st_mtime)
+
+            for stat, path in entries:
+                if size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                size -= stat.st_size
+                self._evictions += 1
+                self._logger.info(f"Evicted {os.path.basename(path)}")
+
+    def stats(self):
+        with self._lock:
+            entries = [entry.stat().st_size for entry in self._entries()]
+            return CacheStats(
+                self._hits, self._misses, self._evictions,
+                len(entries), sum(entries), self.max_size
+            )
+
+
+class RetainedIndex(object):
+    """
+    A persistent index of results which the server retains (see the
+    <retention> of enhance_file()), keyed like the ResultCache.
+    Enhancing the same audio again within the retention time reuses the
+    retained result, without uploading or processing it again.
+    """
+    def __init__(self, path=DEFAULT_RETAINED_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        folder = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(
+            dir=folder, prefix=".insoundz_retained"
+        )
+        try:
+            os.chmod(tmp_path, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                json.dump(entries, tmp)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        """
+        Return the retained (<session_id>, <url>) of <key>, or None if there
+        is none or it has expired.
+        """
+        with self._lock:
+            entry = self._read().get(key)
+        if not entry or entry["expires_at"] <= time.time():
+            return None
+        return entry["session_id"], entry["url"]
+
+    def set(self, key, session_id, url, expires_at=None):
+        """
+        Record a retained result. <expires_at> (an epoch timestamp) keeps its
+        previous value if not set.
+        """
+        now = time.time()
+        with self._lock:
+            entries = {
+                k: v for k, v in self._read().items()
+                if v["expires_at"] > now
+            }
+            if expires_at is None:
+                if key not in entries:
+                    return
+                expires_at = entries[key]["expires_at"]
+            entries[key] = {
+                "session_id": session_id,
+                "url": url,
+                "expires_at": expires_at,
+            }
+            self._write(entries)
+
+    def delete(self, key):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
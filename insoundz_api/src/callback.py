@@ -0,0 +1,158 @@
+import json
+import socket
+import secrets
+import logging
+import threading
+from http import HTTPStatus
+from insoundz_api.api import insoundzAPI
+
+DEFAULT_CALLBACK_HOST = "127.0.0.1"
+# Sessions are still polled this often, in case a notification is lost
+DEFAULT_FALLBACK_INTERVAL_SEC = 30
+CALLBACK_PATH = "/insoundz/callback"
+MAX_NOTIFICATION_SIZE = 65536
+
+
+class CallbackListener(object):
+    """
+    A small embedded HTTP server which receives the notifications of the
+    sessions that were started with its <url> as their callback URL (see
+    insoundzAPI.enhance_file()), and hands them to the handler it's bound
+    to, e.g. StatusPoller.notify() which resolves the future of the
+    session right away instead of on its next poll.
+
+    A notification is a POST of the body of enhance_status() with the
+    "session_id" of the session. The path of <url> holds a random token,
+    so notifications which weren't sent to this listener are rejected.
+
+    The API server must be able to reach the listener: listen on a public
+    <host>, or behind a proxy whose URL is <public_url>. Sessions are
+    still polled every <fallback_interval_sec>, in case a notification is
+    lost.
+    """
+    def __init__(
+        self, host=DEFAULT_CALLBACK_HOST, port=0, public_url=None,
+        fallback_interval_sec=DEFAULT_FALLBACK_INTERVAL_SEC, logger=None
+    ):
+        """
+        :param str   host:              The address to listen on, "" for
+                                        all the interfaces.
+        :param int   port:              The port to listen on, 0 for any
+                                        free port.
+        :param str   public_url:        The URL the API server reaches the
+                                        listener at, e.g. through a proxy.
+                                        Defaults to http://<host>:<port>.
+                                        (This param is optional)
+        :param float fallback_interval_sec:
+                                        The interval of the status polls of
+                                        sessions which are notified [sec].
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.public_url = public_url
+        self.fallback_interval_sec = fallback_interval_sec
+        self.notifications = 0
+        self.rejected = 0
+
+        if logger:
+            self._logger = logger
+        else:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._path = f"{CALLBACK_PATH}/{secrets.token_urlsafe(16)}"
+        self._handler = None
+        self._lock = threading.Lock()
+
+        listener = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_NOTIFICATION_SIZE:
+                    listener._count(rejected=True)
+                    self.close_connection = True
+                    return self._reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                body = self.rfile.read(length)
+                if self.path.split("?")[0] != listener._path:
+                    listener._count(rejected=True)
+                    return self._reply(HTTPStatus.NOT_FOUND)
+                self._reply(listener._receive(body))
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="insoundz-callback",
+            daemon=True
+        ).start()
+        host, port = self._server.server_address[:2]
+        self._logger.info(
+            f"Listening for session notifications on {host}:{port}"
+        )
+
+    @property
+    def url(self):
+        """
+        The callback URL to start sessions with.
+        """
+        if self.public_url:
+            return self.public_url.rstrip("/") + self._path
+        host, port = self._server.server_address[:2]
+        if host in ("", "0.0.0.0", "::"):
+            host = socket.getfqdn()
+        return f"http://{host}:{port}{self._path}"
+
+    def bind(self, handler):
+        """
+        Hand the notifications to <handler>(<session_id>, <status>,
+        <resp_info>).
+        """
+        self._handler = handler
+
+    def _count(self, rejected=False):
+        with self._lock:
+            if rejected:
+                self.rejected += 1
+            else:
+                self.notifications += 1
+
+    def _receive(self, body):
+        try:
+            notification = json.loads(body)
+            sid = notification["session_id"]
+            status, resp_info = insoundzAPI._parse_status(notification)
+        except (ValueError, KeyError, TypeError) as e:
+            self._logger.warning(f"Invalid session notification: {e}")
+            self._count(rejected=True)
+            return HTTPStatus.BAD_REQUEST
+
+        if self._handler is None:
+            # Not ready yet, the server may send it again
+            return HTTPStatus.SERVICE_UNAVAILABLE
+
+        self._count()
+        self._logger.info(f"[{sid}] Notified of status [{status}]")
+        try:
+            self._handler(sid, status, resp_info)
+        except Exception as e:
+            self._logger.error(f"[{sid}] Couldn't handle notification: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR
+        return HTTPStatus.NO_CONTENT
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
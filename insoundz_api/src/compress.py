@@ -0,0 +1,234 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from pathlib import PurePath
+from concurrent.futures import ProcessPoolExecutor
+
+# soundfile is an optional dependency (pip install insoundz-api[compress]),
+# it's imported by the functions that use it.
+
+DEFAULT_COMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_COMPRESS_DIR = os.path.join(
+    tempfile.gettempdir(), "insoundz_compressed"
+)
+# Smaller files gain too little to be worth encoding
+DEFAULT_MIN_COMPRESS_SIZE = 256 * 1024
+DEFAULT_BLOCK_FRAMES = 65536
+
+COMPRESSED_FORMAT = "FLAC"
+COMPRESSED_SUFFIX = ".flac"
+
+# The PCM encodings which FLAC holds losslessly, and their FLAC subtypes
+LOSSLESS_SUBTYPES = {
+    "PCM_U8": "PCM_S8",
+    "PCM_S8": "PCM_S8",
+    "PCM_16": "PCM_16",
+    "PCM_24": "PCM_24",
+}
+
+
+class CompressedAudio(object):
+    """
+    A losslessly compressed copy of a source file, which is uploaded
+    instead of it.
+    """
+    def __init__(
+        self, src, path, original_size, size, start_time, end_time
+    ):
+        self.src = src
+        self.path = path
+        self.original_size = original_size
+        self.size = size
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def ratio(self):
+        return self.original_size / self.size
+
+    @property
+    def encode_sec(self):
+        return self.end_time - self.start_time
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f"CompressedAudio(src={self.src!r}, ratio={self.ratio:.2f})"
+
+
+def _copy(src, dst, format, subtype):
+    import soundfile
+
+    # Integer samples are converted between the PCM widths by exact shifts
+    with soundfile.SoundFile(src) as fin:
+        with soundfile.SoundFile(
+            dst, "w", samplerate=fin.samplerate, channels=fin.channels,
+            format=format, subtype=subtype
+        ) as fout:
+            for block in fin.blocks(DEFAULT_BLOCK_FRAMES, dtype="int32"):
+                fout.write(block)
+
+
+def _encode(src, path):
+    # Runs in a worker process
+    import soundfile
+
+    start_time = time.time()
+    try:
+        info = soundfile.info(src)
+    except RuntimeError:
+        # Not a format which libsndfile reads
+        return None
+    if info.format == COMPRESSED_FORMAT or \
+            info.subtype not in LOSSLESS_SUBTYPES:
+        return None
+
+    tmp_path = path + ".tmp"
+    _copy(src, tmp_path, COMPRESSED_FORMAT, LOSSLESS_SUBTYPES[info.subtype])
+    original_size = os.path.getsize(src)
+    size = os.path.getsize(tmp_path)
+    if size >= original_size:
+        os.remove(tmp_path)
+        return None
+
+    # Encoding is deterministic, so an interrupted multipart upload of the
+    # copy (which is keyed by its size and mtime) can be resumed
+    stat = os.stat(src)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, path)
+    return CompressedAudio(
+        src, path, original_size, size, start_time, time.time()
+    )
+
+
+def _restore(path, src):
+    # Runs in a worker process
+    import soundfile
+
+    original = soundfile.info(src)
+    tmp_path = path + ".tmp"
+    _copy(path, tmp_path, original.format, original.subtype)
+    os.replace(tmp_path, path)
+
+
+class AudioCompressor(object):
+    """
+    Losslessly compresses PCM sources (e.g. WAV) into FLAC before they are
+    uploaded, and restores the enhanced results into the container of the
+    source after they are downloaded.
+    The encoding runs in a process pool, so several files are encoded in
+    parallel with the uploads of others.
+
+    Only the audio samples are restored; other chunks of the source
+    container (e.g. metadata) are not carried over.
+    """
+    def __init__(
+        self, max_workers=DEFAULT_COMPRESS_WORKERS, path=DEFAULT_COMPRESS_DIR,
+        min_size=DEFAULT_MIN_COMPRESS_SIZE, restore=True, logger=None
+    ):
+        """
+        :param int  max_workers:    The number of encoding processes.
+        :param str  path:           Where the compressed copies are kept
+                                    while they are uploaded.
+        :param int  min_size:       Smaller sources are uploaded as is
+                                    [bytes].
+        :param bool restore:        If set, the enhanced results are
+                                    restored into the container of their
+                                    sources. Otherwise they are kept as
+                                    FLAC files.
+        """
+        try:
+            import soundfile  # noqa: F401
+        except ImportError:
+            raise Exception(
+                "Compression requires the soundfile package. "
+                "Install it with 'pip install insoundz-api[compress]'"
+            )
+
+        self._max_workers = max_workers
+        self._pool = None
+        self.path = path
+        self.min_size = min_size
+        self.restore = restore
+        os.makedirs(path, exist_ok=True)
+
+        if logger:
+            self._logger = logger
+        else:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self._max_workers)
+        return self._pool
+
+    def _compressed_path(self, src):
+        digest = hashlib.sha256(
+            os.path.abspath(src).encode("utf-8")
+        ).hexdigest()[:16]
+        name = f"{digest}_{PurePath(src).stem}{COMPRESSED_SUFFIX}"
+        return os.path.join(self.path, name)
+
+    def submit(self, src):
+        """
+        Start compressing <src>. Returns a future of its CompressedAudio
+        (or of None if it isn't worth compressing), or None if <src> is
+        too small.
+        """
+        if os.path.getsize(src) < self.min_size:
+            return None
+        return self._executor().submit(
+            _encode, src, self._compressed_path(src)
+        )
+
+    def discard(self, future):
+        """
+        Remove the compressed copy of a submitted source which won't be
+        uploaded.
+        """
+        def remove(future):
+            if not future.cancelled() and future.exception() is None and \
+                    future.result():
+                future.result().remove()
+
+        if future is not None and not future.cancel():
+            future.add_done_callback(remove)
+
+    def is_compressed(self, path, src):
+        """
+        Whether the enhanced result at <path> is the FLAC of a source
+        <src> which is not.
+        """
+        import soundfile
+
+        try:
+            return soundfile.info(path).format == COMPRESSED_FORMAT and \
+                soundfile.info(src).format != COMPRESSED_FORMAT
+        except (RuntimeError, OSError):
+            return False
+
+    def finish(self, path, src):
+        """
+        Restore the compressed result at <path> into the container of <src>,
+        or give it the FLAC suffix if results are not restored.
+        Returns the final path of the result.
+        """
+        if self.restore:
+            self._executor().submit(_restore, path, src).result()
+            return path
+
+        flac_path = str(PurePath(path).with_suffix(COMPRESSED_SUFFIX))
+        os.replace(path, flac_path)
+        return flac_path
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
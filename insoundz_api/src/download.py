@@ -0,0 +1,427 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from insoundz_api.helpers import open_progress, DEFAULT_CHUNK_SIZE
+from insoundz_api.retry import get_retry_policy
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+
+PARTIAL_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def _parse_content_range(response):
+    """
+    Return the total size of a 206 response, or None.
+    """
+    match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+    if not match or match.group(3) == "*":
+        return None
+    return int(match.group(3))
+
+
+def _validator(response):
+    # Identifies the version of the remote file across requests (presigned
+    # URLs change on every status poll, so the URL itself can't)
+    return response.headers.get("ETag") or \
+        response.headers.get("Last-Modified")
+
+
+class _DownloadState(object):
+    """
+    The sidecar file of a partial download, listing the segments which were
+    already written to the partial file.
+    """
+    def __init__(self, path, size, segment_size, validator, done=None):
+        self.path = path
+        self.size = size
+        self.segment_size = segment_size
+        self.validator = validator
+        self.done = set(done or ())
+        self._lock = threading.Lock()
+
+    @property
+    def segments(self):
+        return (self.size + self.segment_size - 1) // self.segment_size
+
+    def segment_range(self, index):
+        start = index * self.segment_size
+        return start, min(start + self.segment_size, self.size) - 1
+
+    @property
+    def pending(self):
+        return [i for i in range(self.segments) if i not in self.done]
+
+    @property
+    def bytes_done(self):
+        return sum(
+            end - start + 1
+            for start, end in map(self.segment_range, self.done)
+        )
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r", encoding="utf-8") as fd:
+                state = json.load(fd)
+            return cls(
+                path, state["size"], state["segment_size"],
+                state["validator"], state["done"]
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def matches(self, size, validator):
+        return self.size == size and self.validator == validator
+
+    def mark_done(self, index):
+        with self._lock:
+            self.done.add(index)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fd:
+                json.dump({
+                    "size": self.size,
+                    "segment_size": self.segment_size,
+                    "validator": self.validator,
+                    "done": sorted(self.done),
+                }, fd)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RangedDownloader(object):
+    """
+    Download a file over several connections in parallel using HTTP Range
+    requests.
+    Completed segments are recorded in a sidecar state file next to the
+    partial file (<dst>.part.json), so an interrupted download resumes from
+    where it stopped. A server which doesn't support ranges is downloaded
+    as a single stream.
+    """
+    def __init__(
+        self, session=None, max_workers=DEFAULT_DOWNLOAD_WORKERS,
+        segment_size=DEFAULT_SEGMENT_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+        retry_policy=None, logger=None
+    ):
+        """
+        :param SessionPool session:     The connection pool to download with.
+                                        (This param is optional)
+        :param int  max_workers:        The number of parallel connections
+                                        per download.
+        :param int  segment_size:       The size of every ranged request
+                                        [bytes].
+        :param int  chunk_size:         The size of every write [bytes].
+        :param RetryPolicy retry_policy:
+                                        How failed requests are retried, or
+                                        a number of retries. An interrupted
+                                        segment is resumed from where it
+                                        stopped.
+                                        (This param is optional)
+        """
+        self._http = session or requests
+        self._max_workers = max_workers
+        self._segment_size = segment_size
+        self._chunk_size = chunk_size
+        self._retry = get_retry_policy(retry_policy)
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+    def _get(self, src, start, end):
+        return self._http.get(
+            src, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+            timeout=self._retry.timeout(end - start + 1)
+        )
+
+    def _get_first(self, src, start, end, on_retry):
+        return self._retry.call(
+            lambda: self._get(src, start, end), on_retry=on_retry,
+            logger=self._logger
+        )
+
+    def _can_resume(self, error, retries):
+        return retries > 0 and self._retry.is_retryable(error, "GET")
+
+    def _wait_to_resume(self, error, retries, on_retry):
+        # <retries> is the number of retries that are left
+        headers = None
+        if isinstance(error, requests.exceptions.HTTPError):
+            headers = error.response.headers
+            error.response.close()
+        self._retry.notify(error, on_retry)
+        time.sleep(
+            self._retry.backoff(self._retry.retries - retries + 1, headers)
+        )
+
+    def _write_stream(self, response, fd, offset, progress):
+        written = 0
+        fd.seek(offset)
+        for chunk in response.iter_content(self._chunk_size):
+            fd.write(chunk)
+            written += len(chunk)
+            progress(len(chunk))
+        return written
+
+    def _download_segment(
+        self, src, part_path, state, index, progress, response=None,
+        on_retry=None
+    ):
+        start, end = state.segment_range(index)
+        retries = self._retry.retries
+
+        with open(part_path, "r+b") as fd:
+            while start <= end:
+                try:
+                    if response is None:
+                        response = self._get(src, start, end)
+                        response.raise_for_status()
+                        if response.status_code != HTTPStatus.PARTIAL_CONTENT:
+                            raise Exception(
+                                f"Ranged request of {src} was answered "
+                                f"with {response.status_code}"
+                            )
+                    with response:
+                        start += self._write_stream(
+                            response, fd, start, progress
+                        )
+                    if start <= end:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            f"Segment {index} ended early"
+                        )
+                except Exception as e:
+                    if not self._can_resume(e, retries):
+                        raise
+                    self._logger.warning(
+                        f"Resuming segment {index} of {part_path} at byte "
+                        f"{start}: {e}"
+                    )
+                    self._wait_to_resume(e, retries, on_retry)
+                    retries -= 1
+                finally:
+                    response = None
+
+        state.mark_done(index)
+
+    def _download_single(self, response, dst, part_path, progress):
+        with response:
+            with open(part_path, "wb") as fd:
+                self._write_stream(response, fd, 0, progress)
+        os.replace(part_path, dst)
+
+    def _load_state(self, state_path, part_path):
+        state = None
+        if os.path.exists(part_path):
+            state = _DownloadState.load(state_path)
+        return state
+
+    def download(self, src, dst, pbar=False, on_retry=None):
+        """
+        Download <src> to <dst>.
+
+        :param str  src:    The URL of the file.
+        :param str  dst:    The local path to download to.
+        :param      pbar:   If set, show a progress bar. See
+                            open_progress().
+        :param on_retry:    A callable which is called with the error of
+                            every retried request.
+                            (This param is optional)
+        :return:            The number of bytes that were transferred.
+        :rtype:             int
+        """
+        part_path = dst + PARTIAL_SUFFIX
+        state_path = dst + STATE_SUFFIX
+        state = self._load_state(state_path, part_path)
+
+        # The first pending segment doubles as the range support probe, so
+        # small files take a single request
+        segment_size = state.segment_size if state else self._segment_size
+        first = state.pending[0] if state and state.pending else 0
+        start = first * segment_size
+        response = self._get_first(
+            src, start, start + segment_size - 1, on_retry
+        )
+
+        size = _parse_content_range(response)
+        ranged = response.status_code == HTTPStatus.PARTIAL_CONTENT and \
+            size is not None
+
+        bar = None
+        transferred = [0]
+        lock = threading.Lock()
+
+        def progress(length):
+            with lock:
+                transferred[0] += length
+                if bar is not None:
+                    bar.update(length)
+
+        try:
+            if not ranged:
+                if state:
+                    state.remove()
+                self._logger.info(
+                    f"Range requests aren't supported, downloading {dst} "
+                    "as a single stream"
+                )
+                length = response.headers.get("Content-Length")
+                bar = open_progress(
+                    pbar, int(length) if length else None, desc="Downloading"
+                )
+                self._download_single(response, dst, part_path, progress)
+                return transferred[0]
+
+            validator = _validator(response)
+            if state and not state.matches(size, validator):
+                self._logger.info(
+                    f"The remote file changed, restarting the download of "
+                    f"{dst}"
+                )
+                state = None
+                if first != 0:
+                    response.close()
+                    response = self._get_first(
+                        src, 0, segment_size - 1, on_retry
+                    )
+                    first = 0
+
+            if state:
+                self._logger.info(
+                    f"Resuming the download of {dst} at "
+                    f"{state.bytes_done}/{size} bytes"
+                )
+            else:
+                state = _DownloadState(
+                    state_path, size, segment_size, validator
+                )
+                with open(part_path, "wb") as fd:
+                    fd.truncate(size)
+
+            bar = open_progress(
+                pbar, size, state.bytes_done, desc="Downloading"
+            )
+
+            pending = state.pending
+            if not pending:
+                response.close()
+            else:
+                workers = max(min(self._max_workers, len(pending)), 1)
+                with ThreadPoolExecutor(
+                    workers, thread_name_prefix="insoundz-segment"
+                ) as executor:
+                    futures = [executor.submit(
+                        self._download_segment, src, part_path, state,
+                        first, progress, response, on_retry
+                    )]
+                    futures += [
+                        executor.submit(
+                            self._download_segment, src, part_path, state,
+                            index, progress, None, on_retry
+                        )
+                        for index in pending if index != first
+                    ]
+                    for future in futures:
+                        future.result()
+
+            os.replace(part_path, dst)
+            state.remove()
+            return transferred[0]
+
+        finally:
+            if bar is not None:
+                bar.close()
+
+    def stream(self, src, sink, pbar=False, on_retry=None):
+        """
+        Stream <src> into <sink> in order, without writing it to a file.
+        A dropped connection is resumed with a Range request from the last
+        byte that was written.
+
+        :param str  src:    The URL of the file.
+        :param sink:        A callable which is called with every chunk, or
+                            a writable binary object.
+        :param      pbar:   If set, show a progress bar. See
+                            open_progress().
+        :param on_retry:    See download().
+        :return:            The number of bytes that were streamed.
+        :rtype:             int
+        """
+        write = sink if callable(sink) else sink.write
+        written = 0
+        retries = self._retry.retries
+        bar = None
+        headers = {}
+
+        try:
+            while True:
+                response = self._http.get(
+                    src, headers=headers, stream=True,
+                    timeout=self._retry.timeout()
+                )
+                try:
+                    response.raise_for_status()
+                    if headers and \
+                            response.status_code != HTTPStatus.PARTIAL_CONTENT:
+                        raise Exception(
+                            f"Couldn't resume the stream of {src} at byte "
+                            f"{written}"
+                        )
+                    if bar is None:
+                        length = response.headers.get("Content-Length")
+                        bar = open_progress(
+                            pbar, int(length) if length else None,
+                            desc="Downloading"
+                        )
+                    with response:
+                        for chunk in response.iter_content(self._chunk_size):
+                            write(chunk)
+                            written += len(chunk)
+                            if bar is not None:
+                                bar.update(len(chunk))
+                    break
+                except Exception as e:
+                    if not self._can_resume(e, retries):
+                        raise
+                    self._logger.warning(
+                        f"Resuming the stream of {src} at byte {written}: {e}"
+                    )
+                    self._wait_to_resume(e, retries, on_retry)
+                    retries -= 1
+                    if written:
+                        headers = {"Range": f"bytes={written}-"}
+        finally:
+            if bar is not None:
+                bar.close()
+
+        if hasattr(sink, "flush"):
+            sink.flush()
+        return written
+
+
+def download_file_ranged(
+    src, dst, session=None, max_workers=DEFAULT_DOWNLOAD_WORKERS,
+    segment_size=DEFAULT_SEGMENT_SIZE, pbar=False, retry_policy=None,
+    logger=None
+):
+    """
+    Download <src> to <dst> over parallel, resumable Range requests.
+    See RangedDownloader.
+    """
+    downloader = RangedDownloader(
+        session, max_workers=max_workers, segment_size=segment_size,
+        retry_policy=retry_policy, logger=logger
+    )
+    return downloader.download(src, dst, pbar)
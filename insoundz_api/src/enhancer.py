@@ -1,70 +1,107 @@
+import os
 import time
-import validators
+import shutil
+import tempfile
+import threading
 import requests
 from http import HTTPStatus
 from pathlib import Path, PurePath
-from halo import Halo
-from insoundz_api.helpers import *
-from insoundz_api.api import insoundzAPI
+from insoundz_api.helpers import (
+    initialize_logger, is_url, is_file, is_folder, stream_size,
+    upload_stream, enhanced_filename,
+    DEFAULT_CHUNK_SIZE
+)
+from insoundz_api.api import insoundzAPI, DEFAULT_ENHANCE_VERSION
+from insoundz_api.cache import ResultCache, RetainedIndex, hash_file
+from insoundz_api.journal import (
+    JobJournal, PHASE_PROCESSING, PHASE_DOWNLOADING, PHASE_FINISHED,
+    PHASE_FAILED
+)
+from insoundz_api.polling import (
+    get_polling_policy, FixedPolling, DEFAULT_STATUS_INTERVAL_SEC,
+    RETRYABLE_POLL_STATUS_CODES
+)
+from insoundz_api.poller import StatusPoller
+from insoundz_api.metrics import (
+    JobTimings, EnhanceResult, SPAN_LOOKUP, SPAN_ADMISSION, SPAN_AUTH,
+    SPAN_SESSION,
+    SPAN_COMPRESS, SPAN_UPLOAD, SPAN_PROCESSING, SPAN_DOWNLOAD, SPAN_RESTORE,
+    SPAN_SPLIT, SPAN_SEGMENTS, SPAN_STITCH
+)
+from insoundz_api.progress import ProgressEmitter, TerminalRenderer
+from insoundz_api.retry import observe_retries
+from insoundz_api.compress import AudioCompressor, COMPRESSED_FORMAT
+from insoundz_api.scheduler import (
+    JobScheduler, estimate_size_cost, DEFAULT_BYTES_PER_SEC
+)
+from insoundz_api.segment import (
+    AudioSegmenter, SegmentedResult, DEFAULT_SEGMENT_SEC, DEFAULT_OVERLAP_SEC
+)
+from insoundz_api.download import RangedDownloader, DEFAULT_DOWNLOAD_WORKERS
+from insoundz_api.upload import (
+    MultipartUploader, DEFAULT_UPLOAD_WORKERS, DEFAULT_PART_SIZE
+)
+from insoundz_api.batch import (
+    EnhanceBatch, DEFAULT_BATCH_WORKERS, DEFAULT_MAX_IN_FLIGHT
+)
 
-DEFAULT_STATUS_INTERVAL_SEC = 0.5
 MAX_UNAUTHORIZED_RETRIES = 10
+DEFAULT_STREAM_NAME = "stream.wav"
 
+# Responses of a retained result URL which has expired or was removed
+RETAINED_GONE_STATUS_CODES = (
+    HTTPStatus.FORBIDDEN,
+    HTTPStatus.NOT_FOUND,
+    HTTPStatus.GONE,
+)
 
-class AudioEnhancer(object):
-    """
-    A wrapper for insoundz API client to produce audio enhancement.
+
+class AudioEnhancerBase(object):
     """
-    def __init__(
-        self,
-        client_id,
-        secret,
-        endpoint_url=insoundzAPI.get_default_endpoint_url()
-    ):
-        self._logger = initialize_logger("AudioEnhancer")
+    Progress reporting and path handling shared by AudioEnhancer and
+    AsyncAudioEnhancer.
 
-        kwargs = dict(
-            client_id=client_id,
-            secret=secret,
-            endpoint_url=endpoint_url,
-            logger=self._logger,
-        )
-        kwargsNotNone = {k: v for k, v in kwargs.items() if v is not None}
-        self._api = insoundzAPI(**kwargsNotNone)
+    The progress of every job is emitted as ProgressEvents through
+    <events>; subscribe to it to follow the jobs.
+    """
+    def __init__(self, log_stream=None, on_event=None):
+        self._logger = initialize_logger(self.__class__.__name__, log_stream)
+        self.events = ProgressEmitter(logger=self._logger)
+        if on_event:
+            self.events.subscribe(on_event)
 
-    def _progress_text(self, start_time, sid, status):
-        sec_counter = int(time.time() - start_time)
-        return f"Session ID [{sid}]; Job status [{status}]; " \
-            f"Elapsed time [{sec_counter} sec]  "
+    def _job_progress(self, src, progress_bar=False):
+        events = self.events
+        if progress_bar:
+            # The terminal renderer only follows the jobs of this call
+            events = ProgressEmitter(parent=self.events, logger=self._logger)
+            events.subscribe(TerminalRenderer())
+        return events.job(src)
 
-    def _update_status_changed(self, sid, prev_status, status, pbar, spinner):
-        if pbar and prev_status:
-            if status == "failure":
-                spinner.fail()
-            else:
-                spinner.succeed()
-        else:
-            self._logger.info(f"[{sid}] Job status [{status}]")
+    @staticmethod
+    def _transfer(progress, phase):
+        # The <pbar> of a transfer in <phase>
+        if progress is None:
+            return None
+        progress.enter(phase)
+        return progress.transfer(phase)
 
-    def _handle_enhance_failure(self, sid, msg, status, pbar, spinner):
-        if pbar:
-            if status == "downloading" or status == "processing":
-                spinner.fail()
-            else:
-                spinner.stop()
+    def _update_status_changed(self, sid, status, progress):
+        self._logger.info(f"[{sid}] Job status [{status}]")
+        # The final status is reported when the whole job is finished
+        if status != "done" and status != "failure":
+            progress.enter(status, sid)
 
+    def _handle_enhance_failure(self, sid, msg):
         self._logger.error(f"[{sid}] Failure reason: {msg}")
 
     def _get_default_dst_folder(self):
         return Path.cwd()
 
     def _get_default_dst_filename(self, src):
-        src_filename = os.path.basename(src)
-        src_filename_no_suffix = PurePath(src_filename).stem
-        src_filename_suffix = PurePath(src_filename).suffix
-        return src_filename_no_suffix + "_enhanced" + src_filename_suffix
+        return enhanced_filename(src)
 
-    def _download_enhanced_file(self, sid, url, src, dst, pbar):
+    def _get_dst_path(self, src, dst):
         if dst:
             # <dst> includes the full path (including the filename)
             if is_file(dst):
@@ -82,98 +119,778 @@ class AudioEnhancer(object):
             filename = self._get_default_dst_filename(src)
 
         Path(folder).mkdir(parents=True, exist_ok=True)
-        dst_path = os.path.join(folder, filename)
+        return os.path.join(folder, filename)
+
+    def _validate_paths(self, src, dst):
+        if is_url(src):
+            raise Exception(f"Invalid source path {src}")
+
+        if dst and is_url(dst):
+            raise Exception(f"Invalid destination path {dst}")
+
+    @staticmethod
+    def get_default_status_interval():
+        return DEFAULT_STATUS_INTERVAL_SEC
+
+
+class AudioEnhancer(AudioEnhancerBase):
+    """
+    A wrapper for insoundz API client to produce audio enhancement.
+    """
+    def __init__(
+        self,
+        client_id,
+        secret,
+        endpoint_url=insoundzAPI.get_default_endpoint_url(),
+        pool_maxsize=None,
+        keep_alive=None,
+        prewarm=None,
+        token_cache=None,
+        log_stream=None,
+        download_workers=DEFAULT_DOWNLOAD_WORKERS,
+        upload_workers=DEFAULT_UPLOAD_WORKERS,
+        part_size=DEFAULT_PART_SIZE,
+        cache=None,
+        retained_index=None,
+        journal=None,
+        scheme=None,
+        metrics=None,
+        on_event=None,
+        retry_policy=None,
+        compress=None,
+        scheduler=None,
+        callback=None,
+    ):
+        super().__init__(log_stream, on_event)
+
+        kwargs = dict(
+            client_id=client_id,
+            secret=secret,
+            endpoint_url=endpoint_url,
+            logger=self._logger,
+            pool_maxsize=pool_maxsize,
+            keep_alive=keep_alive,
+            prewarm=prewarm,
+            token_cache=token_cache,
+            scheme=scheme,
+            retry_policy=retry_policy,
+        )
+        kwargsNotNone = {k: v for k, v in kwargs.items() if v is not None}
+        self._api = insoundzAPI(**kwargsNotNone)
+
+        self._downloader = RangedDownloader(
+            self._api.session, max_workers=download_workers,
+            retry_policy=self._api.retry_policy, logger=self._logger
+        )
+        self._uploader = MultipartUploader(
+            self._api.session, max_workers=upload_workers,
+            part_size=part_size, retry_policy=self._api.retry_policy,
+            logger=self._logger
+        )
+
+        if isinstance(cache, str):
+            cache = ResultCache(cache, logger=self._logger)
+        self._cache = cache
+
+        if retained_index is True:
+            retained_index = RetainedIndex()
+        elif isinstance(retained_index, str):
+            retained_index = RetainedIndex(retained_index)
+        self._retained = retained_index
+
+        if journal is True:
+            journal = JobJournal()
+        elif isinstance(journal, str):
+            journal = JobJournal(journal)
+        self._journal = journal
+        self._metrics = metrics
+
+        if compress is True:
+            compress = AudioCompressor(logger=self._logger)
+        self._compressor = compress or None
+
+        if scheduler is True:
+            scheduler = JobScheduler(logger=self._logger)
+        if scheduler:
+            scheduler.bind(self._api.balance)
+        self._scheduler = scheduler or None
+
+        self._poller = None
+        self._poller_lock = threading.Lock()
+
+        if callback is True:
+            from insoundz_api.callback import CallbackListener
+            callback = CallbackListener(logger=self._logger)
+        if callback:
+            callback.bind(self._notify)
+        self._callback = callback or None
+
+    @property
+    def cache(self):
+        """
+        The ResultCache of enhanced files, or None.
+        """
+        return self._cache
+
+    @property
+    def scheduler(self):
+        """
+        The JobScheduler which admits the jobs, or None.
+        """
+        return self._scheduler
+
+    @property
+    def callback(self):
+        """
+        The CallbackListener which is notified when sessions are done, or
+        None.
+        """
+        return self._callback
+
+    @property
+    def poller(self):
+        """
+        A StatusPoller which tracks in-flight sessions from a single
+        background thread. Submit session IDs to it and wait on the
+        returned futures.
+        """
+        with self._poller_lock:
+            if self._poller is None:
+                self._poller = StatusPoller(self._api, logger=self._logger)
+            return self._poller
+
+    def close(self):
+        """
+        Stop the status poller and close the pooled connections of the
+        underlying insoundzAPI client.
+        """
+        if self._poller:
+            self._poller.close()
+        if self._journal:
+            self._journal.close()
+        if self._compressor:
+            self._compressor.close()
+        if self._scheduler:
+            self._scheduler.close()
+        if self._callback:
+            self._callback.close()
+        self._api.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _download_enhanced_file(
+        self, sid, url, src, dst, progress=None, timings=None
+    ):
+        dst_path = self._get_dst_path(src, dst)
+        timings = timings or JobTimings()
 
         self._logger.info(f"[{sid}] Downloading enhanced file to {dst_path}")
-        download_file(url, str(dst_path), pbar)
+        with timings.span(SPAN_DOWNLOAD):
+            timings.bytes_downloaded += self._downloader.download(
+                url, str(dst_path),
+                pbar=self._transfer(progress, SPAN_DOWNLOAD),
+                on_retry=timings.retried
+            )
         self._logger.info(f"[{sid}] {dst_path} was downloaded succesfully.")
 
-    def _handle_enhance_done(self, sid, url, src, no_download, dst, pbar):
+        return self._restore(sid, dst_path, src, progress, timings)
+
+    def _restore(self, sid, path, src, progress=None, timings=None):
+        # The result of a compressed upload is compressed too
+        if not self._compressor or \
+                not self._compressor.is_compressed(str(path), src):
+            return path
+
+        timings = timings or JobTimings()
+        if progress is not None:
+            progress.enter(SPAN_RESTORE)
+        with timings.span(SPAN_RESTORE):
+            path = self._compressor.finish(str(path), src)
+        self._logger.info(f"[{sid}] Restored {path}")
+        return path
+
+    def _result_version(self, compressed):
+        # Results of compressed uploads are kept apart, since the server
+        # returns them compressed
+        if compressed:
+            return f"{DEFAULT_ENHANCE_VERSION}+{COMPRESSED_FORMAT.lower()}"
+        return DEFAULT_ENHANCE_VERSION
+
+    def _stream_enhanced_file(
+        self, sid, url, sink, progress=None, timings=None
+    ):
+        timings = timings or JobTimings()
+
+        self._logger.info(f"[{sid}] Streaming enhanced file to {sink!r}")
+        with timings.span(SPAN_DOWNLOAD):
+            size = self._downloader.stream(
+                url, sink, pbar=self._transfer(progress, SPAN_DOWNLOAD),
+                on_retry=timings.retried
+            )
+        timings.bytes_downloaded += size
+        self._logger.info(f"[{sid}] {size} bytes were streamed succesfully.")
+
+    def _handle_enhance_done(
+        self, sid, url, src, no_download, dst, progress=None
+    ):
         self._logger.info(f"[{sid}] Enhanced file URL is located at {url}")
 
         # Downloading enhanced file
         if not no_download:
-            self._download_enhanced_file(sid, url, src, dst, pbar)
+            self._download_enhanced_file(sid, url, src, dst, progress)
+
+    def _notify(self, sid, status, resp_info):
+        # Called from the thread of the CallbackListener
+        return self.poller.notify(sid, status, resp_info)
 
-    def _wait_till_done(self, sid, status_interval_sec, pbar, spinner):    
+    def _callback_url(self):
+        return self._callback.url if self._callback else None
+
+    def _polling_policy(self, status_interval_sec):
+        # Sessions which are notified are only polled in case the
+        # notification is lost
+        if self._callback:
+            return FixedPolling(self._callback.fallback_interval_sec)
+        return get_polling_policy(status_interval_sec)
+
+    def _wait_notified(
+        self, sid, policy, progress, file_size=None, timings=None
+    ):
+        # The session is resolved by its notification, or by the poller if
+        # the notification is lost
+        timings = timings or JobTimings()
+        try:
+            with timings.span(SPAN_PROCESSING):
+                future = self.poller.submit(
+                    sid, file_size=file_size, polling_policy=policy
+                )
+                status, resp_info = future.result()
+        except Exception as e:
+            self._handle_enhance_failure(sid, e)
+            raise
+        timings.polls = future.polls
+        self._logger.info(
+            f"[{sid}] Job status was "
+            f"{'notified' if future.pushed else 'polled'} after "
+            f"{future.polls} polls"
+        )
+        return status, resp_info
+
+    def _wait_till_done(
+        self, sid, policy, progress, file_size=None, timings=None
+    ):
         prev_status = None
         status = None
         retries = MAX_UNAUTHORIZED_RETRIES
+        state = policy.new_state(file_size)
+        interval = policy.next_interval(state)
+        timings = timings or JobTimings()
+        span_start = time.time()
 
-        while not time.sleep(status_interval_sec):
+        while not time.sleep(interval):
+            headers = None
             try:
-                status, resp_info = self._api.enhance_status(sid)
+                status, resp_info, headers = self._api.enhance_status(
+                    sid, with_headers=True
+                )
+                policy.observe(state, status)
+                timings.polls = state.polls
 
                 if status != prev_status:
-                    self._update_status_changed(
-                        sid, prev_status, status, pbar, spinner
-                    )
-                    start_time = time.time()
+                    self._update_status_changed(sid, status, progress)
+                    # Every server-side status gets its own span
+                    if prev_status:
+                        now = time.time()
+                        timings.add_span(prev_status, span_start, now)
+                        span_start = now
 
                 if status == "done" or status == "failure":
+                    if not prev_status:
+                        timings.add_span(SPAN_PROCESSING, span_start)
+                    self._logger.info(
+                        f"[{sid}] Job status was polled {state.polls} times"
+                    )
                     return status, resp_info
 
-                if pbar:
-                    spinner.start(
-                        text=self._progress_text(start_time, sid, status)
-                    )
+                progress.polled(status, state.polls)
                 prev_status = status
 
             except requests.exceptions.HTTPError as e:
-                if e.response.status_code == HTTPStatus.UNAUTHORIZED and retries:
+                headers = e.response.headers
+                if e.response.status_code in RETRYABLE_POLL_STATUS_CODES \
+                        and retries:
                     retries -= 1
+                    timings.retried(e)
                 else:
-                    self._handle_enhance_failure(sid, e, status, pbar, spinner)
+                    self._handle_enhance_failure(sid, e)
                     raise
 
             except Exception as e:
-                self._handle_enhance_failure(sid, e, status, pbar, spinner)
+                self._handle_enhance_failure(sid, e)
                 raise
 
             else:
                 retries = MAX_UNAUTHORIZED_RETRIES
 
+            interval = policy.next_interval(state, headers)
+
     def _enhancement_finish(
-        self, sid, status, info, src, no_download, dst, pbar, spinner
+        self, sid, status, info, src, no_download, dst, progress,
+        sink=None, timings=None
     ):
         if status == "done":
             self._logger.info(
                 f"[{sid}] Enhanced file URL is located at {info}"
             )
 
+            # Streaming the enhanced file into the sink
+            if sink is not None:
+                self._stream_enhanced_file(
+                    sid, info, sink, progress, timings
+                )
+
             # Downloading enhanced file
-            if not no_download:
-                self._download_enhanced_file(sid, info, src, dst, pbar)
+            elif not no_download:
+                return self._download_enhanced_file(
+                    sid, info, src, dst, progress, timings
+                )
 
-        elif status == "failure" and pbar:
-            spinner.stop()
+        elif status == "failure":
             self._logger.error(f"[{sid}] Failure reason: {info}")
 
         else:
             self._logger.exception(f"[{sid}] Unexpected status {status}")
 
-    def _enhancement_start(self, api, src, dst, retention, preset, pbar):
+    def _upload(self, src, sid, upload, progress, timings):
+        pbar = self._transfer(progress, SPAN_UPLOAD)
+        with timings.span(SPAN_UPLOAD):
+            report = self._uploader.upload(src, sid, upload, pbar)
+        timings.bytes_uploaded += report.bytes_uploaded
+        timings.retries += sum(part.attempts - 1 for part in report.parts)
+        self._logger.info(f"[{sid}] Uploaded {report}")
+        return report
+
+    def _compress(self, src, compression, progress, timings):
+        # The CompressedAudio to upload instead of <src>, or None.
+        # <compression> is the future of a compression that was submitted
+        # in advance.
+        if compression is None:
+            compression = self._compressor.submit(src)
+        if compression is None:
+            return None
+
+        if progress is not None:
+            progress.enter(SPAN_COMPRESS)
+        try:
+            compressed = compression.result()
+        except Exception as e:
+            self._logger.warning(f"Couldn't compress {src}: {e}")
+            return None
+        if compressed is None:
+            return None
+
+        timings.add_span(
+            SPAN_COMPRESS, compressed.start_time, compressed.end_time
+        )
+        timings.bytes_original = compressed.original_size
+        timings.bytes_compressed = compressed.size
+        self._logger.info(
+            f"Compressed {src} by {compressed.ratio:.2f}x in "
+            f"{compressed.encode_sec:.2f} sec"
+        )
+        return compressed
+
+    def _enhancement_start(
+        self, api, src, dst, retention, preset, progress=None, timings=None,
+        compress=True, compression=None
+    ):
         self._logger.info(f"Sending a request to insoundzAPI to enhance {src}")
 
-        if validators.url(src):
-            raise Exception(f"Invalid source path {src}")
+        self._validate_paths(src, dst)
+        timings = timings or JobTimings(src)
 
-        if dst and validators.url(dst):
-            raise Exception(f"Invalid destination path {dst}")
+        compressed = None
+        if self._compressor and compress:
+            compressed = self._compress(src, compression, progress, timings)
+        try:
+            return self._start_upload(
+                api, compressed.path if compressed else src, retention,
+                preset, progress, timings
+            )
+        finally:
+            if compressed:
+                compressed.remove()
 
-        sid, src_url = api.enhance_file(retention, preset)
+    def _start_upload(self, api, src, retention, preset, progress, timings):
+        # A multipart upload of <src> which crashed is resumed
+        resumed = self._uploader.resume(src)
+        if resumed:
+            sid, upload = resumed
+            if progress is not None:
+                progress.sid = sid
+            try:
+                report = self._upload(src, sid, upload, progress, timings)
+                return sid, report
+            except requests.exceptions.HTTPError as e:
+                # The part URLs have probably expired, start over
+                self._logger.warning(
+                    f"[{sid}] Couldn't resume the upload of {src}: {e}"
+                )
+                self._uploader.discard(src)
+
+        with timings.span(SPAN_SESSION):
+            if self._uploader.use_multipart(src):
+                sid, upload = api.enhance_file_multipart(
+                    os.path.getsize(src), self._uploader.part_size,
+                    retention, preset, callback_url=self._callback_url()
+                )
+            else:
+                sid, src_url = api.enhance_file(
+                    retention, preset, callback_url=self._callback_url()
+                )
+                upload = {"upload_url": src_url}
+        timings.sid = sid
+        if progress is not None:
+            progress.sid = sid
 
         self._logger.info(
             f"[{sid}] Uploading {src} to insoundzAPI for processing."
         )
-        upload_file(src, src_url, pbar)
+        report = self._upload(src, sid, upload, progress, timings)
 
-        return sid
+        return sid, report
+
+    def _enhancement_start_stream(
+        self, api, data, size, name, dst, retention, preset, progress=None,
+        timings=None
+    ):
+        self._logger.info(
+            f"Sending a request to insoundzAPI to enhance {name}"
+        )
+
+        if dst and is_url(dst):
+            raise Exception(f"Invalid destination path {dst}")
+
+        timings = timings or JobTimings(name)
+        with timings.span(SPAN_SESSION):
+            sid, src_url = api.enhance_file(
+                retention, preset, callback_url=self._callback_url()
+            )
+        timings.sid = sid
+        if progress is not None:
+            progress.sid = sid
+
+        self._logger.info(
+            f"[{sid}] Streaming {name} to insoundzAPI for processing."
+        )
+        pbar = self._transfer(progress, SPAN_UPLOAD)
+        with timings.span(SPAN_UPLOAD):
+            size = upload_stream(
+                data, src_url, size=size, pbar=pbar, session=api.session,
+                retry_policy=api.retry_policy
+            )
+        timings.bytes_uploaded += size
+        self._logger.info(f"[{sid}] Uploaded {size} bytes")
+
+        return sid, size
+
+    def _admit(self, src, cost, duration, priority, deadline, timings):
+        # Wait in the queue of the scheduler before starting a session
+        if not self._scheduler:
+            return None
+        ticket = self._scheduler.wait(self._scheduler.enqueue(
+            src, cost, priority, deadline, duration
+        ))
+        timings.add_span(
+            SPAN_ADMISSION, ticket.enqueued_at, ticket.admitted_at
+        )
+        return ticket
+
+    def _release(self, ticket, charged):
+        if ticket is not None:
+            self._scheduler.release(ticket, charged)
+
+    def _get_cached(self, key, src, dst, sink):
+        if sink is not None:
+            path = self._cache.lookup(key)
+            if path:
+                write = sink if callable(sink) else sink.write
+                with open(path, "rb") as fd:
+                    for chunk in iter(
+                        lambda: fd.read(DEFAULT_CHUNK_SIZE), b""
+                    ):
+                        write(chunk)
+                if hasattr(sink, "flush"):
+                    sink.flush()
+            return path
+
+        dst_path = self._get_dst_path(src, dst)
+        if self._cache.get(key, dst_path):
+            return self._restore(None, dst_path, src)
+        return None
+
+    def _journal_dst(self, src, dst):
+        # The destination is resolved now, since the job may be resumed
+        # from another working directory
+        if dst:
+            return os.path.abspath(dst)
+        return os.path.join(
+            self._get_default_dst_folder(), self._get_default_dst_filename(src)
+        )
+
+    def _journal_add(self, src, dst, preset, retention, no_download, local):
+        if not self._journal:
+            return None
+        # Streams are recorded by name only, they can't be uploaded again
+        if local:
+            src = os.path.abspath(src)
+        return self._journal.add(
+            src, self._journal_dst(src, dst), preset, retention, no_download
+        )
+
+    def _journal_update(self, job_id, **fields):
+        if self._journal and job_id is not None:
+            self._journal.update(job_id, **fields)
+
+    def _journal_status(self, job_id, status, resp_info):
+        if status == "done":
+            self._journal_update(
+                job_id, phase=PHASE_DOWNLOADING, result_url=resp_info
+            )
+        else:
+            self._journal_update(
+                job_id, phase=PHASE_FAILED, error=str(resp_info)
+            )
+
+    def _finish_result(
+        self, sid, status, resp_info, src, no_download, dst, progress, sink,
+        cache_key, timings=None
+    ):
+        # Fill the result cache on the way
+        if cache_key and status == "done" and sink is not None:
+            writer = self._cache.writer(cache_key)
+            write = sink if callable(sink) else sink.write
+
+            def tee(chunk):
+                writer.write(chunk)
+                write(chunk)
+
+            try:
+                self._enhancement_finish(
+                    sid, status, resp_info, src,
+                    no_download, dst, progress, tee, timings
+                )
+            except Exception:
+                writer.abort()
+                raise
+
+            if hasattr(sink, "flush"):
+                sink.flush()
+            writer.commit()
+
+        else:
+            dst_path = self._enhancement_finish(
+                sid, status, resp_info, src,
+                no_download, dst, progress, sink, timings
+            )
+            if cache_key and dst_path:
+                self._cache.put(cache_key, dst_path)
+
+    def _use_retained(
+        self, key, src, no_download, dst, progress, sink, cache_key,
+        timings=None
+    ):
+        retained = self._retained.get(key)
+        if not retained:
+            return None
+
+        sid, url = retained
+        progress.sid = sid
+        self._logger.info(f"[{sid}] Reusing the retained result of {src}")
+
+        if not no_download or sink is not None:
+            try:
+                self._finish_result(
+                    sid, "done", url, src, no_download, dst, progress,
+                    sink, cache_key, timings
+                )
+                return sid, "done", url
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code not in RETAINED_GONE_STATUS_CODES:
+                    raise
+                self._logger.info(f"[{sid}] The retained URL is gone")
+
+        # The URL may have been re-signed, ask the server for the result
+        try:
+            status, info = self._api.enhance_status(sid)
+        except requests.exceptions.HTTPError as e:
+            self._logger.info(f"[{sid}] The retained session is gone: {e}")
+            status = None
+
+        if status != "done":
+            self._retained.delete(key)
+            return None
+
+        try:
+            self._finish_result(
+                sid, status, info, src, no_download, dst, progress, sink,
+                cache_key, timings
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code not in RETAINED_GONE_STATUS_CODES:
+                raise
+            self._retained.delete(key)
+            return None
+
+        self._retained.set(key, sid, info)
+        return sid, status, info
+
+    def _enhance(
+        self, start, src, no_download, dst, status_interval_sec,
+        progress_bar, sink, cache_src=None, preset=None, retention=None,
+        cost=None, duration=None, priority=0, deadline=None
+    ):
+        progress = self._job_progress(src, progress_bar)
+        progress.started()
+
+        sid = None
+        status = None
+        resp_info = None
+        error = None
+        job_id = None
+        timings = JobTimings(src)
+        handshakes = self._api.session.thread_handshakes
+
+        # Count the requests that are retried by the job
+        with observe_retries(timings.retried):
+            try:
+                result_key = None
+                cache_key = None
+                cached = None
+                with timings.span(SPAN_LOOKUP):
+                    if cache_src and (self._cache or self._retained):
+                        result_key = ResultCache.key(
+                            hash_file(cache_src), preset,
+                            self._result_version(
+                                self._compressor is not None and sink is None
+                            )
+                        )
+
+                    # Identical audio is enhanced only once
+                    if self._cache and result_key and \
+                            (sink is not None or not no_download):
+                        cache_key = result_key
+                        cached = self._get_cached(cache_key, src, dst, sink)
+                if cached:
+                    self._logger.info(f"Using the cached result of {src}")
+                    timings.cached = True
+                    return self._job_result(
+                        timings, progress, None, "done", cached
+                    )
+
+                # And is processed only once within the retention time
+                if self._retained and result_key:
+                    retained = self._use_retained(
+                        result_key, src, no_download, dst, progress, sink,
+                        cache_key, timings
+                    )
+                    if retained:
+                        timings.retained = True
+                        return self._job_result(timings, progress, *retained)
+
+                job_id = self._journal_add(
+                    src, dst, preset, retention, no_download and sink is None,
+                    local=cache_src is not None
+                )
+                ticket = None
+                try:
+                    try:
+                        ticket = self._admit(
+                            src, cost, duration, priority, deadline, timings
+                        )
+                        with timings.span(SPAN_AUTH):
+                            self._api.authenticate()
+                        sid, file_size = start(progress, timings)
+                    except Exception as e:
+                        self._journal_update(
+                            job_id, phase=PHASE_FAILED, error=str(e)
+                        )
+                        raise
+                    self._journal_update(
+                        job_id, session_id=sid, phase=PHASE_PROCESSING
+                    )
+
+                    wait = self._wait_till_done
+                    if self._callback:
+                        wait = self._wait_notified
+                    status, resp_info = wait(
+                        sid, self._polling_policy(status_interval_sec),
+                        progress, file_size, timings
+                    )
+                finally:
+                    # The session is over, its download takes no slot
+                    self._release(
+                        ticket, sid is not None and status != "failure"
+                    )
+                self._journal_status(job_id, status, resp_info)
+
+                if self._retained and result_key and retention and \
+                        status == "done":
+                    self._retained.set(
+                        result_key, sid, resp_info,
+                        time.time() + int(retention) * 60
+                    )
+
+                self._finish_result(
+                    sid, status, resp_info, src, no_download, dst, progress,
+                    sink, cache_key, timings
+                )
+                if status == "done":
+                    self._journal_update(job_id, phase=PHASE_FINISHED)
+
+            except KeyError as e:
+                self._logger.error(f"[{sid}] invalid key {e}")
+                self._journal_update(job_id, error=str(e))
+                error = e
+
+            except Exception as e:
+                self._logger.error(f"[{sid}] {e}")
+                self._journal_update(job_id, error=str(e))
+                error = e
+
+        handshakes = self._api.session.thread_handshakes - handshakes
+        self._logger.info(f"[{sid}] Opened {handshakes} new connection(s)")
+
+        return self._job_result(
+            timings, progress, sid, status, resp_info, error
+        )
+
+    def _job_result(
+        self, timings, progress, sid, status, resp_info, error=None
+    ):
+        timings.finish(sid, status, error)
+        self._report_timings(timings)
+        progress.sid = sid
+        progress.finished(status, resp_info, error)
+        return EnhanceResult(sid, status, resp_info, timings)
+
+    def _report_timings(self, timings):
+        self._logger.info(f"[{timings.sid}] Timings: {timings}")
+        if not self._metrics:
+            return
+        try:
+            self._metrics(timings)
+        except Exception as e:
+            self._logger.warning(f"[{timings.sid}] Metrics hook failed: {e}")
 
     def enhance_file(
         self, src, no_download=False, dst=None, retention=None,
         preset=None, status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC,
-        progress_bar=False
+        progress_bar=False, sink=None, priority=0, deadline=None
     ):
         """
         It uses insoundz_api package to enhance the file that is located
@@ -183,6 +900,10 @@ class AudioEnhancer(object):
         If <dst> is a URL, the enhanced file will be uploaded to this URL.
         If <dst> is a file or directory path, the enhanced file will be
         downloaded to the local machine (unless the <no_download> flag is set).
+        If the enhancer has a result cache which already holds the enhanced
+        file of the same audio and preset, it is used without contacting
+        insoundzAPI (the returned <sid> is None and <resp_info> is the local
+        path of the enhanced file).
 
         :param str  src:            Contains a URL or a local path of the
                                     original audio file.
@@ -218,45 +939,390 @@ class AudioEnhancer(object):
                                     The client can set the frequency of
                                     querying the status of the audio
                                     enhancement process.
+                                    Either a number of seconds, a polling
+                                    policy name ('fixed', 'backoff' or
+                                    'adaptive') or a PollingPolicy object.
                                     (This param is optional)
         :param int  progress_bar:   The client can enable/disable the display
                                     of the audio enhancement progress bar.
                                     (This param is optional)
+        :param      sink:           Stream the enhanced file into <sink>
+                                    instead of downloading it to <dst>.
+                                    Either a callable which is called with
+                                    every chunk, or a writable binary
+                                    object (e.g. a pipe to the next stage
+                                    or sys.stdout.buffer).
+                                    (This param is optional)
+        :param int  priority:       If the enhancer has a JobScheduler, jobs
+                                    of higher priorities are admitted first.
+                                    (This param is optional)
+        :param float deadline:      If the enhancer has a JobScheduler, the
+                                    time the job should be done by (an
+                                    epoch timestamp). Jobs with deadlines
+                                    are admitted before the rest of their
+                                    priority.
+                                    (This param is optional)
         :return:    sid:            The session ID.
                     status:         Enhancment final status ("done" or "failure")
                     resp_info:      Final status additinal info (Enhanced file url
                                     if status "done. Error message if status "failure".)
-        :rtype:                     Tuple
+                    The tuple also carries the JobTimings of the job in
+                    its <timings> attribute.
+        :rtype:                     EnhanceResult
         """
 
-        spinner = None
-        if progress_bar:
-            spinner = Halo(spinner='dots', color='magenta', placement='right')
+        def start(progress, timings):
+            # Streamed results can't be restored, so they aren't compressed
+            sid, report = self._enhancement_start(
+                self._api, src, dst, retention, preset, progress, timings,
+                compress=sink is None
+            )
+            # The processing time follows the size of the source
+            return sid, timings.bytes_original or report.size
 
-        sid = None
+        return self._enhance(
+            start, src, no_download, dst, status_interval_sec, progress_bar,
+            sink, cache_src=src, preset=preset, retention=retention,
+            priority=priority, deadline=deadline
+        )
+
+    def enhance_stream(
+        self, data, size=None, name=DEFAULT_STREAM_NAME, no_download=False,
+        dst=None, retention=None, preset=None,
+        status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC, progress_bar=False,
+        sink=None, priority=0, deadline=None
+    ):
+        """
+        Same as enhance_file(), but the original audio is streamed straight
+        into the upload instead of being read from a local file.
+
+        :param      data:           The original audio: bytes, bytearray or
+                                    memoryview, a readable binary object
+                                    (e.g. an in-memory buffer, a socket file
+                                    or sys.stdin.buffer) or an iterator of
+                                    bytes chunks.
+        :param int  size:           The size of <data> [bytes], when it
+                                    can't be told from <data> itself (e.g.
+                                    a generator). Data of an unknown size is
+                                    uploaded with chunked transfer encoding.
+                                    (This param is optional)
+        :param str  name:           A file name for <data>, the default
+                                    <dst> is derived from it like from the
+                                    <src> of enhance_file().
+                                    (This param is optional)
+
+        See enhance_file() for the rest of the parameters and the return
+        value.
+        """
+        if size is None:
+            size = stream_size(data)
+
+        return self._enhance(
+            lambda progress, timings: self._enhancement_start_stream(
+                self._api, data, size, name, dst, retention, preset,
+                progress, timings
+            ),
+            name, no_download, dst, status_interval_sec, progress_bar, sink,
+            preset=preset, retention=retention,
+            cost=estimate_size_cost(size or 0),
+            duration=(size or 0) / DEFAULT_BYTES_PER_SEC, priority=priority,
+            deadline=deadline
+        )
+
+    def enhance_many(
+        self, sources, no_download=False, dst=None, retention=None,
+        preset=None, max_workers=DEFAULT_BATCH_WORKERS,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC, progress_bar=False,
+        order=None, priority=0, deadline=None
+    ):
+        """
+        Enhance many files concurrently.
+        Uploads, status polling and downloads run as separate stages, so the
+        network stays busy while the server processes other files.
+
+        :param iterable sources:    Local paths of the original audio files.
+                                    An item can also be a (src, dst) tuple
+                                    to set the destination per file, or a
+                                    BatchJob to set its priority and
+                                    deadline too.
+        :param bool no_download:    See enhance_file().
+        :param str  dst:            A local directory to download the
+                                    enhanced files to.
+                                    (This param is optional)
+        :param int  retention:      See enhance_file().
+        :param str  preset:         See enhance_file().
+        :param int  max_workers:    The number of concurrent uploads and
+                                    the number of concurrent downloads.
+                                    Make sure the connection pool is large
+                                    enough (see <pool_maxsize>).
+        :param int  max_in_flight:  The maximal number of files that were
+                                    started but are not done yet.
+        :param int  status_interval_sec:
+                                    See enhance_file().
+        :param bool progress_bar:   If set, display a single progress bar
+                                    of the whole batch.
+                                    (This param is optional)
+        :param str  order:          The order in which the waiting jobs of
+                                    the same priority are started: 'fifo',
+                                    or 'sjf' (the shortest audio first).
+                                    Defaults to the order of the
+                                    JobScheduler, or 'fifo'.
+                                    (This param is optional)
+        :param int  priority:       The priority of the sources which
+                                    aren't BatchJobs. See enhance_file().
+                                    (This param is optional)
+        :param float deadline:      The deadline of the sources which
+                                    aren't BatchJobs. See enhance_file().
+                                    (This param is optional)
+        :return:    An EnhanceBatch. Iterating over it yields a BatchResult
+                    per file as soon as the file is done. The aggregate
+                    throughput is available through its <stats> attribute.
+        :rtype:     EnhanceBatch
+        """
+        return EnhanceBatch(
+            self, sources, dst=dst, no_download=no_download,
+            retention=retention, preset=preset, max_workers=max_workers,
+            max_in_flight=max_in_flight,
+            polling_policy=self._polling_policy(status_interval_sec),
+            progress_bar=progress_bar,
+            order=order or (self._scheduler and self._scheduler.order),
+            priority=priority, deadline=deadline
+        )
+
+    def enhance_segmented(
+        self, src, dst=None, retention=None, preset=None,
+        segment_sec=DEFAULT_SEGMENT_SEC, overlap_sec=DEFAULT_OVERLAP_SEC,
+        max_workers=DEFAULT_BATCH_WORKERS,
+        status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC, progress_bar=False
+    ):
+        """
+        Enhance a long recording as concurrent sessions of its segments, so
+        the latency doesn't grow with its whole duration.
+        <src> is cut at low-energy points into overlapping segments of
+        about <segment_sec>, the segments are enhanced like the files of
+        enhance_many(), and the enhanced segments are stitched into <dst>
+        with crossfades over the overlaps. The stitched file has exactly
+        the frames of <src>.
+        A recording which isn't longer than a segment is enhanced by
+        enhance_file().
+        Requires the numpy and soundfile packages.
+
+        :param str   src:           A local path of the original audio file.
+        :param float segment_sec:   The nominal length of a segment [sec].
+        :param float overlap_sec:   The overlap of consecutive segments
+                                    [sec].
+        :param int   max_workers:   See enhance_many().
+
+        See enhance_file() for the rest of the parameters.
+
+        :return:    sids:           The session ID of every segment.
+                    status:         "done" or "failure".
+                    resp_info:      The path of the enhanced file if status
+                                    is "done". The failure reason otherwise.
+                    The tuple also carries the JobTimings of the whole job
+                    in its <timings> attribute, and the BatchResult of
+                    every segment in its <segments> attribute.
+        :rtype:                     SegmentedResult
+        """
+        self._validate_paths(src, dst)
+        segmenter = AudioSegmenter(
+            segment_sec, overlap_sec, logger=self._logger
+        )
+        segments = segmenter.plan(src)
+        if len(segments) == 1:
+            return self.enhance_file(
+                src, dst=dst, retention=retention, preset=preset,
+                status_interval_sec=status_interval_sec,
+                progress_bar=progress_bar
+            )
+
+        progress = self.events.job(src)
+        progress.started()
+        timings = JobTimings(src)
+        results = []
         status = None
         resp_info = None
+        error = None
+        folder = tempfile.mkdtemp(prefix="insoundz_segments_")
 
         try:
-            sid = self._enhancement_start(
-                self._api, src, dst, retention, preset, progress_bar
+            self._logger.info(
+                f"Enhancing {src} as {len(segments)} segments"
             )
-            status, resp_info = self._wait_till_done(
-                sid, status_interval_sec, progress_bar, spinner
+            progress.enter(SPAN_SPLIT)
+            with timings.span(SPAN_SPLIT):
+                segmenter.split(src, segments, folder)
+
+            progress.enter(SPAN_SEGMENTS)
+            enhanced = os.path.join(folder, "enhanced")
+            with timings.span(SPAN_SEGMENTS):
+                batch = self.enhance_many(
+                    [
+                        (segment.path, os.path.join(
+                            enhanced, os.path.basename(segment.path)
+                        ))
+                        for segment in segments
+                    ],
+                    retention=retention, preset=preset,
+                    max_workers=max_workers,
+                    status_interval_sec=status_interval_sec,
+                    progress_bar=progress_bar
+                )
+                by_src = {result.src: result for result in batch}
+            results = [by_src[segment.path] for segment in segments]
+
+            failed = [result for result in results if not result.ok]
+            if failed:
+                status = "failure"
+                resp_info = f"{len(failed)}/{len(results)} segments " \
+                    f"failed: {failed[0].error or failed[0].resp_info}"
+            else:
+                dst_path = self._get_dst_path(src, dst)
+                progress.enter(SPAN_STITCH)
+                with timings.span(SPAN_STITCH):
+                    segmenter.stitch(
+                        src, segments, [result.dst for result in results],
+                        dst_path
+                    )
+                status = "done"
+                resp_info = str(dst_path)
+                self._logger.info(f"{dst_path} was stitched succesfully.")
+
+        except Exception as e:
+            self._logger.error(f"{src}: {e}")
+            error = e
+
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        # The segments reported their own transfers, polls and retries
+        timings.finish(None, status, error)
+        self._report_timings(timings)
+        progress.finished(status, resp_info, error)
+        return SegmentedResult(
+            tuple(result.sid for result in results), status, resp_info,
+            timings, results
+        )
+
+    def _resume_download(self, job, url, progress):
+        try:
+            self._enhancement_finish(
+                job.session_id, "done", url, job.src, job.no_download,
+                job.dst, progress
             )
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code not in RETAINED_GONE_STATUS_CODES:
+                raise
+            # The result URL has expired, ask for a new one
+            status, url = self._api.enhance_status(job.session_id)
+            if status != "done":
+                raise
+            self._journal_update(job.id, result_url=url)
             self._enhancement_finish(
-                sid, status, resp_info, src,
-                no_download, dst, progress_bar, spinner
+                job.session_id, status, url, job.src, job.no_download,
+                job.dst, progress
             )
+        return url
 
-        except KeyError as e:
-            self._logger.error(f"[{sid}] invalid key {e}")
+    def _resume_job(self, job, future, progress_bar):
+        sid = job.session_id
+        progress = self._job_progress(job.src, progress_bar)
+        progress.sid = sid
+        progress.started()
+        timings = JobTimings(job.src)
+        timings.sid = sid
+        try:
+            if future is not None:
+                progress.enter(SPAN_PROCESSING)
+                status, resp_info = future.result()
+                timings.polls = future.polls
+                self._journal_status(job.id, status, resp_info)
+                if status != "done":
+                    self._logger.error(f"[{sid}] Failure reason: {resp_info}")
+                    progress.finished(status, resp_info)
+                    timings.finish(sid, status, resp_info)
+                    return EnhanceResult(sid, status, resp_info, timings)
+            else:
+                resp_info = job.result_url
+
+            resp_info = self._resume_download(job, resp_info, progress)
+            self._journal_update(job.id, phase=PHASE_FINISHED)
+            progress.finished("done", resp_info)
+            timings.finish(sid, "done")
+            return EnhanceResult(sid, "done", resp_info, timings)
 
         except Exception as e:
             self._logger.error(f"[{sid}] {e}")
+            self._journal_update(job.id, error=str(e))
+            progress.finished(None, error=e)
+            timings.finish(sid, None, e)
+            return EnhanceResult(sid, None, None, timings)
 
-        return sid, status, resp_info
+    def resume(
+        self, status_interval_sec=DEFAULT_STATUS_INTERVAL_SEC,
+        progress_bar=False
+    ):
+        """
+        Finish the unfinished jobs of the journal, e.g. after the process
+        which started them died.
+        Jobs which already have a session are re-attached to it: their
+        status is polled and their enhanced file is downloaded, without
+        uploading them again. Jobs which died before their upload was
+        complete are started again (a multipart upload resumes from its
+        missing parts).
 
-    @staticmethod
-    def get_default_status_interval():
-        return DEFAULT_STATUS_INTERVAL_SEC
+        :param int  status_interval_sec:
+                                    See enhance_file().
+        :param bool progress_bar:   See enhance_file().
+        :return:    An EnhanceResult (<sid>, <status>, <resp_info>) per
+                    job. The <error> of its <timings> is set if the job
+                    failed or couldn't be restarted.
+        :rtype:     list
+        """
+        if not self._journal:
+            raise Exception("Resuming requires a job journal")
+
+        jobs = self._journal.unfinished()
+        self._logger.info(f"Resuming {len(jobs)} unfinished job(s)")
+
+        # Poll all the re-attached sessions at once
+        policy = get_polling_policy(status_interval_sec)
+        futures = {
+            job.id: self.poller.submit(job.session_id, polling_policy=policy)
+            for job in jobs
+            if job.session_id and job.phase == PHASE_PROCESSING
+        }
+
+        results = []
+        for job in jobs:
+            if job.session_id:
+                self._logger.info(
+                    f"[{job.session_id}] Re-attaching to the session of "
+                    f"{job.src}"
+                )
+                results.append(
+                    self._resume_job(job, futures.get(job.id), progress_bar)
+                )
+                continue
+
+            self._journal_update(
+                job.id, phase=PHASE_FAILED,
+                error="The upload was interrupted"
+            )
+            if os.path.isabs(job.src) and os.path.isfile(job.src):
+                results.append(self.enhance_file(
+                    job.src, no_download=job.no_download, dst=job.dst,
+                    retention=job.retention, preset=job.preset,
+                    status_interval_sec=status_interval_sec,
+                    progress_bar=progress_bar
+                ))
+            else:
+                error = f"Can't restart the job of {job.src}, its upload " \
+                    "was interrupted"
+                self._logger.error(error)
+                timings = JobTimings(job.src)
+                timings.finish(error=error)
+                results.append(EnhanceResult(None, None, None, timings))
+
+        return results
@@ -1,96 +1,314 @@
-import requests
 import os
 import sys
 import logging
-import validators
 import shutil
 from pathlib import PurePath
-from tqdm import tqdm
-from tqdm.utils import CallbackIOWrapper
+from insoundz_api.retry import get_retry_policy
+
+# requests, tqdm and validators are imported by the functions that use
+# them, so that importing the package (e.g. by the CLI) stays cheap.
 
 DEFAULT_CHUNK_SIZE = 65536
-DEFAULT_TIMEOUT_SEC = 30
 
 
-def initialize_logger(logger_name):
+def initialize_logger(logger_name, stream=None):
+    """
+    The logger <logger_name>, writing to <stream> (stdout by default).
+    Loggers are shared by name, so the stream handler of an earlier call
+    is reused, or replaced if it writes to another stream.
+    """
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.INFO)
+    stream = stream or sys.stdout
+    for handler in list(logger.handlers):
+        if getattr(handler, "_insoundz_handler", False):
+            if handler.stream is stream:
+                return logger
+            logger.removeHandler(handler)
+
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(formatter)
-    logger.addHandler(stdout_handler)
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(formatter)
+    stream_handler._insoundz_handler = True
+    logger.addHandler(stream_handler)
     return logger
 
 
+def is_url(path):
+    import validators
+
+    return bool(validators.url(path))
+
+
 def is_file(path):
-    if not validators.url(path):
+    if not is_url(path):
         return PurePath(path).suffix != ""
     else:
         return False
 
 
 def is_folder(path):
-    if not validators.url(path):
+    if not is_url(path):
         return not is_file(path)
     else:
         return False
 
 
-def upload_file_with_pbar(src, dst):
-    file_size = os.path.getsize(src)
-    with open(src, "rb") as fd:
-        with tqdm(
-            desc=f"Uploading", total=file_size, unit="B",
-            unit_scale=True, unit_divisor=1024
-        ) as t:
-            reader_wrapper = CallbackIOWrapper(t.update, fd, "read")
-            response = requests.put(
-                dst, data=reader_wrapper, timeout=DEFAULT_TIMEOUT_SEC
-            )
-            response.raise_for_status()
-
-
-def upload_file_no_pbar(src, dst):
+def enhanced_filename(src):
+    """
+    The default file name of the enhanced file of <src>.
+    """
+    src_filename = os.path.basename(src)
+    src_filename_no_suffix = PurePath(src_filename).stem
+    src_filename_suffix = PurePath(src_filename).suffix
+    return src_filename_no_suffix + "_enhanced" + src_filename_suffix
+
+
+def open_progress(pbar, total=None, initial=0, desc=None):
+    """
+    Open the progress report of a transfer of <total> bytes.
+
+    :param pbar:        Either a flag, which shows a tqdm progress bar, or a
+                        callable which is called with <total> and <initial>
+                        and returns an object with update() and close()
+                        methods (e.g. the factory of JobProgress.transfer()).
+    :return:            The progress report, or None if <pbar> isn't set.
+    """
+    if not pbar:
+        return None
+    if callable(pbar):
+        return pbar(total, initial)
+
+    from tqdm import tqdm
+
+    return tqdm(
+        desc=desc, total=total, initial=initial, unit="B", unit_scale=True,
+        unit_divisor=1024
+    )
+
+
+def upload_file_with_pbar(
+    src, dst, session=None, pbar=True, retry_policy=None
+):
     with open(src, "rb") as fd:
-        response = requests.put(dst, data=fd, timeout=DEFAULT_TIMEOUT_SEC)
-        response.raise_for_status()
+        upload_stream(
+            fd, dst, size=os.path.getsize(src), pbar=pbar, session=session,
+            retry_policy=retry_policy
+        )
+
+
+def upload_file_no_pbar(src, dst, session=None, retry_policy=None):
+    import requests
+
+    http = session or requests
+    policy = get_retry_policy(retry_policy)
+    size = os.path.getsize(src)
+
+    def send():
+        with open(src, "rb") as fd:
+            return http.put(dst, data=fd, timeout=policy.timeout(size))
+
+    policy.call(send, "PUT")
 
-def upload_file(src, dst, pbar=False):
+def upload_file(src, dst, pbar=False, session=None, retry_policy=None):
     if pbar:
-        upload_file_with_pbar(src, dst)
+        upload_file_with_pbar(src, dst, session, pbar, retry_policy)
     else:
-        upload_file_no_pbar(src, dst)
+        upload_file_no_pbar(src, dst, session, retry_policy)
+
+
+class _SizedStream(object):
+    """
+    An iterator of chunks with a known total size, so it is sent with a
+    Content-Length header rather than with chunked transfer encoding.
+    """
+    def __init__(self, chunks, size):
+        self._chunks = chunks
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+def _iter_buffer(buffer, chunk_size):
+    # Slices of a memoryview share the memory of the buffer
+    view = memoryview(buffer).cast("B")
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
 
 
-def download_file_with_pbar(src, dst, chunk_size=DEFAULT_CHUNK_SIZE):
-    response = requests.get(src, stream=True, timeout=DEFAULT_TIMEOUT_SEC)
-    response.raise_for_status()
+def _iter_reader(reader, chunk_size):
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _reader_size(reader):
+    try:
+        size = os.fstat(reader.fileno()).st_size
+        if size:
+            return size - reader.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    if hasattr(reader, "getbuffer"):
+        return reader.getbuffer().nbytes - reader.tell()
+    return None
+
+
+def stream_size(data):
+    """
+    Return the number of bytes <data> (bytes-like, a readable binary
+    object or an iterator of chunks) will produce, or None if unknown
+    (e.g. a pipe or a generator).
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return memoryview(data).nbytes
+    if hasattr(data, "read"):
+        return _reader_size(data)
+    return None
+
+
+def _iter_data(data, chunk_size):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return _iter_buffer(data, chunk_size)
+    if hasattr(data, "read"):
+        return _iter_reader(data, chunk_size)
+    return iter(data)
+
+
+def _rewind_position(data):
+    # The position a seekable reader is rewound to before a retry
+    try:
+        if hasattr(data, "read") and data.seekable():
+            return data.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+def upload_stream(
+    data, dst, size=None, chunk_size=DEFAULT_CHUNK_SIZE, pbar=False,
+    session=None, retry_policy=None
+):
+    """
+    Upload <data> to <dst> with a single PUT without copying it to a file.
+    A failed upload is retried if <data> can be sent again (a buffer or a
+    seekable reader).
+
+    :param data:            bytes, bytearray or memoryview, a readable
+                            binary object (e.g. a socket file or sys.stdin)
+                            or an iterator of bytes chunks.
+    :param int  size:       The number of bytes to upload, if known in
+                            advance. Data of an unknown size is sent with
+                            chunked transfer encoding.
+                            (This param is optional)
+    :param      pbar:       See open_progress().
+                            (This param is optional)
+    :param RetryPolicy retry_policy:
+                            See RetryPolicy.
+                            (This param is optional)
+    :return:                The number of bytes that were uploaded.
+    :rtype:                 int
+    """
+    import requests
+
+    http = session or requests
+    policy = get_retry_policy(retry_policy)
+
+    if size is None:
+        size = stream_size(data)
+
+    # An iterator or a socket can only be sent once
+    position = _rewind_position(data)
+    retries = None
+    if position is None and \
+            not isinstance(data, (bytes, bytearray, memoryview)):
+        retries = 0
+
+    uploaded = [0]
+    reported = [0]
+    bar = open_progress(pbar, size, desc="Uploading")
+
+    def counted(chunks):
+        for chunk in chunks:
+            uploaded[0] += len(chunk)
+            # A retry doesn't report the bytes of a failed attempt again
+            if bar is not None and uploaded[0] > reported[0]:
+                bar.update(uploaded[0] - reported[0])
+                reported[0] = uploaded[0]
+            yield chunk
+
+    def send():
+        if position is not None:
+            data.seek(position)
+        uploaded[0] = 0
+        body = counted(_iter_data(data, chunk_size))
+        if size is not None:
+            body = _SizedStream(body, size)
+        return http.put(dst, data=body, timeout=policy.timeout(size))
+
+    try:
+        policy.call(send, "PUT", retries=retries)
+    finally:
+        if bar is not None:
+            bar.close()
+
+    return uploaded[0]
+
+
+def download_file_with_pbar(
+    src, dst, chunk_size=DEFAULT_CHUNK_SIZE, session=None, pbar=True,
+    retry_policy=None
+):
+    import requests
+
+    http = session or requests
+    policy = get_retry_policy(retry_policy)
+    response = policy.call(
+        lambda: http.get(src, stream=True, timeout=policy.timeout())
+    )
 
     file_size = None
     if 'Content-Length' in response.headers.keys() and \
             int(response.headers['Content-Length']) != 0:
         file_size = int(response.headers['Content-Length'])
 
-    kwargs = dict(miniters=1, desc="Downloading", total=file_size)
-    kwargsNotNone = {k: v for k, v in kwargs.items() if v is not None}
-    with tqdm.wrapattr(open(dst, "wb"), "write", **kwargsNotNone) as fd:
-        for chunk in response.iter_content(chunk_size):
-            fd.write(chunk)
+    bar = open_progress(pbar, file_size, desc="Downloading")
+    try:
+        with open(dst, "wb") as fd:
+            for chunk in response.iter_content(chunk_size):
+                fd.write(chunk)
+                bar.update(len(chunk))
+    finally:
+        bar.close()
+
 
+def download_file_no_pbar(src, dst, session=None, retry_policy=None):
+    import requests
 
-def download_file_no_pbar(src, dst):
-    with requests.get(
-        src, stream=True, timeout=DEFAULT_TIMEOUT_SEC
+    http = session or requests
+    policy = get_retry_policy(retry_policy)
+    with policy.call(
+        lambda: http.get(src, stream=True, timeout=policy.timeout())
     ) as response:
-        response.raise_for_status()
         with open(dst, 'wb') as f:
             shutil.copyfileobj(response.raw, f)
 
 
-def download_file(src, dst, chunk_size=DEFAULT_CHUNK_SIZE, pbar=False):
+def download_file(
+    src, dst, chunk_size=DEFAULT_CHUNK_SIZE, pbar=False, session=None,
+    retry_policy=None
+):
     if pbar:
-        download_file_with_pbar(src, dst, chunk_size)
+        download_file_with_pbar(
+            src, dst, chunk_size, session, pbar, retry_policy
+        )
     else:
-        download_file_no_pbar(src, dst)
+        download_file_no_pbar(src, dst, session, retry_policy)
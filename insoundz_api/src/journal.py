@@ -0,0 +1,151 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_JOURNAL_PATH = os.path.join(Path.home(), ".insoundz_journal.db")
+
+# The phases a job moves through
+PHASE_UPLOADING = "uploading"
+PHASE_PROCESSING = "processing"
+PHASE_DOWNLOADING = "downloading"
+PHASE_FINISHED = "finished"
+PHASE_FAILED = "failed"
+
+UNFINISHED_PHASES = (PHASE_UPLOADING, PHASE_PROCESSING, PHASE_DOWNLOADING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    src TEXT NOT NULL,
+    dst TEXT,
+    preset TEXT,
+    retention INTEGER,
+    no_download INTEGER NOT NULL DEFAULT 0,
+    session_id TEXT,
+    phase TEXT NOT NULL,
+    result_url TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class Job(object):
+    """
+    A journal record of a single enhancement job.
+    """
+    def __init__(
+        self, id, src, dst, preset, retention, no_download, session_id,
+        phase, result_url, error, created_at, updated_at
+    ):
+        self.id = id
+        self.src = src
+        self.dst = dst
+        self.preset = preset
+        self.retention = retention
+        self.no_download = bool(no_download)
+        self.session_id = session_id
+        self.phase = phase
+        self.result_url = result_url
+        self.error = error
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f"Job(id={self.id}, src={self.src!r}, " \
+            f"session_id={self.session_id!r}, phase={self.phase!r})"
+
+
+class JobJournal(object):
+    """
+    A crash-safe SQLite journal of enhancement jobs.
+    Every job is recorded with its source, session ID, phase and result URL
+    as it moves through the enhancer, so the sessions which were in flight
+    when a process died can be resumed by another process (see
+    AudioEnhancer.resume()) without uploading them again.
+    """
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        """
+        :param str  path:   The journal database file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(_SCHEMA)
+
+    def add(
+        self, src, dst=None, preset=None, retention=None, no_download=False
+    ):
+        """
+        Record a new job and return its ID.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (src, dst, preset, retention, no_download, "
+                "phase, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    src, dst, preset, retention, int(bool(no_download)),
+                    PHASE_UPLOADING, now, now
+                )
+            )
+            return cursor.lastrowid
+
+    def update(self, job_id, **fields):
+        """
+        Update the <session_id>, <phase>, <result_url> or <error> of a job.
+        """
+        columns = ("session_id", "phase", "result_url", "error")
+        fields = {k: v for k, v in fields.items() if k in columns}
+        if not fields:
+            return
+
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                tuple(fields.values()) + (time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return Job(*row) if row else None
+
+    def unfinished(self):
+        """
+        Return the jobs which were neither finished nor failed.
+        """
+        placeholders = ", ".join("?" * len(UNFINISHED_PHASES))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM jobs WHERE phase IN ({placeholders}) "
+                "ORDER BY id",
+                UNFINISHED_PHASES
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def prune(self, max_age_sec):
+        """
+        Remove finished and failed jobs older than <max_age_sec>.
+        """
+        placeholders = ", ".join("?" * len(UNFINISHED_PHASES))
+        with self._lock:
+            self._db.execute(
+                f"DELETE FROM jobs WHERE phase NOT IN ({placeholders}) "
+                "AND updated_at < ?",
+                UNFINISHED_PHASES + (time.time() - max_age_sec,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,440 @@
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+# The spans of a job. The time a session spends on the server is split into
+# spans named after its statuses (e.g. "queued" and "processing").
+SPAN_LOOKUP = "lookup"
+# The wait of a job in the queue of the JobScheduler
+SPAN_ADMISSION = "admission"
+SPAN_AUTH = "auth"
+SPAN_SESSION = "session"
+SPAN_COMPRESS = "compress"
+SPAN_UPLOAD = "upload"
+SPAN_PROCESSING = "processing"
+SPAN_DOWNLOAD = "download"
+SPAN_RESTORE = "restore"
+# The spans of a segmented job
+SPAN_SPLIT = "split"
+SPAN_SEGMENTS = "segments"
+SPAN_STITCH = "stitch"
+
+DEFAULT_METRICS_PREFIX = "insoundz"
+DEFAULT_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = \
+    "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class Span(object):
+    """
+    A timed phase of a job.
+    """
+    def __init__(self, name, start_time, end_time):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    def __repr__(self):
+        return f"Span(name={self.name!r}, duration={self.duration:.3f})"
+
+
+class JobTimings(object):
+    """
+    A structured timing record of a single enhancement job: a span for
+    every phase, the bytes that were transferred, the number of status
+    polls and the number of retried requests.
+    Jobs whose source was compressed before the upload also record its
+    original size (<bytes_original>) and compressed size
+    (<bytes_compressed>).
+    """
+    def __init__(self, src=None):
+        self.src = src
+        self.sid = None
+        self.status = None
+        self.error = None
+        self.cached = False
+        self.retained = False
+        self.spans = []
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self.bytes_original = 0
+        self.bytes_compressed = 0
+        self.polls = 0
+        self.retries = 0
+        self.start_time = time.time()
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start_time, end_time=None):
+        span = Span(name, start_time, end_time or time.time())
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the body of a with statement as a span of <name>.
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start_time)
+
+    def retried(self, *args):
+        """
+        Count a retried request. Can be passed as an <on_retry> callback.
+        """
+        with self._lock:
+            self.retries += 1
+
+    def duration(self, name):
+        """
+        The total duration of the spans of <name> [sec].
+        """
+        return sum(span.duration for span in self.spans if span.name == name)
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def compression_ratio(self):
+        if not self.bytes_compressed:
+            return None
+        return self.bytes_original / self.bytes_compressed
+
+    @property
+    def compression_saved_sec(self):
+        """
+        An estimate of the time the compression saved [sec]: the upload
+        time of the bytes it removed, at the measured upload rate, minus
+        the encoding and restoring time.
+        """
+        if not self.bytes_compressed:
+            return None
+        upload_sec = self.duration(SPAN_UPLOAD)
+        return upload_sec * (self.compression_ratio - 1) - \
+            self.duration(SPAN_COMPRESS) - self.duration(SPAN_RESTORE)
+
+    def finish(self, sid=None, status=None, error=None):
+        self.sid = sid or self.sid
+        self.status = status
+        if error is not None:
+            self.error = str(error)
+        self.end_time = time.time()
+
+    def as_dict(self):
+        return {
+            "src": self.src,
+            "sid": self.sid,
+            "status": self.status,
+            "error": self.error,
+            "cached": self.cached,
+            "retained": self.retained,
+            "elapsed": self.elapsed,
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_time": span.start_time,
+                    "duration": span.duration,
+                }
+                for span in self.spans
+            ],
+            "bytes_uploaded": self.bytes_uploaded,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_original": self.bytes_original,
+            "bytes_compressed": self.bytes_compressed,
+            "compression_ratio": self.compression_ratio,
+            "compression_saved_sec": self.compression_saved_sec,
+            "polls": self.polls,
+            "retries": self.retries,
+        }
+
+    def __str__(self):
+        names = []
+        for span in self.spans:
+            if span.name not in names:
+                names.append(span.name)
+        spans = ", ".join(
+            f"{name} {self.duration(name):.2f}" for name in names
+        )
+        compression = ""
+        if self.bytes_compressed:
+            compression = f" (compressed {self.compression_ratio:.2f}x, " \
+                f"saved {self.compression_saved_sec:.2f} sec)"
+        return f"{self.elapsed:.2f} sec ({spans or 'no spans'}); " \
+            f"{self.bytes_uploaded} bytes up{compression}, " \
+            f"{self.bytes_downloaded} bytes down; {self.polls} polls, " \
+            f"{self.retries} retries"
+
+
+class EnhanceResult(tuple):
+    """
+    The (<sid>, <status>, <resp_info>) of an enhancement. It unpacks like
+    a plain tuple, and carries the JobTimings of the job in <timings>.
+    """
+    def __new__(cls, sid, status, resp_info, timings=None):
+        result = super().__new__(cls, (sid, status, resp_info))
+        result.timings = timings
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.timings,)
+
+    @property
+    def sid(self):
+        return self[0]
+
+    @property
+    def status(self):
+        return self[1]
+
+    @property
+    def resp_info(self):
+        return self[2]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class PrometheusExporter(object):
+    """
+    A metrics hook that aggregates the JobTimings of every job, and renders
+    them in the Prometheus text format or in the OpenMetrics format.
+
+        exporter = PrometheusExporter()
+        enhancer = AudioEnhancer(client_id, secret, metrics=exporter)
+        exporter.serve(9100)
+
+    The queue waits of a JobScheduler are the "admission" phase of the
+    jobs; pass the scheduler to export its queue depth too.
+    """
+    def __init__(
+        self, prefix=DEFAULT_METRICS_PREFIX, buckets=DEFAULT_BUCKETS,
+        scheduler=None
+    ):
+        """
+        :param str  prefix:     The prefix of every metric name.
+        :param list buckets:    The upper bounds of the duration histogram
+                                buckets [sec].
+        :param      scheduler:  A JobScheduler whose queue depth, jobs in
+                                flight and admissions are exported.
+                                (This param is optional)
+        """
+        self._prefix = prefix
+        self._scheduler = scheduler
+        self._buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._phases = {}
+        self._durations = {}
+        self._counters = {
+            "bytes_uploaded": 0,
+            "bytes_downloaded": 0,
+            "bytes_saved": 0,
+            "polls": 0,
+            "retries": 0,
+            "cache_hits": 0,
+            "retained_hits": 0,
+        }
+
+    def __call__(self, timings):
+        self.observe(timings)
+
+    def observe(self, timings):
+        status = timings.status or ("error" if timings.error else "unknown")
+        with self._lock:
+            self._jobs[status] = self._jobs.get(status, 0) + 1
+
+            durations = {}
+            for span in timings.spans:
+                durations[span.name] = \
+                    durations.get(span.name, 0.0) + span.duration
+            for name, duration in durations.items():
+                if name not in self._phases:
+                    self._phases[name] = _Histogram(self._buckets)
+                self._phases[name].observe(duration)
+
+            if status not in self._durations:
+                self._durations[status] = _Histogram(self._buckets)
+            self._durations[status].observe(timings.elapsed)
+
+            self._counters["bytes_uploaded"] += timings.bytes_uploaded
+            self._counters["bytes_downloaded"] += timings.bytes_downloaded
+            if timings.bytes_compressed:
+                self._counters["bytes_saved"] += \
+                    timings.bytes_original - timings.bytes_compressed
+            self._counters["polls"] += timings.polls
+            self._counters["retries"] += timings.retries
+            self._counters["cache_hits"] += int(timings.cached)
+            self._counters["retained_hits"] += int(timings.retained)
+
+    def _counter(self, lines, name, help, samples, openmetrics):
+        family = f"{self._prefix}_{name}"
+        # The text format names the family after its samples
+        if openmetrics:
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} counter")
+        else:
+            lines.append(f"# HELP {family}_total {help}")
+            lines.append(f"# TYPE {family}_total counter")
+        for labels, value in samples:
+            lines.append(f"{family}_total{_labels(labels)} {_number(value)}")
+
+    def _gauge(self, lines, name, help, value):
+        family = f"{self._prefix}_{name}"
+        lines.append(f"# HELP {family} {help}")
+        lines.append(f"# TYPE {family} gauge")
+        lines.append(f"{family} {_number(value)}")
+
+    def _histogram(self, lines, name, help, label, histograms):
+        family = f"{self._prefix}_{name}"
+        lines.append(f"# HELP {family} {help}")
+        lines.append(f"# TYPE {family} histogram")
+        for value, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                labels = _labels(((label, value), ("le", _number(bound))))
+                lines.append(f"{family}_bucket{labels} {count}")
+            labels = _labels(((label, value),))
+            lines.append(f"{family}_sum{labels} {_number(histogram.sum)}")
+            lines.append(f"{family}_count{labels} {histogram.count}")
+
+    def render(self, openmetrics=False):
+        """
+        Return the metrics in the Prometheus text format, or in the
+        OpenMetrics format if <openmetrics> is set.
+        """
+        lines = []
+        with self._lock:
+            self._counter(
+                lines, "jobs", "Enhancement jobs by their final status.",
+                [((("status", status),), count)
+                 for status, count in sorted(self._jobs.items())],
+                openmetrics
+            )
+            self._histogram(
+                lines, "job_duration_seconds",
+                "The duration of enhancement jobs.", "status",
+                self._durations
+            )
+            self._histogram(
+                lines, "phase_duration_seconds",
+                "The duration of every phase of the enhancement jobs.",
+                "phase", self._phases
+            )
+            for name, help in (
+                ("bytes_uploaded", "Bytes uploaded to insoundzAPI."),
+                ("bytes_downloaded", "Enhanced bytes downloaded."),
+                ("bytes_saved", "Upload bytes saved by compression."),
+                ("polls", "Status polls."),
+                ("retries", "Retried requests."),
+                ("cache_hits", "Jobs served from the result cache."),
+                ("retained_hits", "Jobs served from retained results."),
+            ):
+                self._counter(
+                    lines, name, help, [((), self._counters[name])],
+                    openmetrics
+                )
+
+        if self._scheduler is not None:
+            stats = self._scheduler.stats
+            self._gauge(
+                lines, "scheduler_queue_depth",
+                "Jobs waiting in the queue of the scheduler.",
+                stats.queue_depth
+            )
+            self._gauge(
+                lines, "scheduler_in_flight",
+                "Admitted jobs whose sessions aren't finished.",
+                stats.in_flight
+            )
+            for name, help in (
+                ("admitted", "Jobs admitted by the scheduler."),
+                ("rejected", "Jobs the balance couldn't cover."),
+                ("throttled", "Jobs delayed by the rate limit."),
+            ):
+                self._counter(
+                    lines, f"scheduler_{name}", help,
+                    [((), getattr(stats, name))], openmetrics
+                )
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, addr=""):
+        """
+        Serve the metrics over HTTP from a background thread, in the format
+        the scraper accepts. Returns the server; call shutdown() on it to
+        stop serving.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                openmetrics = "application/openmetrics-text" in \
+                    self.headers.get("Accept", "")
+                body = exporter.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    OPENMETRICS_CONTENT_TYPE if openmetrics
+                    else PROMETHEUS_CONTENT_TYPE
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="insoundz-metrics",
+            daemon=True
+        ).start()
+        return server
@@ -0,0 +1,314 @@
+import time
+import logging
+import threading
+import requests
+from http import HTTPStatus
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from insoundz_api.polling import FixedPolling, RETRYABLE_POLL_STATUS_CODES
+
+DEFAULT_POLL_WORKERS = 4
+DEFAULT_BULK_SIZE = 100
+DEFAULT_COALESCE_SEC = 0.25
+MAX_UNAUTHORIZED_RETRIES = 10
+# Notifications of sessions which aren't submitted yet are kept for them
+MAX_EARLY_NOTIFICATIONS = 1000
+
+# Responses of a server which doesn't expose the bulk status endpoint
+BULK_UNSUPPORTED_STATUS_CODES = (
+    HTTPStatus.NOT_FOUND,
+    HTTPStatus.METHOD_NOT_ALLOWED,
+    HTTPStatus.NOT_IMPLEMENTED,
+)
+
+
+class PollFuture(Future):
+    """
+    A Future which is resolved with (<status>, <resp_info>) once a session
+    reaches "done" or "failure". Its <pushed> is set if the status was
+    notified by the server rather than polled.
+    """
+    def __init__(self, session_id):
+        super().__init__()
+        self.session_id = session_id
+        self.polls = 0
+        self.pushed = False
+
+
+class _PolledSession(object):
+    def __init__(self, sid, future, policy, state, due):
+        self.sid = sid
+        self.future = future
+        self.policy = policy
+        self.state = state
+        self.due = due
+        self.retries = MAX_UNAUTHORIZED_RETRIES
+
+
+class StatusPoller(object):
+    """
+    A single background poller for all the in-flight sessions.
+    Sessions are checked on a shared schedule (sessions which are due
+    within <coalesce_sec> of each other are checked together), through a
+    small pool of workers or through the bulk status endpoint when the
+    server exposes it.
+    """
+    def __init__(
+        self, api, polling_policy=None, max_workers=DEFAULT_POLL_WORKERS,
+        use_bulk=True, bulk_size=DEFAULT_BULK_SIZE,
+        coalesce_sec=DEFAULT_COALESCE_SEC, logger=None
+    ):
+        """
+        :param insoundzAPI api:         The client to poll with.
+        :param PollingPolicy polling_policy:
+                                        The default policy of submitted
+                                        sessions.
+        :param int  max_workers:        The number of concurrent status
+                                        requests.
+        :param bool use_bulk:           Try the bulk status endpoint first.
+        :param int  bulk_size:          The maximal number of sessions per
+                                        bulk request.
+        :param float coalesce_sec:      Sessions which are due within this
+                                        window are checked together.
+        """
+        self._api = api
+        self._policy = polling_policy or FixedPolling()
+        self._use_bulk = use_bulk
+        self._bulk_size = bulk_size
+        self._coalesce_sec = coalesce_sec
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="insoundz-status"
+        )
+        self._sessions = {}
+        self._early = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    @property
+    def pending(self):
+        """
+        The number of sessions which are not done yet.
+        """
+        with self._cond:
+            return len(self._sessions)
+
+    def submit(self, sid, file_size=None, polling_policy=None, callback=None):
+        """
+        Start tracking <sid>.
+
+        :param str  sid:                The session ID.
+        :param int  file_size:          The size of the source file, used
+                                        by adaptive polling policies.
+        :param PollingPolicy polling_policy:
+                                        Overrides the default policy.
+        :param callable callback:       Called with the PollFuture once the
+                                        session is resolved.
+        :return:                        A PollFuture.
+        :rtype:                         PollFuture
+        """
+        policy = polling_policy or self._policy
+        state = policy.new_state(file_size)
+        future = PollFuture(sid)
+        if callback:
+            future.add_done_callback(callback)
+
+        with self._cond:
+            if self._closed:
+                raise Exception("Status poller is closed")
+
+            early = self._early.pop(sid, None)
+            if early is not None:
+                future.pushed = True
+                future.set_result(early)
+                return future
+
+            self._sessions[sid] = _PolledSession(
+                sid, future, policy, state,
+                time.time() + policy.next_interval(state)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="insoundz-poller", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+        return future
+
+    def cancel(self, sid):
+        """
+        Stop tracking <sid>.
+        """
+        with self._cond:
+            session = self._sessions.pop(sid, None)
+        if session:
+            session.future.cancel()
+
+    def notify(self, sid, status, resp_info):
+        """
+        Resolve <sid> with a status which was pushed by the server (see
+        CallbackListener), without waiting for its next poll. The final
+        status of a session which isn't submitted yet resolves it once it
+        is. Returns False if <status> isn't final.
+        """
+        if status != "done" and status != "failure":
+            return False
+
+        with self._cond:
+            session = self._sessions.get(sid)
+            if session is None:
+                self._early[sid] = (status, resp_info)
+                while len(self._early) > MAX_EARLY_NOTIFICATIONS:
+                    self._early.popitem(last=False)
+                return True
+
+        self._logger.info(f"[{sid}] Job status [{status}] was notified")
+        self._resolve(session, status, resp_info, pushed=True)
+        return True
+
+    def _pop(self, session):
+        # Only the first of a poll and a notification resolves the session
+        with self._cond:
+            return self._sessions.pop(session.sid, None) is session
+
+    def _resolve(self, session, status, resp_info, pushed=False):
+        if not self._pop(session):
+            return
+        session.future.polls = session.state.polls
+        session.future.pushed = pushed
+        if not session.future.done():
+            session.future.set_result((status, resp_info))
+
+    def _fail(self, session, error):
+        if not self._pop(session):
+            return
+        session.future.polls = session.state.polls
+        if not session.future.done():
+            session.future.set_exception(error)
+
+    def _handle_status(self, session, status, resp_info, headers):
+        session.policy.observe(session.state, status)
+        session.retries = MAX_UNAUTHORIZED_RETRIES
+
+        if status == "done" or status == "failure":
+            self._logger.info(f"[{session.sid}] Job status [{status}]")
+            self._resolve(session, status, resp_info)
+        else:
+            session.due = time.time() + session.policy.next_interval(
+                session.state, headers
+            )
+
+    def _handle_error(self, session, error):
+        headers = None
+        retryable = False
+        if isinstance(error, requests.exceptions.HTTPError):
+            headers = error.response.headers
+            retryable = \
+                error.response.status_code in RETRYABLE_POLL_STATUS_CODES
+
+        if retryable and session.retries:
+            session.retries -= 1
+            session.due = time.time() + session.policy.next_interval(
+                session.state, headers
+            )
+        else:
+            self._logger.error(f"[{session.sid}] Failure reason: {error}")
+            self._fail(session, error)
+
+    def _poll_one(self, session):
+        try:
+            status, resp_info, headers = self._api.enhance_status(
+                session.sid, with_headers=True
+            )
+        except Exception as e:
+            self._handle_error(session, e)
+        else:
+            self._handle_status(session, status, resp_info, headers)
+
+    def _poll_bulk(self, sessions):
+        try:
+            statuses, headers = self._api.enhance_status_bulk(
+                [session.sid for session in sessions]
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code in BULK_UNSUPPORTED_STATUS_CODES:
+                self._logger.info(
+                    "Bulk status isn't supported, polling sessions one by one"
+                )
+                self._use_bulk = False
+                return False
+            for session in sessions:
+                self._handle_error(session, e)
+            return True
+        except Exception as e:
+            for session in sessions:
+                self._handle_error(session, e)
+            return True
+
+        for session in sessions:
+            if session.sid in statuses:
+                status, resp_info = statuses[session.sid]
+                self._handle_status(session, status, resp_info, headers)
+            else:
+                # Not reported, check it on its own next time
+                session.due = time.time() + session.policy.next_interval(
+                    session.state, headers
+                )
+        return True
+
+    def _poll(self, sessions):
+        start = 0
+        while self._use_bulk and start < len(sessions):
+            if not self._poll_bulk(sessions[start:start + self._bulk_size]):
+                break
+            start += self._bulk_size
+
+        list(self._executor.map(self._poll_one, sessions[start:]))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.time()
+                    if self._sessions:
+                        next_due = min(s.due for s in self._sessions.values())
+                        if next_due <= now:
+                            break
+                        self._cond.wait(next_due - now)
+                    else:
+                        self._cond.wait()
+
+                if self._closed:
+                    return
+
+                horizon = time.time() + self._coalesce_sec
+                due = [s for s in self._sessions.values() if s.due <= horizon]
+
+            self._poll(due)
+
+    def close(self):
+        """
+        Stop polling. Unresolved futures are cancelled.
+        """
+        with self._cond:
+            self._closed = True
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._cond.notify()
+
+        for session in sessions:
+            session.future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
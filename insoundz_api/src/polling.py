@@ -0,0 +1,262 @@
+import time
+import random
+import threading
+from http import HTTPStatus
+from datetime import datetime, timezone
+
+DEFAULT_STATUS_INTERVAL_SEC = 0.5
+DEFAULT_MAX_INTERVAL_SEC = 30
+DEFAULT_BACKOFF_FACTOR = 1.5
+DEFAULT_JITTER = 0.1
+DEFAULT_SMOOTHING = 0.3
+
+# Poll failures which are retried (while honoring Retry-After)
+RETRYABLE_POLL_STATUS_CODES = (
+    HTTPStatus.UNAUTHORIZED,
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+)
+
+
+def parse_retry_after(headers):
+    """
+    Return the number of seconds the server asked us to wait (either by a
+    Retry-After header or by exhausted rate-limit headers), or None.
+    """
+    if not headers:
+        return None
+
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        # An HTTP date is rare, and email.utils is slow to import
+        from email.utils import parsedate_to_datetime
+
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            delay = retry_at - datetime.now(timezone.utc)
+            return max(delay.total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+
+    remaining = headers.get("X-RateLimit-Remaining")
+    reset = headers.get("X-RateLimit-Reset")
+    if remaining is not None and reset is not None:
+        try:
+            if int(remaining) > 0:
+                return None
+            reset = float(reset)
+        except ValueError:
+            return None
+
+        # The reset value is either an epoch timestamp or a delay
+        if reset > 1e9:
+            reset -= time.time()
+        return max(reset, 0.0)
+
+    return None
+
+
+class PollState(object):
+    """
+    The status polling history of a single job.
+    """
+    def __init__(self, file_size=None):
+        self.file_size = file_size
+        self.polls = 0
+        self.status = None
+        self.status_since = time.time()
+        self.attempt = 0
+        self.durations = {}
+
+    @property
+    def status_elapsed(self):
+        return time.time() - self.status_since
+
+    def update(self, status):
+        now = time.time()
+        self.polls += 1
+
+        if status != self.status:
+            if self.status is not None:
+                self.durations[self.status] = now - self.status_since
+            self.status = status
+            self.status_since = now
+            self.attempt = 0
+        else:
+            self.attempt += 1
+
+
+class PollingPolicy(object):
+    """
+    Decides how long to wait before every status poll of a job.
+    A policy may be shared by many jobs, the per-job history is kept in a
+    PollState that is created by new_state().
+    """
+    def new_state(self, file_size=None):
+        return PollState(file_size)
+
+    def observe(self, state, status):
+        """
+        Record the status that was returned by a poll.
+        """
+        state.update(status)
+
+    def interval(self, state):
+        raise NotImplementedError
+
+    def next_interval(self, state, headers=None):
+        """
+        The number of seconds to wait before the next poll. Retry-After and
+        rate-limit headers of the last response are always honored.
+        """
+        interval = self.interval(state)
+
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            interval = max(interval, retry_after)
+
+        return interval
+
+
+class FixedPolling(PollingPolicy):
+    """
+    Poll every <interval_sec> seconds.
+    """
+    def __init__(self, interval_sec=DEFAULT_STATUS_INTERVAL_SEC):
+        self.interval_sec = interval_sec
+
+    def interval(self, state):
+        return self.interval_sec
+
+
+class BackoffPolling(PollingPolicy):
+    """
+    Poll with an exponentially growing, capped and jittered interval.
+    The backoff restarts whenever the job status changes.
+    """
+    def __init__(
+        self, initial_sec=DEFAULT_STATUS_INTERVAL_SEC,
+        max_sec=DEFAULT_MAX_INTERVAL_SEC, factor=DEFAULT_BACKOFF_FACTOR,
+        jitter=DEFAULT_JITTER
+    ):
+        """
+        :param float initial_sec:   The first interval of every status.
+        :param float max_sec:       The interval cap.
+        :param float factor:        The interval growth factor.
+        :param float jitter:        The relative random spread of every
+                                    interval, so parallel jobs don't poll
+                                    in lockstep.
+        """
+        self.initial_sec = initial_sec
+        self.max_sec = max_sec
+        self.factor = factor
+        self.jitter = jitter
+
+    def _jitter(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _backoff(self, attempt):
+        return min(self.initial_sec * self.factor ** attempt, self.max_sec)
+
+    def interval(self, state):
+        return self._jitter(self._backoff(state.attempt))
+
+
+class AdaptivePolling(BackoffPolling):
+    """
+    Estimate when a job will be done from its file size and from the
+    processing rate that was observed for previous jobs, and poll close to
+    that time. Polls are fast while the server is downloading the uploaded
+    file, and fall back to backoff once the estimate is exceeded (or when
+    there is nothing to estimate from yet).
+    """
+    def __init__(
+        self, initial_sec=DEFAULT_STATUS_INTERVAL_SEC,
+        max_sec=DEFAULT_MAX_INTERVAL_SEC, factor=DEFAULT_BACKOFF_FACTOR,
+        jitter=DEFAULT_JITTER, sec_per_byte=None, smoothing=DEFAULT_SMOOTHING
+    ):
+        """
+        :param float sec_per_byte:  An initial guess of the processing time
+                                    per byte of the source file.
+                                    (This param is optional)
+        :param float smoothing:     The weight of the newest observation in
+                                    the processing rate estimate.
+        """
+        super().__init__(initial_sec, max_sec, factor, jitter)
+        self.sec_per_byte = sec_per_byte
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def observe(self, state, status):
+        prev_status = state.status
+        super().observe(state, status)
+
+        # Learn the processing rate from every job that finished processing
+        if prev_status == "processing" and status == "done" \
+                and state.file_size:
+            rate = state.durations["processing"] / state.file_size
+            with self._lock:
+                if self.sec_per_byte is None:
+                    self.sec_per_byte = rate
+                else:
+                    self.sec_per_byte += self.smoothing * (
+                        rate - self.sec_per_byte
+                    )
+
+    def expected_duration(self, state):
+        """
+        The expected processing duration of the job, or None if unknown.
+        """
+        if not state.file_size or self.sec_per_byte is None:
+            return None
+        return state.file_size * self.sec_per_byte
+
+    def interval(self, state):
+        if state.status != "processing":
+            return super().interval(state)
+
+        expected = self.expected_duration(state)
+        if expected is None:
+            return super().interval(state)
+
+        remaining = expected - state.status_elapsed
+        if remaining <= self.initial_sec:
+            return super().interval(state)
+
+        # Approach the expected completion time by halves
+        interval = min(max(remaining / 2, self.initial_sec), self.max_sec)
+        return self._jitter(interval)
+
+
+POLLING_POLICIES = {
+    "fixed": FixedPolling,
+    "backoff": BackoffPolling,
+    "adaptive": AdaptivePolling,
+}
+
+
+def get_polling_policy(value):
+    """
+    Convert a number of seconds (fixed interval), a policy name or a
+    PollingPolicy into a PollingPolicy.
+    """
+    if isinstance(value, PollingPolicy):
+        return value
+
+    if isinstance(value, (int, float)):
+        return FixedPolling(value)
+
+    if value in POLLING_POLICIES:
+        return POLLING_POLICIES[value]()
+
+    try:
+        return FixedPolling(float(value))
+    except (TypeError, ValueError):
+        raise Exception(
+            f"Invalid polling policy {value}. Expected a number of seconds "
+            f"or one of {', '.join(POLLING_POLICIES)}"
+        )
@@ -0,0 +1,341 @@
+import time
+import itertools
+import threading
+from insoundz_api.metrics import SPAN_UPLOAD, SPAN_DOWNLOAD
+
+# The types of progress events
+EVENT_STARTED = "started"
+EVENT_PHASE = "phase"
+EVENT_PROGRESS = "progress"
+EVENT_POLLED = "polled"
+EVENT_DONE = "done"
+EVENT_FAILED = "failed"
+
+# Transfers emit at most one progress event per interval
+DEFAULT_MIN_INTERVAL_SEC = 0.1
+
+_job_ids = itertools.count(1)
+
+
+class ProgressEvent(object):
+    """
+    A progress event of a job.
+
+    <phase> is the phase the job entered ("upload", "download" or a
+    server-side status such as "processing"), <bytes_done> and
+    <bytes_total> are the progress of the current transfer (<bytes_total>
+    is None if unknown), and <info> is the number of status polls of a
+    "polled" event, the enhanced file URL of a "done" event or the error
+    of a "failed" event.
+    """
+    __slots__ = (
+        "type", "job", "src", "sid", "phase", "bytes_done", "bytes_total",
+        "info", "time"
+    )
+
+    def __init__(
+        self, type, job, src=None, sid=None, phase=None, bytes_done=None,
+        bytes_total=None, info=None
+    ):
+        self.type = type
+        self.job = job
+        self.src = src
+        self.sid = sid
+        self.phase = phase
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.info = info
+        self.time = time.time()
+
+    def __repr__(self):
+        return f"ProgressEvent(type={self.type!r}, job={self.job}, " \
+            f"sid={self.sid!r}, phase={self.phase!r})"
+
+
+class ProgressEmitter(object):
+    """
+    Dispatch the progress events of jobs to the subscribed callables.
+    Events are only built while someone is subscribed (to the emitter or
+    to its <parent>), so an emitter without subscribers costs close to
+    nothing.
+    """
+    def __init__(
+        self, parent=None, min_interval_sec=DEFAULT_MIN_INTERVAL_SEC,
+        logger=None
+    ):
+        """
+        :param ProgressEmitter parent:  Events are forwarded to <parent>
+                                        too.
+                                        (This param is optional)
+        :param float min_interval_sec:  The minimal interval between the
+                                        progress events of a transfer.
+        :param logger:                  Logs the subscribers that failed.
+                                        (This param is optional)
+        """
+        self._parent = parent
+        self._logger = logger
+        self._lock = threading.Lock()
+        # Replaced rather than mutated, so emit() doesn't need the lock
+        self._subscribers = ()
+        self.min_interval_sec = min_interval_sec
+
+    def subscribe(self, callback):
+        """
+        Call <callback> with every ProgressEvent.
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(
+                subscriber for subscriber in self._subscribers
+                if subscriber is not callback
+            )
+
+    @property
+    def active(self):
+        return bool(self._subscribers) or \
+            (self._parent is not None and self._parent.active)
+
+    def emit(self, event):
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                if self._logger:
+                    self._logger.warning(
+                        f"[{event.sid}] A progress subscriber failed: {e}"
+                    )
+        if self._parent is not None:
+            self._parent.emit(event)
+
+    def job(self, src=None):
+        """
+        Return the JobProgress of a new job.
+        """
+        return JobProgress(self, src)
+
+
+class _Transfer(object):
+    """
+    The byte progress of a single upload or download, rate limited to one
+    event per <min_interval_sec>.
+    """
+    def __init__(self, job, phase, total, initial=0):
+        self._job = job
+        self._phase = phase
+        self._total = total
+        self._done = initial
+        self._interval = job.emitter.min_interval_sec
+        self._last_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._emit()
+
+    def _emit(self):
+        self._job.emit(
+            EVENT_PROGRESS, phase=self._phase, bytes_done=self._done,
+            bytes_total=self._total
+        )
+
+    def update(self, length):
+        with self._lock:
+            self._done += length
+            now = time.monotonic()
+            if now - self._last_time < self._interval:
+                return
+            self._last_time = now
+            self._emit()
+
+    def close(self):
+        with self._lock:
+            self._emit()
+
+
+class JobProgress(object):
+    """
+    Emits the progress events of a single job.
+    """
+    def __init__(self, emitter, src=None):
+        self.emitter = emitter
+        self.job = next(_job_ids)
+        self.src = src
+        self.sid = None
+        self.phase = None
+
+    def emit(self, type, **fields):
+        if self.emitter.active:
+            self.emitter.emit(
+                ProgressEvent(type, self.job, self.src, self.sid, **fields)
+            )
+
+    def started(self):
+        self.emit(EVENT_STARTED)
+
+    def enter(self, phase, sid=None):
+        self.sid = sid or self.sid
+        if phase != self.phase:
+            self.phase = phase
+            self.emit(EVENT_PHASE, phase=phase)
+
+    def polled(self, status, polls):
+        self.emit(EVENT_POLLED, phase=status, info=polls)
+
+    def transfer(self, phase):
+        """
+        Return a factory of the byte progress of a <phase> transfer, which
+        can be passed as the <pbar> of the transfer functions, or None if
+        nobody is subscribed.
+        """
+        if not self.emitter.active:
+            return None
+        return lambda total, initial=0: _Transfer(self, phase, total, initial)
+
+    def finished(self, status, info=None, error=None):
+        self.phase = None
+        if status == "done" and error is None:
+            self.emit(EVENT_DONE, info=info)
+        else:
+            self.emit(EVENT_FAILED, info=error or info)
+
+
+def _byte_bar(desc, total, initial=0):
+    from tqdm import tqdm
+
+    return tqdm(
+        desc=desc, total=total, initial=initial, unit="B", unit_scale=True,
+        unit_divisor=1024
+    )
+
+
+class TerminalRenderer(object):
+    """
+    Render the progress events of a single job in the terminal: a tqdm
+    progress bar for the upload and the download, and a Halo spinner with
+    the elapsed time of every server-side status.
+    """
+    _DESCRIPTIONS = {SPAN_UPLOAD: "Uploading", SPAN_DOWNLOAD: "Downloading"}
+
+    def __init__(self):
+        self._spinner = None
+        self._bar = None
+        self._phase_time = None
+
+    def _close_bar(self):
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
+
+    def _stop_spinner(self, succeed=True):
+        if self._spinner is not None:
+            if succeed:
+                self._spinner.succeed()
+            else:
+                self._spinner.fail()
+            self._spinner = None
+
+    def _spinner_text(self, event):
+        elapsed = int(event.time - self._phase_time)
+        return f"Session ID [{event.sid}]; Job status [{event.phase}]; " \
+            f"Elapsed time [{elapsed} sec]  "
+
+    def __call__(self, event):
+        if event.type == EVENT_PHASE:
+            self._close_bar()
+            self._stop_spinner()
+            self._phase_time = event.time
+            if event.phase not in self._DESCRIPTIONS:
+                from halo import Halo
+
+                self._spinner = Halo(
+                    spinner='dots', color='magenta', placement='right'
+                )
+                self._spinner.start(text=self._spinner_text(event))
+
+        elif event.type == EVENT_POLLED:
+            if self._spinner is not None:
+                self._spinner.text = self._spinner_text(event)
+
+        elif event.type == EVENT_PROGRESS:
+            if self._bar is None:
+                self._bar = _byte_bar(
+                    self._DESCRIPTIONS.get(event.phase, event.phase),
+                    event.bytes_total, event.bytes_done
+                )
+            else:
+                self._bar.update(event.bytes_done - self._bar.n)
+
+        elif event.type in (EVENT_DONE, EVENT_FAILED):
+            self._close_bar()
+            self._stop_spinner(succeed=event.type == EVENT_DONE)
+
+
+class BatchRenderer(object):
+    """
+    Render the progress events of many jobs as a single tqdm progress bar
+    of the finished files, with the number of files in every phase and the
+    transferred bytes.
+    """
+    def __init__(self, total=None):
+        """
+        :param int  total:  The number of files, if known in advance.
+                            (This param is optional)
+        """
+        self._total = total
+        self._bar = None
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._transfers = {}
+        self._bytes = {SPAN_UPLOAD: 0, SPAN_DOWNLOAD: 0}
+        self._failed = 0
+
+    def _postfix(self):
+        counts = {}
+        for phase in self._phases.values():
+            if phase:
+                counts[phase] = counts.get(phase, 0) + 1
+        postfix = dict(sorted(counts.items()))
+        postfix["up"] = f"{self._bytes[SPAN_UPLOAD] / 1024 / 1024:.1f}MB"
+        postfix["down"] = f"{self._bytes[SPAN_DOWNLOAD] / 1024 / 1024:.1f}MB"
+        if self._failed:
+            postfix["failed"] = self._failed
+        return postfix
+
+    def __call__(self, event):
+        with self._lock:
+            if self._bar is None:
+                from tqdm import tqdm
+
+                self._bar = tqdm(
+                    desc="Enhancing", total=self._total, unit="file"
+                )
+
+            finished = 0
+            if event.type == EVENT_STARTED:
+                self._phases[event.job] = None
+            elif event.type == EVENT_PHASE:
+                self._phases[event.job] = event.phase
+            elif event.type == EVENT_PROGRESS:
+                key = (event.job, event.phase)
+                previous = self._transfers.get(key, 0)
+                self._transfers[key] = event.bytes_done
+                if event.phase in self._bytes:
+                    self._bytes[event.phase] += event.bytes_done - previous
+            elif event.type in (EVENT_DONE, EVENT_FAILED):
+                self._phases.pop(event.job, None)
+                for phase in self._bytes:
+                    self._transfers.pop((event.job, phase), None)
+                self._failed += event.type == EVENT_FAILED
+                finished = 1
+            elif event.type == EVENT_POLLED:
+                return
+
+            self._bar.set_postfix(self._postfix(), refresh=False)
+            self._bar.update(finished)
+
+    def close(self):
+        with self._lock:
+            if self._bar is not None:
+                self._bar.close()
+                self._bar = None
@@ -0,0 +1,257 @@
+import time
+import random
+import threading
+from http import HTTPStatus
+from contextlib import contextmanager
+from insoundz_api.polling import parse_retry_after
+
+# requests is imported by the methods that use it, so that importing the
+# API client stays cheap.
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_SEC = 0.5
+DEFAULT_MAX_BACKOFF_SEC = 30
+DEFAULT_JITTER = 0.1
+DEFAULT_CONNECT_TIMEOUT_SEC = 10
+DEFAULT_READ_TIMEOUT_SEC = 30
+# Transfers get an extra second of read timeout for every <rate> bytes
+DEFAULT_MIN_TRANSFER_RATE = 256 * 1024
+
+# Responses which are retried
+RETRYABLE_STATUS_CODES = (
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+)
+
+# Responses of requests which the server rejected without processing them,
+# so even a non-idempotent request is safe to send again
+REJECTED_STATUS_CODES = (
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+_observers = threading.local()
+
+
+@contextmanager
+def observe_retries(callback):
+    """
+    Call <callback> with the error of every request that is retried by the
+    current thread within the with statement (e.g. to count the retries of
+    a job).
+    """
+    previous = getattr(_observers, "callback", None)
+    _observers.callback = callback
+    try:
+        yield
+    finally:
+        _observers.callback = previous
+
+
+def _never_sent(error):
+    # A connection which couldn't be opened never carried the request
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried, how long to wait before
+    every retry and the timeouts of every request.
+    A policy holds no per-request state, so it may be shared by the API
+    client and all the transfers.
+
+    Idempotent requests are retried after connection errors, timeouts and
+    the responses of RETRYABLE_STATUS_CODES. Other requests (e.g. starting
+    an enhancement session) are only retried when they are known not to
+    have been processed: the connection couldn't be opened, or the server
+    rejected them (429, 503).
+    """
+    def __init__(
+        self, retries=DEFAULT_RETRIES, backoff_sec=DEFAULT_BACKOFF_SEC,
+        max_backoff_sec=DEFAULT_MAX_BACKOFF_SEC, jitter=DEFAULT_JITTER,
+        connect_timeout_sec=DEFAULT_CONNECT_TIMEOUT_SEC,
+        read_timeout_sec=DEFAULT_READ_TIMEOUT_SEC,
+        min_transfer_rate=DEFAULT_MIN_TRANSFER_RATE,
+        status_codes=RETRYABLE_STATUS_CODES
+    ):
+        """
+        :param int   retries:           The number of times a request is
+                                        retried.
+        :param float backoff_sec:       The wait before the first retry,
+                                        doubled on every retry.
+        :param float max_backoff_sec:   The wait cap. A longer Retry-After
+                                        of the server is still honored.
+        :param float jitter:            The relative random spread of every
+                                        wait.
+        :param float connect_timeout_sec:
+                                        The timeout of opening a
+                                        connection.
+        :param float read_timeout_sec:  The timeout of waiting for the
+                                        server.
+        :param int   min_transfer_rate: The slowest expected transfer rate
+                                        [bytes/sec]; the read timeout of a
+                                        transfer grows with its size by it.
+        :param tuple status_codes:      The response status codes which are
+                                        retried.
+        """
+        self.retries = retries
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.jitter = jitter
+        self.connect_timeout_sec = connect_timeout_sec
+        self.read_timeout_sec = read_timeout_sec
+        self.min_transfer_rate = min_transfer_rate
+        self.status_codes = tuple(status_codes)
+
+    def timeout(self, size=None):
+        """
+        The (connect, read) timeouts of a request which transfers <size>
+        bytes.
+        """
+        read_timeout = self.read_timeout_sec
+        if size and self.min_transfer_rate:
+            read_timeout += size / self.min_transfer_rate
+        return self.connect_timeout_sec, read_timeout
+
+    def backoff(self, attempt, headers=None):
+        """
+        The number of seconds to wait before retry number <attempt>
+        (starting at 1). Retry-After and rate-limit headers of the failed
+        response are honored.
+        """
+        delay = min(
+            self.backoff_sec * 2 ** (attempt - 1), self.max_backoff_sec
+        )
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def is_retryable(self, error, method="GET", idempotent=None):
+        """
+        Whether a request of <method> which failed with <error> may be
+        sent again. <idempotent> overrides the idempotency of <method>
+        (e.g. a POST which only reads).
+        """
+        import requests
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        if isinstance(error, requests.exceptions.HTTPError):
+            if error.response is None:
+                return False
+            status_code = error.response.status_code
+            if status_code in REJECTED_STATUS_CODES:
+                return status_code in self.status_codes
+            return idempotent and status_code in self.status_codes
+
+        if isinstance(error, (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+        )):
+            return idempotent or _never_sent(error)
+
+        return False
+
+    def notify(self, error, on_retry=None):
+        """
+        Report a retry to <on_retry> and to the observer of the current
+        thread (see observe_retries()), once if they are the same callable.
+        """
+        if on_retry:
+            on_retry(error)
+        observer = getattr(_observers, "callback", None)
+        if observer and observer != on_retry:
+            observer(error)
+
+    def call(
+        self, send, method="GET", idempotent=None, on_retry=None,
+        logger=None, retries=None
+    ):
+        """
+        Call <send> (which sends the request and returns the response)
+        until it succeeds, the error isn't retryable or the retries are
+        exhausted.
+
+        :param      send:           A callable which sends the request.
+        :param str  method:         The HTTP method of the request.
+        :param bool idempotent:     See is_retryable().
+                                    (This param is optional)
+        :param      on_retry:       A callable which is called with the
+                                    error of every retried request.
+                                    (This param is optional)
+        :param      logger:         Logs every retry.
+                                    (This param is optional)
+        :param int  retries:        Overrides the <retries> of the policy,
+                                    e.g. 0 for a body which can't be sent
+                                    twice.
+                                    (This param is optional)
+        :return:                    The successful response.
+        """
+        import requests
+
+        retries = self.retries if retries is None else retries
+        attempt = 0
+
+        while True:
+            try:
+                response = send()
+                response.raise_for_status()
+                return response
+            except Exception as e:
+                if attempt >= retries or \
+                        not self.is_retryable(e, method, idempotent):
+                    raise
+                error = e
+
+            headers = None
+            if isinstance(error, requests.exceptions.HTTPError):
+                headers = error.response.headers
+                error.response.close()
+
+            attempt += 1
+            delay = self.backoff(attempt, headers)
+            if logger:
+                logger.warning(
+                    f"Retrying a {method} request in {delay:.1f} sec "
+                    f"({attempt}/{retries}): {error}"
+                )
+            self.notify(error, on_retry)
+            time.sleep(delay)
+
+
+def get_retry_policy(value=None):
+    """
+    Convert None (the default policy), a number of retries or a
+    RetryPolicy into a RetryPolicy.
+    """
+    if value is None:
+        return RetryPolicy()
+
+    if isinstance(value, RetryPolicy):
+        return value
+
+    try:
+        return RetryPolicy(retries=int(value))
+    except (TypeError, ValueError):
+        raise Exception(
+            f"Invalid retry policy {value}. Expected a number of retries or "
+            "a RetryPolicy"
+        )
@@ -0,0 +1,563 @@
+import os
+import math
+import time
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BALANCE_REFRESH_SEC = 60
+# The byte rate of 16-bit stereo audio at 44.1 kHz, the cost estimate of
+# sources whose duration can't be read
+DEFAULT_BYTES_PER_SEC = 44100 * 2 * 2
+DEFAULT_CREDITS_PER_MIN = 1.0
+
+# The orders of the queued jobs of the same priority
+ORDER_FIFO = "fifo"
+ORDER_SJF = "sjf"
+ORDERS = (ORDER_FIFO, ORDER_SJF)
+
+
+def audio_duration(src):
+    """
+    The duration of the audio file <src> [sec] as read from its header, or
+    None if it can't be read (soundfile is used if it's installed, WAV
+    headers are read without it).
+    """
+    try:
+        import soundfile
+    except ImportError:
+        soundfile = None
+
+    if soundfile is not None:
+        try:
+            return soundfile.info(src).duration
+        except (RuntimeError, OSError):
+            return None
+
+    import wave
+
+    try:
+        with wave.open(src, "rb") as fin:
+            return fin.getnframes() / fin.getframerate()
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+
+def estimate_size_cost(size, credits_per_min=DEFAULT_CREDITS_PER_MIN):
+    """
+    The projected cost of enhancing <size> bytes of audio of an unknown
+    duration (e.g. a stream) [credits].
+    """
+    return size / DEFAULT_BYTES_PER_SEC / 60 * credits_per_min
+
+
+def estimate_duration(src):
+    """
+    The duration of the audio file <src> [sec], or an estimate of it from
+    the size of the file if its header can't be read.
+    """
+    duration = audio_duration(src)
+    if duration is None:
+        return os.path.getsize(src) / DEFAULT_BYTES_PER_SEC
+    return duration
+
+
+def estimate_cost(src, credits_per_min=DEFAULT_CREDITS_PER_MIN):
+    """
+    The projected cost of enhancing <src> [credits], by the duration of its
+    audio.
+    """
+    return estimate_duration(src) / 60 * credits_per_min
+
+
+def get_order(value=None):
+    """
+    Validate the order of queued jobs, ORDER_FIFO by default.
+    """
+    if value is None:
+        return ORDER_FIFO
+    if value not in ORDERS:
+        raise Exception(
+            f"Invalid order {value}. Expected one of {', '.join(ORDERS)}"
+        )
+    return value
+
+
+def order_key(order, priority=0, deadline=None, duration=None, sequence=0):
+    """
+    The sort key of a queued job. Higher priorities come first. Within a
+    priority, jobs with a deadline come first, the earliest deadline
+    first, and the rest follow in their <order>: the order they were
+    queued in (ORDER_FIFO), or the shortest estimated <duration> first
+    (ORDER_SJF), which minimizes the mean completion time of a mixed batch.
+    """
+    key = (-priority, math.inf if deadline is None else deadline)
+    if order == ORDER_SJF:
+        key += (math.inf if duration is None else duration,)
+    return key + (sequence,)
+
+
+class TokenBucket(object):
+    """
+    A token bucket rate limit: <rate> tokens are added every second, up to
+    <burst> tokens.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        :param float rate:  The sustained rate [tokens/sec].
+        :param float burst: The capacity of the bucket, the number of
+                            tokens which may be taken at once after an
+                            idle period. Defaults to max(1, <rate>).
+                            (This param is optional)
+        """
+        if rate <= 0:
+            raise Exception(f"Invalid rate {rate}. It must be positive")
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Take a token if there is one. Returns 0 if it was taken, otherwise
+        the number of seconds until there is one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class Ticket(object):
+    """
+    A job which waits in the queue of a JobScheduler, and holds its
+    session slot and credits once it's admitted.
+    """
+    def __init__(
+        self, src, cost, priority=0, deadline=None, duration=None,
+        callback=None
+    ):
+        self.src = src
+        self.cost = cost
+        self.priority = priority
+        self.deadline = deadline
+        self.duration = duration
+        self.callback = callback
+        self.error = None
+        self.enqueued_at = time.time()
+        self.admitted_at = None
+        self.throttled = False
+        self.released = False
+        self._event = threading.Event()
+
+    @property
+    def wait_sec(self):
+        return (self.admitted_at or time.time()) - self.enqueued_at
+
+    def __repr__(self):
+        return f"Ticket(src={self.src!r}, cost={self.cost:.2f}, " \
+            f"wait_sec={self.wait_sec:.2f})"
+
+
+class SchedulerStats(object):
+    """
+    The queue depth, admissions and wait times of a JobScheduler.
+    """
+    def __init__(self):
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+        self.balance = None
+
+    @property
+    def mean_wait_sec(self):
+        return self.total_wait_sec / self.admitted if self.admitted else 0.0
+
+    def as_dict(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "mean_wait_sec": self.mean_wait_sec,
+            "max_wait_sec": self.max_wait_sec,
+            "balance": self.balance,
+        }
+
+    def __str__(self):
+        balance = "unknown" if self.balance is None else \
+            f"{self.balance:.2f}"
+        return f"{self.admitted} admitted, {self.rejected} rejected, " \
+            f"{self.queue_depth} queued (max {self.max_queue_depth}), " \
+            f"{self.in_flight} in flight; wait {self.mean_wait_sec:.2f} " \
+            f"sec mean, {self.max_wait_sec:.2f} sec max; " \
+            f"{self.throttled} throttled; balance {balance}"
+
+
+class JobScheduler(object):
+    """
+    Admits enhancement jobs before their sessions are started, so jobs
+    queue locally instead of being throttled or rejected by the server
+    after their upload.
+
+    A job is admitted once
+      - the number of admitted jobs whose sessions aren't finished yet is
+        below <max_sessions>,
+      - a token of the <rate> limit is available, and
+      - the balance covers its projected cost on top of the costs of the
+        jobs in flight.
+
+    The balance is refreshed every <balance_refresh_sec>, and the costs of
+    the jobs which finished since are deducted from it locally meanwhile.
+    A job which the balance can't cover while no other job is in flight is
+    rejected, unless <wait_for_credits> is set (then it waits for the
+    balance to be topped up).
+    Jobs are admitted by their priority and deadline, and then in their
+    <order> (see order_key()).
+
+        scheduler = JobScheduler(rate=2, max_sessions=8)
+        enhancer = AudioEnhancer(client_id, secret, scheduler=scheduler)
+    """
+    def __init__(
+        self, rate=None, burst=None, max_sessions=None,
+        balance_refresh_sec=DEFAULT_BALANCE_REFRESH_SEC, cost=None,
+        credits_per_min=DEFAULT_CREDITS_PER_MIN, wait_for_credits=False,
+        order=ORDER_FIFO, logger=None
+    ):
+        """
+        :param float rate:          The maximal rate of session starts
+                                    [sessions/sec], None for no limit.
+        :param float burst:         See TokenBucket.
+                                    (This param is optional)
+        :param int   max_sessions:  The maximal number of concurrent
+                                    sessions, None for no limit.
+        :param float balance_refresh_sec:
+                                    The interval of the balance checks
+                                    [sec], None to skip the admission
+                                    control by the balance.
+        :param       cost:          A callable which returns the projected
+                                    cost of a source file [credits].
+                                    Defaults to the duration of its audio
+                                    by <credits_per_min>.
+                                    (This param is optional)
+        :param float credits_per_min:
+                                    The default cost of a minute of audio.
+        :param bool  wait_for_credits:
+                                    If set, jobs which the balance can't
+                                    cover wait instead of being rejected.
+        :param str   order:         The order of the queued jobs of the
+                                    same priority, ORDER_FIFO or ORDER_SJF.
+        """
+        self.max_sessions = max_sessions
+        self.balance_refresh_sec = balance_refresh_sec
+        self.wait_for_credits = wait_for_credits
+        self.credits_per_min = credits_per_min
+        self.order = get_order(order)
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._cost = cost
+        self._get_balance = None
+
+        if logger:
+            self._logger = logger
+        else:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = 0
+        self._in_flight = set()
+        # The last balance of the server, and the costs of the admitted
+        # jobs since
+        self._balance = None
+        self._refreshed_at = None
+        self._stale = False
+        self._spent = 0.0
+        self._reserved = 0.0
+        self._thread = None
+        self._closed = False
+
+        self.stats = SchedulerStats()
+
+    def bind(self, get_balance):
+        """
+        Set the callable which returns the current balance (an
+        AudioEnhancer binds the balance() of its insoundzAPI client),
+        unless one is already set.
+        """
+        with self._cond:
+            if self._get_balance is None:
+                self._get_balance = get_balance
+
+    @property
+    def available(self):
+        """
+        The projected balance after the jobs in flight [credits], or None
+        if it's unknown.
+        """
+        with self._cond:
+            if self._balance is None:
+                return None
+            return self._balance - self._spent - self._reserved
+
+    def _update_stats(self):
+        # Called with the lock held
+        self.stats.queue_depth = len(self._queue)
+        self.stats.max_queue_depth = max(
+            self.stats.max_queue_depth, len(self._queue)
+        )
+        self.stats.in_flight = len(self._in_flight)
+        if self._balance is not None:
+            self.stats.balance = self._balance - self._spent
+
+    def _estimate(self, src, cost, duration):
+        # The duration is needed by the default cost and by ORDER_SJF
+        needs_duration = self.order == ORDER_SJF or \
+            cost is None and self._cost is None
+        try:
+            if duration is None and needs_duration:
+                duration = estimate_duration(src)
+            if cost is None:
+                if self._cost is not None:
+                    cost = self._cost(src)
+                else:
+                    cost = duration / 60 * self.credits_per_min
+        except Exception as e:
+            self._logger.warning(f"Couldn't estimate the cost of {src}: {e}")
+        return cost or 0.0, duration
+
+    def enqueue(
+        self, src, cost=None, priority=0, deadline=None, duration=None,
+        callback=None
+    ):
+        """
+        Queue a job. <callback> is called with its Ticket from the thread
+        of the scheduler once it's admitted or rejected (in which case the
+        <error> of the ticket is set); it must not block.
+
+        :param str   src:       The source file of the job.
+        :param float cost:      The projected cost of the job [credits].
+                                Estimated from <src> if not set.
+                                (This param is optional)
+        :param int   priority:  Jobs of higher priorities are admitted
+                                first.
+        :param float deadline:  The time the job should be done by (an
+                                epoch timestamp). Jobs with deadlines are
+                                admitted before the rest of their priority.
+                                (This param is optional)
+        :param float duration:  The duration of the audio of the job
+                                [sec]. Estimated from <src> if needed.
+                                (This param is optional)
+        :param       callback:  See above.
+                                (This param is optional)
+        :return:                The Ticket of the job.
+        """
+        cost, duration = self._estimate(src, cost, duration)
+        ticket = Ticket(src, cost, priority, deadline, duration, callback)
+
+        with self._cond:
+            if self._closed:
+                raise Exception("The scheduler was closed")
+            self._sequence += 1
+            key = order_key(
+                self.order, priority, deadline, duration, self._sequence
+            )
+            heapq.heappush(self._queue, key + (ticket,))
+            self._update_stats()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="insoundz-scheduler", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+        return ticket
+
+    def wait(self, ticket, timeout=None):
+        """
+        Block until <ticket> is admitted. Raises the error of a rejected
+        ticket.
+        """
+        if not ticket._event.wait(timeout):
+            raise Exception(
+                f"{ticket.src} wasn't admitted within {timeout} sec"
+            )
+        if ticket.error is not None:
+            raise ticket.error
+        return ticket
+
+    def admit(self, src, cost=None, priority=0, deadline=None, duration=None):
+        """
+        Queue a job (see enqueue()) and block until it's admitted. Returns
+        its Ticket, which must be released once its session is finished.
+        """
+        return self.wait(
+            self.enqueue(src, cost, priority, deadline, duration)
+        )
+
+    @contextmanager
+    def admitted(self, src, cost=None, priority=0, deadline=None):
+        """
+        Hold an admission for the body of a with statement.
+        """
+        ticket = self.admit(src, cost, priority, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def release(self, ticket, charged=True):
+        """
+        Free the session slot of an admitted <ticket>. Unless <charged>
+        (its session was never started or failed), its cost is returned to
+        the projected balance.
+        """
+        with self._cond:
+            if ticket.released or ticket not in self._in_flight:
+                return
+            ticket.released = True
+            self._in_flight.discard(ticket)
+            self._reserved -= ticket.cost
+            if charged:
+                self._spent += ticket.cost
+            self._stale = True
+            self._update_stats()
+            self._cond.notify_all()
+
+    def _refresh(self):
+        # Called without the lock, as it sends a request
+        try:
+            balance = float(self._get_balance())
+        except Exception as e:
+            self._logger.warning(f"Couldn't get the balance: {e}")
+            balance = None
+
+        with self._cond:
+            self._refreshed_at = time.monotonic()
+            self._stale = False
+            if balance is not None:
+                self._balance = balance
+                self._spent = 0.0
+                self._logger.debug(f"Balance: {balance:.2f} credits")
+            self._update_stats()
+
+    def _needs_refresh(self):
+        # Called with the lock held
+        if self._get_balance is None or self.balance_refresh_sec is None:
+            return False
+        return self._refreshed_at is None or \
+            time.monotonic() - self._refreshed_at >= self.balance_refresh_sec
+
+    def _affordable(self, ticket):
+        # Called with the lock held
+        if self._balance is None or self.balance_refresh_sec is None:
+            return True
+        return ticket.cost <= self._balance - self._spent - self._reserved
+
+    def _next(self):
+        """
+        Called with the lock held. Returns the ticket to admit or to reject,
+        "refresh" if the balance must be refreshed first, or the number of
+        seconds to wait (None until notified).
+        """
+        if not self._queue:
+            return None
+        ticket = self._queue[0][-1]
+
+        if self.max_sessions and len(self._in_flight) >= self.max_sessions:
+            return None
+        if self._needs_refresh():
+            return "refresh"
+
+        if not self._affordable(ticket):
+            if self._in_flight:
+                # Jobs which fail return their credits
+                return None
+            if self._stale and self._get_balance is not None:
+                return "refresh"
+            if self.wait_for_credits:
+                return self.balance_refresh_sec
+            heapq.heappop(self._queue)
+            ticket.error = Exception(
+                f"Insufficient balance to enhance {ticket.src}: it costs "
+                f"{ticket.cost:.2f} credits and "
+                f"{self._balance - self._spent:.2f} are left"
+            )
+            self.stats.rejected += 1
+            self._update_stats()
+            return ticket
+
+        if self._bucket is not None:
+            delay = self._bucket.take()
+            if delay:
+                if not ticket.throttled:
+                    ticket.throttled = True
+                    self.stats.throttled += 1
+                return delay
+
+        heapq.heappop(self._queue)
+        ticket.admitted_at = time.time()
+        self._in_flight.add(ticket)
+        self._reserved += ticket.cost
+        self.stats.admitted += 1
+        self.stats.total_wait_sec += ticket.wait_sec
+        self.stats.max_wait_sec = max(
+            self.stats.max_wait_sec, ticket.wait_sec
+        )
+        self._update_stats()
+        return ticket
+
+    def _dispatch(self, ticket):
+        ticket._event.set()
+        if ticket.callback is None:
+            return
+        try:
+            ticket.callback(ticket)
+        except Exception as e:
+            self._logger.error(f"Couldn't start {ticket.src}: {e}")
+            self.release(ticket, charged=False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    step = self._next()
+                    if isinstance(step, (Ticket, str)):
+                        break
+                    self._cond.wait(step)
+
+            if step == "refresh":
+                self._refresh()
+            else:
+                self._dispatch(step)
+
+    def close(self):
+        """
+        Stop admitting jobs, and reject the queued ones.
+        """
+        with self._cond:
+            self._closed = True
+            queued = [entry[-1] for entry in self._queue]
+            self._queue = []
+            self._update_stats()
+            self._cond.notify_all()
+
+        for ticket in queued:
+            ticket.error = Exception("The scheduler was closed")
+            self._dispatch(ticket)
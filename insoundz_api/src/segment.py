@@ -0,0 +1,291 @@
+import os
+import logging
+from pathlib import PurePath
+from insoundz_api.metrics import EnhanceResult
+
+# numpy and soundfile are optional dependencies
+# (pip install insoundz-api[segment]), they're imported by the functions
+# that use them.
+
+DEFAULT_SEGMENT_SEC = 600
+DEFAULT_OVERLAP_SEC = 2
+# How far from its nominal position a cut may move to a quieter point
+DEFAULT_SEARCH_SEC = 15
+DEFAULT_ENERGY_FRAME_SEC = 0.02
+DEFAULT_BLOCK_FRAMES = 65536
+
+SEGMENT_FORMAT = "WAV"
+
+
+def _dtype(subtype):
+    # Integer PCM is copied exactly, anything else as floating point
+    return "int32" if subtype.startswith("PCM") else "float64"
+
+
+def _read(fin, frames, channels, dtype):
+    """
+    Read exactly <frames> frames, padding with silence after the end of
+    the file.
+    """
+    import numpy as np
+
+    block = fin.read(frames, dtype=dtype, always_2d=True)
+    if len(block) < frames:
+        padding = np.zeros((frames - len(block), channels), dtype=dtype)
+        block = np.concatenate((block, padding))
+    return block
+
+
+def _copy(fin, fout, frames, channels, dtype):
+    while frames > 0:
+        block = _read(
+            fin, min(frames, DEFAULT_BLOCK_FRAMES), channels, dtype
+        )
+        fout.write(block)
+        frames -= len(block)
+
+
+def crossfade(tail, head):
+    """
+    Mix the overlap of two consecutive enhanced segments: the <tail> of
+    the first fades out linearly while the <head> of the second fades in.
+    Both hold the same audio, so the gains sum to 1.
+    """
+    import numpy as np
+
+    fade = np.linspace(0.0, 1.0, len(tail) + 2)[1:-1, np.newaxis]
+    mixed = tail * (1.0 - fade) + head * fade
+    if np.issubdtype(tail.dtype, np.integer):
+        mixed = np.rint(mixed)
+    return mixed.astype(tail.dtype)
+
+
+class Segment(object):
+    """
+    The frames [<start>, <end>) of the source. Consecutive segments overlap
+    around the cut between them.
+    """
+    def __init__(self, index, start, end, path=None):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.path = path
+
+    @property
+    def frames(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Segment(index={self.index}, start={self.start}, " \
+            f"end={self.end})"
+
+
+class SegmentedResult(EnhanceResult):
+    """
+    The (<sids>, <status>, <resp_info>) of a segmented enhancement, where
+    <sids> holds the session ID of every segment and <resp_info> is the
+    path of the stitched file (or the failure reason). Its <segments> is
+    the list of the BatchResults of the segments.
+    """
+    def __new__(cls, sids, status, resp_info, timings=None, segments=None):
+        result = super().__new__(cls, sids, status, resp_info, timings)
+        result.segments = segments or []
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.timings, self.segments)
+
+
+class AudioSegmenter(object):
+    """
+    Splits a long recording into overlapping segments which are enhanced
+    as separate sessions, and stitches the enhanced segments back together.
+
+    The cuts are placed at the quietest point within <search_sec> of every
+    <segment_sec> boundary, and consecutive segments overlap by
+    <overlap_sec> around the cut. The overlaps are crossfaded when
+    stitching, and the stitched file has exactly the frames of the source.
+    """
+    def __init__(
+        self, segment_sec=DEFAULT_SEGMENT_SEC,
+        overlap_sec=DEFAULT_OVERLAP_SEC, search_sec=None, logger=None
+    ):
+        """
+        :param float segment_sec:   The nominal length of a segment [sec].
+        :param float overlap_sec:   The overlap of consecutive segments
+                                    [sec].
+        :param float search_sec:    How far from its nominal position a cut
+                                    may move to a quieter point [sec].
+                                    Defaults to a tenth of <segment_sec>,
+                                    up to DEFAULT_SEARCH_SEC.
+                                    (This param is optional)
+        """
+        try:
+            import numpy  # noqa: F401
+            import soundfile  # noqa: F401
+        except ImportError:
+            raise Exception(
+                "Segmentation requires the numpy and soundfile packages. "
+                "Install them with 'pip install insoundz-api[segment]'"
+            )
+
+        if search_sec is None:
+            search_sec = min(DEFAULT_SEARCH_SEC, segment_sec / 10)
+        if segment_sec <= 2 * (overlap_sec + search_sec):
+            raise Exception(
+                f"Invalid segment length {segment_sec}. It must be longer "
+                "than twice the overlap and the search range"
+            )
+
+        self.segment_sec = segment_sec
+        self.overlap_sec = overlap_sec
+        self.search_sec = search_sec
+
+        if logger:
+            self._logger = logger
+        else:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+    def _energy(self, src, frame):
+        """
+        The mean energy of every <frame> frames of <src>.
+        """
+        import numpy as np
+        import soundfile
+
+        energies = []
+        with soundfile.SoundFile(src) as fin:
+            for block in fin.blocks(
+                frame * (DEFAULT_BLOCK_FRAMES // frame + 1),
+                dtype="float32", always_2d=True
+            ):
+                count = len(block) // frame
+                mono = block[:count * frame].mean(axis=1)
+                energies.append(
+                    np.square(mono).reshape(count, frame).mean(axis=1)
+                )
+        if not energies:
+            return np.zeros(0)
+        return np.concatenate(energies)
+
+    def plan(self, src):
+        """
+        Return the Segments of <src>; a single one if it's short.
+        """
+        import numpy as np
+        import soundfile
+
+        info = soundfile.info(src)
+        total = info.frames
+        segment = int(self.segment_sec * info.samplerate)
+        overlap = int(self.overlap_sec * info.samplerate)
+        search = int(self.search_sec * info.samplerate)
+        if total <= segment + search:
+            return [Segment(0, 0, total)]
+
+        frame = max(1, int(DEFAULT_ENERGY_FRAME_SEC * info.samplerate))
+        energy = self._energy(src, frame)
+        # The whole overlap around a cut should be quiet, not only the cut
+        window = max(1, overlap // frame)
+        energy = np.convolve(energy, np.ones(window) / window, mode="same")
+
+        cuts = []
+        position = 0
+        while total - position > segment + search:
+            nominal = position + segment
+            first = (nominal - search) // frame
+            last = min(nominal + search, total - overlap) // frame
+            last = max(last, first + 1)
+            quietest = first + int(np.argmin(energy[first:last]))
+            cuts.append(quietest * frame + frame // 2)
+            position = cuts[-1]
+
+        half = overlap // 2
+        starts = [0] + [max(cut - half, 0) for cut in cuts]
+        ends = [min(cut + overlap - half, total) for cut in cuts] + [total]
+        return [
+            Segment(index, start, end)
+            for index, (start, end) in enumerate(zip(starts, ends))
+        ]
+
+    def split(self, src, segments, folder):
+        """
+        Write every segment of <src> into <folder>, and set its <path>.
+        """
+        import soundfile
+
+        stem = PurePath(src).stem
+        with soundfile.SoundFile(src) as fin:
+            subtype = fin.subtype
+            if not soundfile.check_format(SEGMENT_FORMAT, subtype):
+                subtype = "FLOAT"
+            dtype = _dtype(subtype)
+
+            for segment in segments:
+                segment.path = os.path.join(
+                    folder, f"{stem}.{segment.index:04d}.wav"
+                )
+                fin.seek(segment.start)
+                with soundfile.SoundFile(
+                    segment.path, "w", samplerate=fin.samplerate,
+                    channels=fin.channels, format=SEGMENT_FORMAT,
+                    subtype=subtype
+                ) as fout:
+                    _copy(fin, fout, segment.frames, fin.channels, dtype)
+
+    def stitch(self, src, segments, paths, dst):
+        """
+        Stitch the enhanced <paths> of the <segments> of <src> into <dst>,
+        in the format of <src>. Returns the number of frames written.
+        """
+        import soundfile
+
+        info = soundfile.info(src)
+        dtype = _dtype(info.subtype)
+        written = 0
+
+        with soundfile.SoundFile(
+            dst, "w", samplerate=info.samplerate, channels=info.channels,
+            format=info.format, subtype=info.subtype
+        ) as fout:
+            tail = None
+            for index, (segment, path) in enumerate(zip(segments, paths)):
+                with soundfile.SoundFile(path) as fin:
+                    if fin.samplerate != info.samplerate or \
+                            fin.channels != info.channels:
+                        raise Exception(
+                            f"Enhanced segment {index} is {fin.samplerate} "
+                            f"Hz, {fin.channels} channels, instead of "
+                            f"{info.samplerate} Hz, {info.channels} channels"
+                        )
+                    if fin.frames != segment.frames:
+                        self._logger.warning(
+                            f"Enhanced segment {index} has {fin.frames} "
+                            f"frames instead of {segment.frames}, it's "
+                            "aligned to the source"
+                        )
+
+                    position = 0
+                    if tail is not None:
+                        head = _read(fin, len(tail), info.channels, dtype)
+                        fout.write(crossfade(tail, head))
+                        position = len(tail)
+
+                    # The frames up to the overlap with the next segment
+                    body_end = segment.frames
+                    if index + 1 < len(segments):
+                        body_end = segments[index + 1].start - segment.start
+                    _copy(
+                        fin, fout, body_end - position, info.channels, dtype
+                    )
+
+                    tail = None
+                    if index + 1 < len(segments):
+                        tail = _read(
+                            fin, segment.end - segments[index + 1].start,
+                            info.channels, dtype
+                        )
+                    written = segment.end
+
+        return written
@@ -0,0 +1,212 @@
+import threading
+from functools import lru_cache
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_PREWARM_TIMEOUT_SEC = 10
+
+
+class HandshakeCounter(object):
+    """
+    A thread-safe counter of the connections (TCP+TLS handshakes) that
+    were opened by a SessionPool.
+    Counts are kept both globally and per calling thread, so a single
+    enhancement can measure its own handshakes while other threads are
+    using the same pool.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._total = 0
+
+    def increment(self):
+        with self._lock:
+            self._total += 1
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    @property
+    def total(self):
+        return self._total
+
+    @property
+    def thread_total(self):
+        return getattr(self._local, "count", 0)
+
+
+def _counting_pool_class(base, counter):
+    class CountingConnection(base.ConnectionCls):
+        def connect(self):
+            counter.increment()
+            return super().connect()
+
+    class CountingConnectionPool(base):
+        ConnectionCls = CountingConnection
+
+    return CountingConnectionPool
+
+
+@lru_cache(maxsize=None)
+def _counting_adapter_class():
+    """
+    Return an HTTPAdapter class that reports every new connection to a
+    HandshakeCounter. It is built on first use, so that importing this
+    module doesn't import requests.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import (
+        HTTPConnectionPool, HTTPSConnectionPool
+    )
+
+    class CountingHTTPAdapter(HTTPAdapter):
+        def __init__(self, counter, **kwargs):
+            self._counter = counter
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _counting_pool_class(
+                    HTTPConnectionPool, self._counter
+                ),
+                "https": _counting_pool_class(
+                    HTTPSConnectionPool, self._counter
+                ),
+            }
+
+    return CountingHTTPAdapter
+
+
+class SessionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections.
+    The pool is shared by every insoundzAPI call and by the upload/download
+    helpers, so status polls and transfers reuse open connections instead
+    of paying for a new TCP+TLS handshake on every request.
+
+    Every thread gets its own requests.Session, while all sessions share a
+    single connection pool.
+    """
+    def __init__(
+        self,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        pool_block=False,
+        keep_alive=True,
+    ):
+        """
+        :param int  pool_connections:   The number of hosts to keep a
+                                        connection pool for.
+        :param int  pool_maxsize:       The maximal number of connections
+                                        to keep open per host.
+        :param bool pool_block:         If set, requests will wait for a free
+                                        connection instead of opening a new
+                                        (non-pooled) one.
+        :param bool keep_alive:         If not set, every connection is
+                                        closed after its request is done.
+        """
+        self._counter = HandshakeCounter()
+        self._adapter = _counting_adapter_class()(
+            self._counter,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self._keep_alive = keep_alive
+        self._local = threading.local()
+        self._closed = False
+
+    def _new_session(self):
+        import requests
+
+        session = requests.Session()
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+        if not self._keep_alive:
+            session.headers.update({"Connection": "close"})
+        return session
+
+    @property
+    def session(self):
+        """
+        The requests.Session of the calling thread.
+        """
+        if self._closed:
+            raise Exception("Session pool is closed")
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._new_session()
+            self._local.session = session
+        return session
+
+    @property
+    def handshakes(self):
+        """
+        The total number of connections opened by this pool.
+        """
+        return self._counter.total
+
+    @property
+    def thread_handshakes(self):
+        """
+        The number of connections opened by the calling thread.
+        """
+        return self._counter.thread_total
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def prewarm(self, url, connections=1, timeout=DEFAULT_PREWARM_TIMEOUT_SEC):
+        """
+        Open <connections> connections to <url> ahead of time, so the first
+        requests don't pay for the handshakes.
+        Failures are ignored, a cold connection will be opened on demand.
+        """
+        from requests.exceptions import RequestException
+
+        def _warm():
+            try:
+                self.head(url, timeout=timeout).close()
+            except RequestException:
+                pass
+
+        threads = [
+            threading.Thread(target=_warm, daemon=True)
+            for _ in range(connections)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def __getattr__(name):
+    # CountingHTTPAdapter is built on first use
+    if name == "CountingHTTPAdapter":
+        return _counting_adapter_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime
+
+# Stored next to the ~/.netrc credentials store of insoundz_cli
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(Path.home(), ".insoundz_tokens")
+DEFAULT_REFRESH_MARGIN_SEC = 60
+DEFAULT_REFRESH_RETRY_SEC = 30
+
+
+def parse_expires(expires, now=None):
+    """
+    Convert the <expires> value of an account token (an epoch timestamp,
+    a number of seconds from now or an ISO-8601 date) into an epoch
+    timestamp. Returns None if it can't be parsed.
+    """
+    now = now or time.time()
+
+    if expires is None:
+        return None
+
+    if isinstance(expires, (int, float)) or \
+            isinstance(expires, str) and expires.replace(".", "", 1).isdigit():
+        expires = float(expires)
+        # Epoch timestamps in milliseconds
+        if expires > 1e12:
+            return expires / 1000
+        if expires > 1e9:
+            return expires
+        return now + expires
+
+    try:
+        expires_at = datetime.fromisoformat(expires.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return expires_at.timestamp()
+
+
+class TokenCache(object):
+    """
+    A persistent on-disk cache of account tokens.
+    The file is only readable by its owner and is replaced atomically.
+    Tokens are keyed by a hash of the endpoint and the credentials, so the
+    cache never holds the secret itself.
+    """
+    def __init__(self, path=DEFAULT_TOKEN_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint_url, client_id, secret):
+        return hashlib.sha256(
+            f"{endpoint_url}\0{client_id}\0{secret}".encode("utf-8")
+        ).hexdigest()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        folder = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".insoundz_tokens")
+        try:
+            os.chmod(tmp_path, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                json.dump(entries, tmp)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        """
+        Return a cached (<token>, <expires_at>) or None.
+        """
+        with self._lock:
+            entry = self._read().get(key)
+        if not entry:
+            return None
+        return entry["token"], entry["expires_at"]
+
+    def set(self, key, token, expires_at):
+        now = time.time()
+        with self._lock:
+            entries = {
+                k: v for k, v in self._read().items()
+                if v.get("expires_at") and v["expires_at"] > now
+            }
+            entries[key] = {"token": token, "expires_at": expires_at}
+            self._write(entries)
+
+    def delete(self, key):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+
+class TokenManager(object):
+    """
+    Keeps a valid account token.
+    The token is fetched lazily on first use, taken from a TokenCache when
+    possible, and refreshed in the background <refresh_margin_sec> seconds
+    before it expires, so requests never wait for a refresh.
+    """
+    def __init__(
+        self, fetch=None, cache=None, cache_key=None,
+        refresh_margin_sec=DEFAULT_REFRESH_MARGIN_SEC,
+        background_refresh=True, logger=None
+    ):
+        """
+        :param callable fetch:          Returns a new (<token>, <expires>).
+                                        If not set, the owner fetches
+                                        tokens itself and calls set().
+        :param TokenCache cache:        A persistent token cache.
+                                        (This param is optional)
+        :param str  cache_key:          The key of the token in the cache.
+        :param int  refresh_margin_sec: Refresh the token this long before
+                                        it expires.
+        :param bool background_refresh: Refresh ahead of time from a
+                                        background timer.
+        """
+        self._fetch = fetch
+        self._cache = cache
+        self._cache_key = cache_key
+        self._margin = refresh_margin_sec
+        self._background_refresh = background_refresh and fetch is not None
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._lock = threading.RLock()
+        self._fetch_lock = threading.Lock()
+        self._token = None
+        self._expires_at = None
+        self._refresh_at = None
+        self._timer = None
+        self._loaded = False
+        self._closed = False
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    def _load_cached(self):
+        self._loaded = True
+        if not self._cache:
+            return
+
+        cached = self._cache.get(self._cache_key)
+        if cached:
+            token, expires_at = cached
+            if expires_at and expires_at - self._margin > time.time():
+                self._logger.info("Using a cached account token")
+                self._set(token, expires_at)
+
+    def needs_refresh(self):
+        with self._lock:
+            if not self._loaded:
+                self._load_cached()
+            if self._token is None:
+                return True
+            if self._refresh_at is None:
+                return False
+            return self._refresh_at <= time.time()
+
+    def _usable(self):
+        # A token which is due for a refresh is still used until it expires
+        # while a background refresh is pending
+        with self._lock:
+            if self._token is None:
+                return False
+            if not self.needs_refresh():
+                return True
+            return self._timer is not None and \
+                self._expires_at is not None and \
+                self._expires_at > time.time()
+
+    def peek(self):
+        """
+        Return the current token if it's still valid, without fetching.
+        """
+        if self.needs_refresh():
+            return None
+        return self._token
+
+    def get(self):
+        """
+        Return a valid token, fetching a new one if needed.
+        """
+        if self._usable():
+            return self._token
+
+        with self._fetch_lock:
+            if not self.needs_refresh():
+                return self._token
+            return self.refresh()
+
+    def refresh(self):
+        """
+        Fetch a new token now.
+        """
+        token, expires = self._fetch()
+        self.set(token, expires)
+        return token
+
+    def set(self, token, expires=None):
+        """
+        Store a new token (and persist it in the cache).
+        """
+        expires_at = parse_expires(expires)
+        with self._lock:
+            self._set(token, expires_at)
+            self._loaded = True
+
+        if self._cache and expires_at:
+            try:
+                self._cache.set(self._cache_key, token, expires_at)
+            except OSError as e:
+                self._logger.warning(f"Couldn't cache the account token: {e}")
+
+    def _set(self, token, expires_at):
+        self._token = token
+        self._expires_at = expires_at
+        self._refresh_at = None
+        if expires_at:
+            # Short-lived tokens are refreshed halfway through their lifetime
+            lifetime = expires_at - time.time()
+            self._refresh_at = expires_at - min(self._margin, lifetime / 2)
+        self._schedule_refresh()
+
+    def invalidate(self):
+        """
+        Drop the current token (e.g. after it was rejected by the server).
+        """
+        with self._lock:
+            self._token = None
+            self._expires_at = None
+            self._refresh_at = None
+            self._cancel_timer()
+
+        if self._cache:
+            try:
+                self._cache.delete(self._cache_key)
+            except OSError:
+                pass
+
+    def _cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule_refresh(self, delay=None):
+        self._cancel_timer()
+        if not self._background_refresh or self._closed:
+            return
+
+        if delay is None:
+            if self._refresh_at is None:
+                return
+            delay = max(self._refresh_at - time.time(), 0)
+
+        self._timer = threading.Timer(delay, self._background_refresh_token)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh_token(self):
+        try:
+            with self._fetch_lock:
+                self.refresh()
+            self._logger.info("The account token was refreshed")
+        except Exception as e:
+            self._logger.warning(f"Couldn't refresh the account token: {e}")
+            with self._lock:
+                self._schedule_refresh(DEFAULT_REFRESH_RETRY_SEC)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._cancel_timer()
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import requests
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from insoundz_api.helpers import upload_file, open_progress
+from insoundz_api.retry import get_retry_policy
+
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_UPLOAD_STATE_DIR = os.path.join(Path.home(), ".insoundz_uploads")
+
+
+class PartTiming(object):
+    """
+    The upload timing of a single part.
+    """
+    def __init__(self, number, size, elapsed, attempts=1):
+        self.number = number
+        self.size = size
+        self.elapsed = elapsed
+        self.attempts = attempts
+
+    @property
+    def bytes_per_sec(self):
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return f"PartTiming(number={self.number}, size={self.size}, " \
+            f"elapsed={self.elapsed:.3f}, attempts={self.attempts})"
+
+
+class UploadReport(object):
+    """
+    The outcome of an upload: whether it was a multipart upload, how many
+    parts were resumed from a previous run, and the timing of every part
+    that was uploaded.
+    """
+    def __init__(self, src, sid, size, multipart=False):
+        self.src = src
+        self.sid = sid
+        self.size = size
+        self.multipart = multipart
+        self.resumed_parts = 0
+        self.parts = []
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def bytes_uploaded(self):
+        return sum(part.size for part in self.parts)
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_uploaded / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        text = f"{self.bytes_uploaded} bytes in {self.elapsed:.2f} sec " \
+            f"({self.bytes_per_sec / 1024 / 1024:.2f} MB/s)"
+        if not self.multipart:
+            return text + " as a single PUT"
+
+        text += f"; {len(self.parts)} parts"
+        if self.resumed_parts:
+            text += f" ({self.resumed_parts} resumed)"
+        if self.parts:
+            times = sorted(part.elapsed for part in self.parts)
+            text += f"; part time min/median/max " \
+                f"{times[0]:.2f}/{times[len(times) // 2]:.2f}/" \
+                f"{times[-1]:.2f} sec"
+        return text
+
+
+class _UploadState(object):
+    """
+    The state file of a multipart upload, so an upload which crashed can be
+    resumed (with the same session and part URLs) by a later run.
+    """
+    def __init__(self, path, sid, upload, part_size, etags=None):
+        self.path = path
+        self.sid = sid
+        self.upload = upload
+        self.part_size = part_size
+        self.etags = dict(etags or {})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(src):
+        stat = os.stat(src)
+        return hashlib.sha256(
+            f"{os.path.abspath(src)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+            .encode("utf-8")
+        ).hexdigest()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r", encoding="utf-8") as fd:
+                state = json.load(fd)
+            return cls(
+                path, state["sid"], state["upload"], state["part_size"],
+                {int(number): etag for number, etag in state["etags"].items()}
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        with self._lock:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fd:
+                json.dump({
+                    "sid": self.sid,
+                    "upload": self.upload,
+                    "part_size": self.part_size,
+                    "etags": self.etags,
+                }, fd)
+            os.replace(tmp_path, self.path)
+
+    def part_done(self, number, etag):
+        with self._lock:
+            self.etags[number] = etag
+        self.save()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MultipartUploader(object):
+    """
+    Upload a source file in parts over several connections in parallel.
+    Every part is retried on its own, and the progress of every multipart
+    upload is kept in <state_dir> so that an upload which crashed resumes
+    from the parts that were not uploaded yet.
+    An upload target without part URLs is uploaded with a single PUT.
+    """
+    def __init__(
+        self, session=None, max_workers=DEFAULT_UPLOAD_WORKERS,
+        part_size=DEFAULT_PART_SIZE, retry_policy=None,
+        state_dir=DEFAULT_UPLOAD_STATE_DIR, logger=None
+    ):
+        """
+        :param SessionPool session:     The connection pool to upload with.
+                                        (This param is optional)
+        :param int  max_workers:        The number of parts which are
+                                        uploaded concurrently.
+        :param int  part_size:          The size of every part [bytes].
+        :param RetryPolicy retry_policy:
+                                        How failed parts are retried (every
+                                        part on its own), or a number of
+                                        retries.
+                                        (This param is optional)
+        :param str  state_dir:          Where the state of multipart
+                                        uploads is kept.
+        """
+        self._session = session
+        self._http = session or requests
+        self._max_workers = max_workers
+        self._retry = get_retry_policy(retry_policy)
+        self._state_dir = state_dir
+        self.part_size = part_size
+
+        self._logger = logger
+        if not self._logger:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+    def use_multipart(self, src):
+        return os.path.getsize(src) > self.part_size
+
+    def _state_path(self, src):
+        return os.path.join(self._state_dir, _UploadState.key(src) + ".json")
+
+    def resume(self, src):
+        """
+        Return the (<session_id>, <upload>) of an unfinished multipart
+        upload of <src>, or None.
+        """
+        state = _UploadState.load(self._state_path(src))
+        if not state:
+            return None
+        return state.sid, state.upload
+
+    def discard(self, src):
+        """
+        Forget the unfinished multipart upload of <src>.
+        """
+        _UploadState(self._state_path(src), None, None, None).remove()
+
+    def _read_part(self, src, number, part_size):
+        with open(src, "rb") as fd:
+            fd.seek((number - 1) * part_size)
+            return fd.read(part_size)
+
+    def _upload_part(self, src, url, number, part_size, state, progress):
+        data = self._read_part(src, number, part_size)
+        attempts = [1]
+        start_time = time.time()
+
+        def retried(error):
+            attempts[0] += 1
+            self._logger.warning(
+                f"[{state.sid}] Retrying part {number} of {src}: {error}"
+            )
+
+        response = self._retry.call(
+            lambda: self._http.put(
+                url, data=data, timeout=self._retry.timeout(len(data))
+            ),
+            "PUT", on_retry=retried
+        )
+
+        timing = PartTiming(
+            number, len(data), time.time() - start_time, attempts[0]
+        )
+        state.part_done(number, response.headers.get("ETag"))
+        progress(len(data))
+        self._logger.debug(f"[{state.sid}] Uploaded {timing}")
+        return timing
+
+    def _complete(self, state):
+        complete_url = state.upload.get("complete_url")
+        if not complete_url:
+            return
+
+        parts = [
+            {"part_number": number, "etag": etag}
+            for number, etag in sorted(state.etags.items())
+        ]
+        # Completing the same parts twice is harmless
+        self._retry.call(
+            lambda: self._http.post(
+                complete_url, json={"parts": parts},
+                timeout=self._retry.timeout()
+            ),
+            "POST", idempotent=True, logger=self._logger
+        )
+
+    def _upload_single(self, src, sid, url, pbar):
+        report = UploadReport(src, sid, os.path.getsize(src))
+        start_time = time.time()
+        upload_file(
+            src, url, pbar, session=self._session, retry_policy=self._retry
+        )
+        report.parts.append(
+            PartTiming(1, report.size, time.time() - start_time)
+        )
+        report.end_time = time.time()
+        return report
+
+    def upload(self, src, sid, upload, pbar=False):
+        """
+        Upload <src> to the target that was returned with session <sid>.
+
+        :param str  src:        A local path of the file.
+        :param str  sid:        The session ID.
+        :param dict upload:     The upload target: an "upload_url" and
+                                optionally "part_urls", "part_size" and a
+                                "complete_url".
+        :param      pbar:       If set, show a progress bar. See
+                                open_progress().
+        :return:                The per-part timings of the upload.
+        :rtype:                 UploadReport
+        """
+        part_urls = upload.get("part_urls")
+        if not part_urls:
+            return self._upload_single(src, sid, upload["upload_url"], pbar)
+
+        part_size = upload.get("part_size") or self.part_size
+        state_path = self._state_path(src)
+        state = _UploadState.load(state_path)
+        if not state or state.sid != sid:
+            state = _UploadState(state_path, sid, upload, part_size)
+            state.save()
+
+        report = UploadReport(src, sid, os.path.getsize(src), multipart=True)
+        pending = [
+            (number, url) for number, url in enumerate(part_urls, 1)
+            if number not in state.etags
+        ]
+        report.resumed_parts = len(part_urls) - len(pending)
+        if report.resumed_parts:
+            self._logger.info(
+                f"[{sid}] Resuming the upload of {src}, "
+                f"{report.resumed_parts}/{len(part_urls)} parts are done"
+            )
+
+        resumed = min(report.resumed_parts * part_size, report.size)
+        bar = open_progress(pbar, report.size, resumed, desc="Uploading")
+        lock = threading.Lock()
+
+        def progress(length):
+            if bar is not None:
+                with lock:
+                    bar.update(length)
+
+        try:
+            workers = max(min(self._max_workers, len(pending)), 1)
+            with ThreadPoolExecutor(
+                workers, thread_name_prefix="insoundz-part"
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self._upload_part, src, url, number, part_size,
+                        state, progress
+                    )
+                    for number, url in pending
+                ]
+                report.parts = [future.result() for future in futures]
+        finally:
+            if bar is not None:
+                bar.close()
+
+        self._complete(state)
+        state.remove()
+        report.end_time = time.time()
+        return report
@@ -0,0 +1,259 @@
+import os
+import time
+import queue
+import fnmatch
+import logging
+import threading
+from insoundz_api.helpers import enhanced_filename
+
+# watchdog is an optional dependency (pip install insoundz-api[watch]).
+# Without it the folder is scanned periodically.
+
+DEFAULT_SETTLE_SEC = 5
+DEFAULT_SCAN_INTERVAL_SEC = 2
+# Files which are still being written or aren't audio
+DEFAULT_IGNORED_PATTERNS = (
+    ".*", "*.part", "*.part.json", "*.tmp", "*.crdownload", "*~"
+)
+
+_STOP = object()
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FolderWatcher(object):
+    """
+    Watch a folder tree for new or replaced audio files, and yield every
+    file once its writes have settled (its size and modification time
+    didn't change for <settle_sec>).
+
+    Iterating over the watcher yields (src, dst_folder) tuples, with the
+    tree of <folder> mirrored into <dst>, so it can be passed straight to
+    AudioEnhancer.enhance_many() as an endless batch:
+
+        watcher = FolderWatcher("/mnt/incoming", "/mnt/enhanced")
+        for result in enhancer.enhance_many(watcher):
+            ...
+
+    Files which already exist are yielded too, unless their enhanced file
+    is newer than them. The iteration ends once stop() is called (e.g.
+    from a signal handler), and the batch then drains its in-flight jobs.
+
+    File system events (inotify on Linux) are used if the watchdog package
+    is installed, otherwise the folder is scanned every
+    <scan_interval_sec>.
+    """
+    def __init__(
+        self, folder, dst, pattern="*", settle_sec=DEFAULT_SETTLE_SEC,
+        scan_interval_sec=DEFAULT_SCAN_INTERVAL_SEC, recursive=True,
+        ignored_patterns=DEFAULT_IGNORED_PATTERNS, logger=None
+    ):
+        """
+        :param str   folder:            The folder to watch.
+        :param str   dst:               The folder the enhanced files are
+                                        written to. It's never watched,
+                                        even if it's inside <folder>.
+        :param str   pattern:           Only files that match this pattern
+                                        are yielded.
+        :param float settle_sec:        How long a file must stay unchanged
+                                        before it's yielded [sec].
+        :param float scan_interval_sec: The interval of the scans when file
+                                        system events aren't available
+                                        [sec].
+        :param bool  recursive:         If set, the sub-folders of <folder>
+                                        are watched too.
+        :param tuple ignored_patterns:  Files that match these patterns are
+                                        never yielded.
+        """
+        self.folder = os.path.abspath(folder)
+        self.dst = os.path.abspath(dst)
+        self.pattern = pattern
+        self.settle_sec = settle_sec
+        self.scan_interval_sec = scan_interval_sec
+        self.recursive = recursive
+        self.ignored_patterns = tuple(ignored_patterns)
+
+        if logger:
+            self._logger = logger
+        else:
+            self._logger = logging.getLogger(__class__.__name__)
+            self._logger.addHandler(logging.NullHandler())
+
+        self._lock = threading.Lock()
+        # path: (size, mtime, the time it last changed)
+        self._pending = {}
+        # path: (size, mtime) of the files which were yielded
+        self._yielded = {}
+        self._ready = queue.Queue()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._started = False
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def _dst_folder(self, path):
+        rel_dir = os.path.relpath(os.path.dirname(path), self.folder)
+        return os.path.normpath(os.path.join(self.dst, rel_dir))
+
+    def _is_watched(self, path):
+        name = os.path.basename(path)
+        if not fnmatch.fnmatch(name, self.pattern) or any(
+            fnmatch.fnmatch(name, ignored)
+            for ignored in self.ignored_patterns
+        ):
+            return False
+        if os.path.commonpath([path, self.dst]) == self.dst:
+            return False
+        if not self.recursive and os.path.dirname(path) != self.folder:
+            return False
+        return True
+
+    def _is_enhanced(self, path, stat):
+        enhanced = os.path.join(
+            self._dst_folder(path), enhanced_filename(path)
+        )
+        enhanced_stat = _stat(enhanced)
+        return enhanced_stat is not None and enhanced_stat[1] >= stat[1]
+
+    def _touch(self, path):
+        # Called on every sign of a change of <path>
+        path = os.path.abspath(path)
+        if not self._is_watched(path):
+            return
+        stat = _stat(path)
+        with self._lock:
+            if stat is None:
+                self._pending.pop(path, None)
+                self._yielded.pop(path, None)
+            elif self._yielded.get(path) != stat and \
+                    self._pending.get(path, (None, None))[:2] != stat:
+                self._pending[path] = stat + (time.monotonic(),)
+
+    def _scan(self, folder=None):
+        for root, dirs, filenames in os.walk(folder or self.folder):
+            if os.path.commonpath([root, self.dst]) == self.dst:
+                dirs[:] = []
+                continue
+            for filename in filenames:
+                self._touch(os.path.join(root, filename))
+            if not self.recursive:
+                break
+
+    def _prune(self):
+        # Forget the yielded files which were removed, since a scan only
+        # touches the files which exist
+        with self._lock:
+            yielded = list(self._yielded)
+        for path in yielded:
+            if _stat(path) is None:
+                with self._lock:
+                    self._yielded.pop(path, None)
+
+    def _settle(self):
+        # Yields the files that didn't change for <settle_sec>
+        now = time.monotonic()
+        with self._lock:
+            pending = list(self._pending.items())
+
+        for path, (size, mtime, since) in pending:
+            stat = _stat(path)
+            with self._lock:
+                if stat is None:
+                    self._pending.pop(path, None)
+                    self._yielded.pop(path, None)
+                    continue
+                if stat != (size, mtime):
+                    self._pending[path] = stat + (now,)
+                    continue
+                if now - since < self.settle_sec:
+                    continue
+                self._pending.pop(path, None)
+                self._yielded[path] = stat
+
+            if self._is_enhanced(path, stat):
+                self._logger.info(f"{path} was already enhanced")
+                continue
+            self._ready.put((path, self._dst_folder(path)))
+
+    def _run(self):
+        last_scan = time.monotonic()
+        interval = min(self.settle_sec / 4, 1) or 0.1
+        while not self._stopped.wait(interval):
+            if self._observer is None and \
+                    time.monotonic() - last_scan >= self.scan_interval_sec:
+                self._scan()
+                self._prune()
+                last_scan = time.monotonic()
+            self._settle()
+
+    def _start_observer(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            self._logger.info(
+                f"watchdog isn't installed, scanning {self.folder} every "
+                f"{self.scan_interval_sec} sec"
+            )
+            return None
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                path = getattr(event, "dest_path", "") or event.src_path
+                if event.is_directory:
+                    # The files of a folder that was moved in
+                    if event.event_type in ("created", "moved"):
+                        watcher._scan(path)
+                    return
+                if event.event_type == "moved":
+                    # The file is gone from its former path
+                    watcher._touch(event.src_path)
+                watcher._touch(path)
+
+        observer = Observer()
+        observer.schedule(Handler(), self.folder, recursive=self.recursive)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        os.makedirs(self.dst, exist_ok=True)
+        self._observer = self._start_observer()
+        self._scan()
+        threading.Thread(
+            target=self._run, name="insoundz-watch", daemon=True
+        ).start()
+        self._logger.info(f"Watching {self.folder}")
+
+    def stop(self):
+        """
+        Stop watching. The iteration ends, and files which weren't yielded
+        yet are left for the next run.
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+        self._ready.put(_STOP)
+
+    def __iter__(self):
+        self.start()
+        while True:
+            item = self._ready.get()
+            if item is _STOP:
+                return
+            yield item
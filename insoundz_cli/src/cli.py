@@ -1,10 +1,31 @@
 #!/usr/bin/env python
 
 import os
+import sys
+import glob
+import signal
+import fnmatch
 import click
 import click_creds
 from insoundz_api.api import insoundzAPI
-from insoundz_api.enhancer import AudioEnhancer
+from insoundz_api.batch import DEFAULT_BATCH_WORKERS
+from insoundz_api.polling import (
+    get_polling_policy, DEFAULT_STATUS_INTERVAL_SEC
+)
+from insoundz_api.retry import DEFAULT_RETRIES
+from insoundz_api.segment import DEFAULT_OVERLAP_SEC
+from insoundz_api.cache import ResultCache, DEFAULT_CACHE_MAX_SIZE
+from insoundz_api.journal import DEFAULT_JOURNAL_PATH
+from insoundz_api.scheduler import (
+    JobScheduler, DEFAULT_BALANCE_REFRESH_SEC, ORDER_FIFO, ORDERS
+)
+from insoundz_api.watch import DEFAULT_SETTLE_SEC, DEFAULT_SCAN_INTERVAL_SEC
+from insoundz_api.callback import (
+    CallbackListener, DEFAULT_FALLBACK_INTERVAL_SEC
+)
+
+# The enhancer (and requests, tqdm and halo with it) is imported by the
+# commands that use it, so that --help and config start fast.
 
 
 def get_credentials(cred_store):
@@ -70,6 +91,121 @@ def get_url(ctx, param, value):
     return url
 
 
+def get_status_interval(ctx, param, value):
+    try:
+        return get_polling_policy(value)
+    except Exception as e:
+        raise click.BadParameter(str(e))
+
+
+def get_callback_address(ctx, param, value):
+    if value is None:
+        return None
+    host, _, port = value.rpartition(":")
+    if not port.isdigit():
+        raise click.BadParameter(f"{value} isn't a HOST:PORT address")
+    return host, int(port)
+
+
+def get_callback(callback_listen, callback_url):
+    if not callback_listen:
+        if callback_url:
+            raise click.UsageError(
+                "--callback-url requires --callback-listen."
+            )
+        return None
+    host, port = callback_listen
+    return CallbackListener(host, port, public_url=callback_url)
+
+
+def get_result_cache(cache_dir, cache_size):
+    if not cache_dir:
+        return None
+    return ResultCache(cache_dir, max_size=cache_size * 1024 * 1024)
+
+
+def get_scheduler(rate_limit, max_sessions, check_balance, order):
+    if not rate_limit and not max_sessions and not check_balance:
+        return None
+    return JobScheduler(
+        rate=rate_limit, max_sessions=max_sessions,
+        balance_refresh_sec=(
+            DEFAULT_BALANCE_REFRESH_SEC if check_balance else None
+        ),
+        order=order
+    )
+
+
+def expand_source(src, pattern):
+    """
+    Expand a directory, a glob pattern or a file into (path, base) pairs.
+    <base> is the directory the path is mirrored from into the destination.
+    """
+    if os.path.isdir(src):
+        for root, _, filenames in os.walk(src):
+            for filename in sorted(fnmatch.filter(filenames, pattern)):
+                yield os.path.join(root, filename), src
+
+    elif glob.has_magic(src):
+        # Mirror the tree below the non-magic prefix of the pattern
+        base = src
+        while glob.has_magic(base):
+            base = os.path.dirname(base)
+        for path in sorted(glob.glob(src, recursive=True)):
+            if os.path.isfile(path):
+                yield path, base
+
+    elif os.path.isfile(src):
+        yield src, os.path.dirname(src)
+
+    else:
+        raise click.BadParameter(f"{src} doesn't exist", param_hint="--src")
+
+
+def read_manifest(manifest):
+    """
+    Read a manifest file (one source path per line, relative paths are
+    relative to the manifest) into (path, base) pairs.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r", encoding="utf-8") as fd:
+        paths = [
+            os.path.join(manifest_dir, line.strip()) for line in fd
+            if line.strip() and not line.strip().startswith("#")
+        ]
+
+    if not paths:
+        return []
+
+    base = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [(path, base) for path in paths]
+
+
+def get_batch_sources(srcs, manifest, pattern, dst):
+    """
+    Build the (src, dst_folder) list of a batch, mirroring every source
+    tree into <dst>.
+    """
+    pairs = []
+    for src in srcs:
+        pairs.extend(expand_source(src, pattern))
+    if manifest:
+        pairs.extend(read_manifest(manifest))
+
+    sources = []
+    seen = set()
+    for path, base in pairs:
+        path = os.path.abspath(path)
+        if path in seen:
+            continue
+        seen.add(path)
+
+        rel_dir = os.path.relpath(os.path.dirname(path), os.path.abspath(base))
+        sources.append((path, os.path.normpath(os.path.join(dst, rel_dir))))
+
+    return sources
+
+
 @click.group(context_settings=dict(help_option_names=["-h", "--help"]))
 @click_creds.use_netrcstore(
     name="insoundzAPI",
@@ -117,8 +253,9 @@ def insoundz_cli(cred_store: click_creds.NetrcStore):
     "--src",
     type=click.Path(
         exists=True, file_okay=True, dir_okay=False,
-        readable=True, resolve_path=True),
-    help="A local path of the original audio file.",
+        readable=True, resolve_path=True, allow_dash=True),
+    help="A local path of the original audio file, or '-' to read it from "
+         "stdin.",
     prompt="src",
     required=True,
 )
@@ -132,31 +269,649 @@ def insoundz_cli(cred_store: click_creds.NetrcStore):
     "--dst",
     type=click.Path(
         exists=False, file_okay=True, dir_okay=True,
-        resolve_path=False),
-    help=f"A local path or file to download the enhanced file. [default: "
+        resolve_path=False, allow_dash=True),
+    help=f"A local path or file to download the enhanced file, or '-' to "
+          "write it to stdout. [default: "
           "<current_path>/<original_filename>_enhanced.<original_suffix>]",
 )
 @click.option("--retention", type=int, help="URL Retention duration [minutes].")
 @click.option(
     "--status-interval",
-    type=float,
-    help="Check the enhancement process every <status-interval> [seconds].",
-    default=AudioEnhancer.get_default_status_interval(),
+    type=str,
+    help="Check the enhancement process every <status-interval> [seconds], "
+         "or select a polling policy ('backoff' or 'adaptive').",
+    default=str(DEFAULT_STATUS_INTERVAL_SEC),
+    callback=get_status_interval,
 )
 @click.option(
     "--no-progress-bar",
     is_flag=True,
     help="If set, progress-bar won't be displayed. ",
 )
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, resolve_path=True),
+    help="Keep the enhanced files in a local cache directory, so identical "
+         "audio isn't enhanced twice.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    help="The maximal size of the cache [MB]. The least recently used files "
+         "are evicted.",
+    default=DEFAULT_CACHE_MAX_SIZE // 1024 // 1024,
+)
+@click.option(
+    "--cache-stats",
+    is_flag=True,
+    help="If set, the cache statistics are displayed at the end.",
+)
+@click.option(
+    "--reuse-retained",
+    is_flag=True,
+    help="If set, audio which was enhanced with --retention is not "
+         "uploaded again while the server retains its result.",
+)
+@click.option(
+    "--journal",
+    is_flag=True,
+    help="If set, the jobs are recorded in a journal "
+         f"({DEFAULT_JOURNAL_PATH}), so they can be finished by the resume "
+         "command if this process dies.",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    help="The number of times a request which failed on a network error or "
+         "a server error is retried.",
+    default=DEFAULT_RETRIES,
+)
+@click.option(
+    "--compress",
+    is_flag=True,
+    help="If set, PCM sources are losslessly compressed (FLAC) before "
+         "they are uploaded, and the results are restored to their "
+         "format. Requires the soundfile package.",
+)
+@click.option(
+    "--segment-sec",
+    type=click.FloatRange(min=0, min_open=True),
+    help="If set, a longer source is cut into segments of about "
+         "<segment-sec> [seconds], which are enhanced in parallel and "
+         "stitched back together. Requires the numpy and soundfile "
+         "packages.",
+)
+@click.option(
+    "--overlap-sec",
+    type=click.FloatRange(min=0),
+    help="The overlap of consecutive segments [seconds], which is "
+         "crossfaded when they are stitched.",
+    default=DEFAULT_OVERLAP_SEC,
+)
+@click.option(
+    "--callback-listen",
+    callback=get_callback_address,
+    help="A HOST:PORT to listen on for the notifications of finished "
+         "sessions (e.g. 0.0.0.0:8090), instead of waiting for their next "
+         "status poll. Sessions are still polled every "
+         f"{DEFAULT_FALLBACK_INTERVAL_SEC} seconds, in case a notification "
+         "is lost.",
+)
+@click.option(
+    "--callback-url",
+    help="The URL the API server reaches the --callback-listen address at, "
+         "e.g. through a proxy.",
+)
 def enhance_file(
     client_id, secret, url,
     src=None, no_download=False,
-    dst=None, retention=None, status_interval=None, no_progress_bar=False
+    dst=None, retention=None, status_interval=None, no_progress_bar=False,
+    cache_dir=None, cache_size=None, cache_stats=False, reuse_retained=False,
+    journal=False, retries=DEFAULT_RETRIES, compress=False,
+    segment_sec=None, overlap_sec=DEFAULT_OVERLAP_SEC, callback_listen=None,
+    callback_url=None
 ):
-    enhancer = AudioEnhancer(client_id, secret, url)
-    enhancer.enhance_file(
-        src=src, no_download=no_download, dst=dst, retention=retention,
-        status_interval_sec=status_interval, progress_bar=(not no_progress_bar)
+    from insoundz_api.enhancer import AudioEnhancer
+
+    if segment_sec and (src == "-" or dst == "-" or no_download):
+        raise click.UsageError(
+            "--segment-sec requires a local --src and --dst, and can't be "
+            "combined with --no-download."
+        )
+
+    sink = None
+    log_stream = None
+    if dst == "-":
+        # Keep stdout clean for the enhanced audio
+        sink = click.get_binary_stream("stdout")
+        log_stream = sys.stderr
+        dst = None
+        no_progress_bar = True
+
+    enhancer = AudioEnhancer(
+        client_id, secret, url, token_cache=True, log_stream=log_stream,
+        cache=get_result_cache(cache_dir, cache_size),
+        retained_index=reuse_retained or None, journal=journal or None,
+        retry_policy=retries, compress=compress or None,
+        callback=get_callback(callback_listen, callback_url)
+    )
+    if src == "-":
+        enhancer.enhance_stream(
+            click.get_binary_stream("stdin"), no_download=no_download,
+            dst=dst, retention=retention, status_interval_sec=status_interval,
+            progress_bar=(not no_progress_bar), sink=sink
+        )
+    elif segment_sec:
+        enhancer.enhance_segmented(
+            src=src, dst=dst, retention=retention, segment_sec=segment_sec,
+            overlap_sec=overlap_sec, status_interval_sec=status_interval,
+            progress_bar=(not no_progress_bar)
+        )
+    else:
+        enhancer.enhance_file(
+            src=src, no_download=no_download, dst=dst, retention=retention,
+            status_interval_sec=status_interval,
+            progress_bar=(not no_progress_bar), sink=sink
+        )
+
+    if cache_stats and enhancer.cache:
+        click.echo(f"Cache: {enhancer.cache.stats()}", err=sink is not None)
+
+
+@click.command(
+    "enhance-batch",
+    help="Enhance all the audio files of directories, glob patterns "
+         "or a manifest file",
+    context_settings={"show_default": True}
+)
+@click.option(
+    "--client-id",
+    type=str,
+    help="Client ID for insoundz API services. "
+         "If not set, the CLI uses the permanently configured client ID. "
+         "If set, the CLI will use this client ID only for this session.",
+    callback=get_client_id,
+)
+@click.option(
+    "--secret",
+    type=str,
+    help="Secret key to access insoundz API services. "
+         "If not set, the CLI uses the permanently configured secret key. "
+         "If set, the CLI will use this secret key only for this session.",
+    callback=get_secret,
+)
+@click.option(
+    "--url",
+    type=str,
+    help="Use an alternative endpoint URL (without the 'http://' prefix). "
+         "If not set, the CLI uses the permanently configured url. "
+         "If set, the CLI will use this url only for this session. "
+         "If not set and not permanently configured, "
+         "the CLI will use the default url. "
+         f"[default: {insoundzAPI.get_default_endpoint_url()}]",
+    callback=get_url,
+)
+@click.option(
+    "--src",
+    type=str,
+    multiple=True,
+    help="A directory, a glob pattern or a local path of an original "
+         "audio file. Can be set multiple times.",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False,
+        readable=True, resolve_path=True),
+    help="A file that lists a source path per line.",
+)
+@click.option(
+    "--pattern",
+    type=str,
+    help="Only enhance the files of <src> directories that match "
+         "this pattern.",
+    default="*",
+)
+@click.option(
+    "--no-download",
+    is_flag=True,
+    help="If set, the enhanced files won't be downloaded to the local "
+         "machine (we'll get only the URLs of the enhanced files).",
+)
+@click.option(
+    "--dst",
+    type=click.Path(
+        exists=False, file_okay=False, dir_okay=True,
+        resolve_path=True),
+    help="A local directory to download the enhanced files to. "
+         "The directory tree of the sources is mirrored under it. "
+         "[default: <current_path>]",
+)
+@click.option("--retention", type=int, help="URL Retention duration [minutes].")
+@click.option(
+    "--status-interval",
+    type=str,
+    help="Check the enhancement process every <status-interval> [seconds], "
+         "or select a polling policy ('backoff' or 'adaptive').",
+    default=str(DEFAULT_STATUS_INTERVAL_SEC),
+    callback=get_status_interval,
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="The number of concurrent uploads and downloads.",
+    default=DEFAULT_BATCH_WORKERS,
+)
+@click.option(
+    "--no-progress-bar",
+    is_flag=True,
+    help="If set, progress-bar won't be displayed. ",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, resolve_path=True),
+    help="Keep the enhanced files in a local cache directory, so identical "
+         "audio isn't enhanced twice.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    help="The maximal size of the cache [MB]. The least recently used files "
+         "are evicted.",
+    default=DEFAULT_CACHE_MAX_SIZE // 1024 // 1024,
+)
+@click.option(
+    "--cache-stats",
+    is_flag=True,
+    help="If set, the cache statistics are displayed at the end.",
+)
+@click.option(
+    "--journal",
+    is_flag=True,
+    help="If set, the jobs are recorded in a journal "
+         f"({DEFAULT_JOURNAL_PATH}), so they can be finished by the resume "
+         "command if this process dies.",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    help="The number of times a request which failed on a network error or "
+         "a server error is retried.",
+    default=DEFAULT_RETRIES,
+)
+@click.option(
+    "--compress",
+    is_flag=True,
+    help="If set, PCM sources are losslessly compressed (FLAC) before "
+         "they are uploaded, and the results are restored to their "
+         "format. Requires the soundfile package.",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(min=0, min_open=True),
+    help="The maximal number of sessions started per second. "
+         "Jobs over it wait locally instead of being throttled.",
+)
+@click.option(
+    "--max-sessions",
+    type=click.IntRange(min=1),
+    help="The maximal number of concurrent sessions. "
+         "Jobs over it wait locally until a session is finished.",
+)
+@click.option(
+    "--check-balance",
+    is_flag=True,
+    help="If set, a job is only started if the balance covers its cost "
+         "(one credit per minute of audio) on top of the jobs in flight; "
+         "otherwise it fails before its upload.",
+)
+@click.option(
+    "--order",
+    type=click.Choice(ORDERS),
+    default=ORDER_FIFO,
+    help="The order in which the waiting files are started: as they are "
+         "found (fifo), or the shortest audio first (sjf), which lowers "
+         "the average time until a file is done.",
+)
+@click.option(
+    "--callback-listen",
+    callback=get_callback_address,
+    help="A HOST:PORT to listen on for the notifications of finished "
+         "sessions (e.g. 0.0.0.0:8090), instead of waiting for their next "
+         "status poll. Sessions are still polled every "
+         f"{DEFAULT_FALLBACK_INTERVAL_SEC} seconds, in case a notification "
+         "is lost.",
+)
+@click.option(
+    "--callback-url",
+    help="The URL the API server reaches the --callback-listen address at, "
+         "e.g. through a proxy.",
+)
+def enhance_batch(
+    client_id, secret, url, src=(), manifest=None, pattern="*",
+    no_download=False, dst=None, retention=None, status_interval=None,
+    jobs=DEFAULT_BATCH_WORKERS, no_progress_bar=False, cache_dir=None,
+    cache_size=None, cache_stats=False, journal=False,
+    retries=DEFAULT_RETRIES, compress=False, rate_limit=None,
+    max_sessions=None, check_balance=False, order=ORDER_FIFO,
+    callback_listen=None, callback_url=None
+):
+    from insoundz_api.enhancer import AudioEnhancer
+    from insoundz_api.download import DEFAULT_DOWNLOAD_WORKERS
+
+    if not src and not manifest:
+        raise click.UsageError("Either --src or --manifest must be set.")
+
+    sources = get_batch_sources(src, manifest, pattern, dst or os.getcwd())
+    if not sources:
+        click.echo("No source files were found.")
+        return
+
+    # Every job may upload or download over several connections at once
+    enhancer = AudioEnhancer(
+        client_id, secret, url,
+        pool_maxsize=jobs * (DEFAULT_DOWNLOAD_WORKERS + 1) + 1,
+        token_cache=True, cache=get_result_cache(cache_dir, cache_size),
+        journal=journal or None, retry_policy=retries,
+        compress=compress or None,
+        scheduler=get_scheduler(
+            rate_limit, max_sessions, check_balance, order
+        ),
+        callback=get_callback(callback_listen, callback_url)
+    )
+    with enhancer:
+        batch = enhancer.enhance_many(
+            sources, no_download=no_download, retention=retention,
+            max_workers=jobs, status_interval_sec=status_interval,
+            progress_bar=not no_progress_bar, order=order
+        )
+        failures = [result for result in batch if not result.ok]
+
+    stats = batch.stats
+    click.echo(
+        f"Enhanced {stats.files - stats.failures}/{stats.files} files in "
+        f"{stats.elapsed:.1f} sec "
+        f"({stats.files_per_sec:.2f} files/s, "
+        f"{stats.bytes_per_sec / 1024 / 1024:.2f} MB/s, "
+        f"{stats.polls} status polls)"
+    )
+    if cache_stats and enhancer.cache:
+        click.echo(f"Cache: {enhancer.cache.stats()}")
+    if enhancer.scheduler:
+        click.echo(f"Scheduler: {enhancer.scheduler.stats}")
+    for result in failures:
+        click.echo(f"Failed: {result.src} ({result.error})")
+
+
+@click.command(
+    "resume",
+    help="Finish the jobs of the journal which were interrupted",
+    context_settings={"show_default": True}
+)
+@click.option(
+    "--client-id",
+    type=str,
+    help="Client ID for insoundz API services. "
+         "If not set, the CLI uses the permanently configured client ID. "
+         "If set, the CLI will use this client ID only for this session.",
+    callback=get_client_id,
+)
+@click.option(
+    "--secret",
+    type=str,
+    help="Secret key to access insoundz API services. "
+         "If not set, the CLI uses the permanently configured secret key. "
+         "If set, the CLI will use this secret key only for this session.",
+    callback=get_secret,
+)
+@click.option(
+    "--url",
+    type=str,
+    help="Use an alternative endpoint URL (without the 'http://' prefix). "
+         "If not set, the CLI uses the permanently configured url. "
+         "If set, the CLI will use this url only for this session. "
+         "If not set and not permanently configured, "
+         "the CLI will use the default url. "
+         f"[default: {insoundzAPI.get_default_endpoint_url()}]",
+    callback=get_url,
+)
+@click.option(
+    "--status-interval",
+    type=str,
+    help="Check the enhancement process every <status-interval> [seconds], "
+         "or select a polling policy ('backoff' or 'adaptive').",
+    default=str(DEFAULT_STATUS_INTERVAL_SEC),
+    callback=get_status_interval,
+)
+@click.option(
+    "--no-progress-bar",
+    is_flag=True,
+    help="If set, progress-bar won't be displayed. ",
+)
+def resume(
+    client_id, secret, url, status_interval=None, no_progress_bar=False
+):
+    from insoundz_api.enhancer import AudioEnhancer
+
+    enhancer = AudioEnhancer(
+        client_id, secret, url, token_cache=True, journal=True
+    )
+    with enhancer:
+        results = enhancer.resume(
+            status_interval_sec=status_interval,
+            progress_bar=not no_progress_bar
+        )
+
+    done = sum(1 for _, status, _ in results if status == "done")
+    click.echo(f"Resumed {len(results)} job(s), {done} done")
+
+
+@click.command(
+    "watch",
+    help="Watch a directory, and enhance every audio file that is written "
+         "into it until interrupted",
+    context_settings={"show_default": True}
+)
+@click.option(
+    "--client-id",
+    type=str,
+    help="Client ID for insoundz API services. "
+         "If not set, the CLI uses the permanently configured client ID. "
+         "If set, the CLI will use this client ID only for this session.",
+    callback=get_client_id,
+)
+@click.option(
+    "--secret",
+    type=str,
+    help="Secret key to access insoundz API services. "
+         "If not set, the CLI uses the permanently configured secret key. "
+         "If set, the CLI will use this secret key only for this session.",
+    callback=get_secret,
+)
+@click.option(
+    "--url",
+    type=str,
+    help="Use an alternative endpoint URL (without the 'http://' prefix). "
+         "If not set, the CLI uses the permanently configured url. "
+         "If set, the CLI will use this url only for this session. "
+         "If not set and not permanently configured, "
+         "the CLI will use the default url. "
+         f"[default: {insoundzAPI.get_default_endpoint_url()}]",
+    callback=get_url,
+)
+@click.option(
+    "--src",
+    type=click.Path(
+        exists=True, file_okay=False, dir_okay=True,
+        resolve_path=True),
+    required=True,
+    help="The directory to watch. Its sub-directories are watched too.",
+)
+@click.option(
+    "--dst",
+    type=click.Path(
+        exists=False, file_okay=False, dir_okay=True,
+        resolve_path=True),
+    required=True,
+    help="A local directory to download the enhanced files to. "
+         "The directory tree of <src> is mirrored under it.",
+)
+@click.option(
+    "--pattern",
+    type=str,
+    help="Only enhance the files that match this pattern.",
+    default="*",
+)
+@click.option(
+    "--settle-sec",
+    type=click.FloatRange(min=0),
+    help="Enhance a file once it wasn't modified for <settle-sec> "
+         "[seconds].",
+    default=DEFAULT_SETTLE_SEC,
+)
+@click.option(
+    "--scan-interval",
+    type=click.FloatRange(min=0.1),
+    help="Scan the directory every <scan-interval> [seconds] when file "
+         "system events aren't available (the watchdog package isn't "
+         "installed).",
+    default=DEFAULT_SCAN_INTERVAL_SEC,
+)
+@click.option("--retention", type=int, help="URL Retention duration [minutes].")
+@click.option(
+    "--status-interval",
+    type=str,
+    help="Check the enhancement process every <status-interval> [seconds], "
+         "or select a polling policy ('backoff' or 'adaptive').",
+    default=str(DEFAULT_STATUS_INTERVAL_SEC),
+    callback=get_status_interval,
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="The number of concurrent uploads and downloads.",
+    default=DEFAULT_BATCH_WORKERS,
+)
+@click.option(
+    "--journal",
+    is_flag=True,
+    help="If set, the jobs are recorded in a journal "
+         f"({DEFAULT_JOURNAL_PATH}), so they can be finished by the resume "
+         "command if this process dies.",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    help="The number of times a request which failed on a network error or "
+         "a server error is retried.",
+    default=DEFAULT_RETRIES,
+)
+@click.option(
+    "--compress",
+    is_flag=True,
+    help="If set, PCM sources are losslessly compressed (FLAC) before "
+         "they are uploaded, and the results are restored to their "
+         "format. Requires the soundfile package.",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(min=0, min_open=True),
+    help="The maximal number of sessions started per second. "
+         "Jobs over it wait locally instead of being throttled.",
+)
+@click.option(
+    "--max-sessions",
+    type=click.IntRange(min=1),
+    help="The maximal number of concurrent sessions. "
+         "Jobs over it wait locally until a session is finished.",
+)
+@click.option(
+    "--check-balance",
+    is_flag=True,
+    help="If set, a job is only started if the balance covers its cost "
+         "(one credit per minute of audio) on top of the jobs in flight; "
+         "otherwise it fails before its upload.",
+)
+@click.option(
+    "--order",
+    type=click.Choice(ORDERS),
+    default=ORDER_FIFO,
+    help="The order in which the waiting files are started: as they are "
+         "found (fifo), or the shortest audio first (sjf), which lowers "
+         "the average time until a file is done.",
+)
+@click.option(
+    "--callback-listen",
+    callback=get_callback_address,
+    help="A HOST:PORT to listen on for the notifications of finished "
+         "sessions (e.g. 0.0.0.0:8090), instead of waiting for their next "
+         "status poll. Sessions are still polled every "
+         f"{DEFAULT_FALLBACK_INTERVAL_SEC} seconds, in case a notification "
+         "is lost.",
+)
+@click.option(
+    "--callback-url",
+    help="The URL the API server reaches the --callback-listen address at, "
+         "e.g. through a proxy.",
+)
+def watch(
+    client_id, secret, url, src, dst, pattern="*",
+    settle_sec=DEFAULT_SETTLE_SEC, scan_interval=DEFAULT_SCAN_INTERVAL_SEC,
+    retention=None, status_interval=None, jobs=DEFAULT_BATCH_WORKERS,
+    journal=False, retries=DEFAULT_RETRIES, compress=False,
+    rate_limit=None, max_sessions=None, check_balance=False,
+    order=ORDER_FIFO, callback_listen=None, callback_url=None
+):
+    from insoundz_api.enhancer import AudioEnhancer
+    from insoundz_api.download import DEFAULT_DOWNLOAD_WORKERS
+    from insoundz_api.watch import FolderWatcher
+
+    watcher = FolderWatcher(
+        src, dst, pattern=pattern, settle_sec=settle_sec,
+        scan_interval_sec=scan_interval
+    )
+
+    # The first signal drains the jobs in flight, a second one aborts them
+    def stop(signum, frame):
+        if watcher.stopped:
+            raise KeyboardInterrupt
+        click.echo(
+            "Stopping after the jobs in flight (interrupt again to abort)"
+        )
+        watcher.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # A single long-lived enhancer keeps its token and connections warm
+    # between the files
+    enhancer = AudioEnhancer(
+        client_id, secret, url,
+        pool_maxsize=jobs * (DEFAULT_DOWNLOAD_WORKERS + 1) + 1,
+        token_cache=True, journal=journal or None, retry_policy=retries,
+        compress=compress or None,
+        scheduler=get_scheduler(
+            rate_limit, max_sessions, check_balance, order
+        ),
+        callback=get_callback(callback_listen, callback_url)
+    )
+    click.echo(f"Watching {src} (press Ctrl+C to stop)")
+    with enhancer:
+        batch = enhancer.enhance_many(
+            watcher, retention=retention, max_workers=jobs,
+            status_interval_sec=status_interval, progress_bar=False,
+            order=order
+        )
+        for result in batch:
+            if result.ok:
+                click.echo(f"Enhanced: {result.src}")
+            else:
+                click.echo(f"Failed: {result.src} ({result.error})")
+
+    stats = batch.stats
+    click.echo(
+        f"Enhanced {stats.files - stats.failures}/{stats.files} files in "
+        f"{stats.elapsed:.1f} sec"
     )
 
 
@@ -241,6 +996,9 @@ def enhance_file(
 
 insoundz_cli.add_command(click_creds.config_group)
 insoundz_cli.add_command(enhance_file)
+insoundz_cli.add_command(enhance_batch)
+insoundz_cli.add_command(resume)
+insoundz_cli.add_command(watch)
 # insoundz_cli.add_command(version)
 # insoundz_cli.add_command(balance)
 
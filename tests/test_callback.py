@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+from insoundz_api.callback import CallbackListener
+from insoundz_api.enhancer import AudioEnhancer
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                    "benchmarks")
+)
+from fake_server import FakeInsoundzServer  # noqa: E402
+
+# Long enough that a session which isn't notified can't complete through a
+# status poll within the test
+STATUS_INTERVAL_SEC = 5
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "src.wav"
+    path.write_bytes(os.urandom(100000))
+    return str(path)
+
+
+def _enhance(fake, listener, src, dst):
+    with AudioEnhancer(
+        "client_id", "secret", fake.endpoint_url, scheme="http",
+        callback=listener, log_stream=open(os.devnull, "w")
+    ) as enhancer:
+        return enhancer.enhance_file(
+            src, dst=str(dst), status_interval_sec=STATUS_INTERVAL_SEC
+        )
+
+
+def test_notified_session_completes_without_polls(src, tmp_path):
+    with FakeInsoundzServer(processing_delay_sec=0.2) as fake:
+        with CallbackListener() as listener:
+            result = _enhance(fake, listener, src, tmp_path / "out")
+        stats = fake.stats()
+
+    assert result.status == "done"
+    assert (tmp_path / "out" / "src_enhanced.wav").exists()
+    assert result.timings.polls == 0
+    assert listener.notifications == 1
+    assert stats.get("callback") == 1
+    assert "status" not in stats
+    assert "bulk_status" not in stats
+
+
+def test_lost_notification_completes_through_fallback_poll(src, tmp_path):
+    with FakeInsoundzServer(
+        processing_delay_sec=0.2, callback_loss_rate=1.0
+    ) as fake:
+        with CallbackListener(fallback_interval_sec=0.5) as listener:
+            result = _enhance(fake, listener, src, tmp_path / "out")
+        stats = fake.stats()
+
+    assert result.status == "done"
+    assert (tmp_path / "out" / "src_enhanced.wav").exists()
+    assert result.timings.polls >= 1
+    assert listener.notifications == 0
+    assert stats.get("callback_lost") == 1